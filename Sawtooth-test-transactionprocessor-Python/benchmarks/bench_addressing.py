@@ -0,0 +1,108 @@
+"""
+Measures address derivation of hellotxp_addressing: hashing every name as
+the client and the transaction processor used to, batch_address with a
+cold and a warm LRU cache, and addresses_for over a whole bulk
+transaction. Reports addresses/s.
+
+usage: python benchmarks/bench_addressing.py [--names N] [--repeat N]
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hellotxp_addressing import ADDRESS_CACHE_SIZE
+from hellotxp_addressing import addresses_for
+from hellotxp_addressing import batch_address
+from hellotxp_addressing import batch_prefix
+from hellotxp_addressing import index_address
+from hellotxp_addressing import index_key_prefix
+from hellotxp_codec import GROUP_SEPARATOR
+from hellotxp_codec import INDEX_BATCHNR
+
+
+def make_names(count):
+    # names of a few co-ops, as a bulk submit of their batches sends them
+    return ['coop-{:02d}/batch-{:07d}'.format(i % 20, i) for i in range(count)]
+
+
+def _clear_caches():
+    batch_address.cache_clear()
+    batch_prefix.cache_clear()
+    index_address.cache_clear()
+    index_key_prefix.cache_clear()
+
+
+def _sha512(value):
+    return hashlib.sha512(value.encode('utf-8')).hexdigest()
+
+
+def _uncached(names):
+    # the namespace prefix, group and name hashed on every call
+    return [
+        _sha512('hellotxp')[:6] + '00' +
+        _sha512(name.split(GROUP_SEPARATOR, 1)[0])[:8] + _sha512(name)[:54]
+        for name in names
+    ]
+
+
+def _cold(names):
+    _clear_caches()
+    return [batch_address(name) for name in names]
+
+
+def _warm(names):
+    return [batch_address(name) for name in names]
+
+
+def _bulk(names):
+    return addresses_for(names)
+
+
+def _index(names):
+    return [index_address(INDEX_BATCHNR, '7', name) for name in names]
+
+
+WORKLOADS = [
+    ('uncached', _uncached),
+    ('batch_address cold', _cold),
+    ('batch_address warm', _warm),
+    ('addresses_for warm', _bulk),
+    ('index_address warm', _index),
+]
+
+
+def measure(derive, names, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        derive(names)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(names) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--names', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    names = make_names(args.names)
+    if args.names > ADDRESS_CACHE_SIZE:
+        print("{} names do not fit the cache of {}, warm runs miss".format(
+            args.names, ADDRESS_CACHE_SIZE))
+
+    _clear_caches()
+    print("{:<20} {:>14}".format("workload", "addresses/s"))
+    for name, derive in WORKLOADS:
+        rate = measure(derive, names, args.repeat)
+        print("{:<20} {:>14.0f}".format(name, rate))
+    print(batch_address.cache_info())
+
+
+if __name__ == '__main__':
+    main()
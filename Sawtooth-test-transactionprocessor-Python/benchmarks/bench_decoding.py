@@ -0,0 +1,95 @@
+"""
+Compares the decoders of REST API state listings: the yaml.safe_load the
+client used to parse responses with, when PyYAML is installed, and the
+decoders of hellotxp_json. Reports entries/s and the peak memory of
+iterating over one listing, on top of the response text every decoder
+needs in full.
+
+usage: python benchmarks/bench_decoding.py [--entries N] [--repeat N]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from hellotxp_codec import encode_state
+from hellotxp_json import DECODERS
+
+
+def make_listing(count):
+    data = [
+        {
+            'address': '314d67{:064x}'.format(i),
+            'data': base64.b64encode(encode_state([(
+                'coop-{:07d}'.format(i), i, 100.0, 52.37, 4.89, 'user', 0
+            )])).decode(),
+        }
+        for i in range(count)
+    ]
+    return json.dumps({
+        'data': data,
+        'head': 'f' * 128,
+        'link': 'http://rest-api:8008/state?head={}&start={}&limit={}'.format(
+            'f' * 128, data[0]['address'], count),
+        'paging': {'limit': count, 'start': data[0]['address']},
+    }, indent=2)
+
+
+def _iterators():
+    iterators = {}
+    if yaml is not None:
+        iterators['yaml.safe_load'] = lambda text: iter(yaml.safe_load(text)['data'])
+    for name, decoder_class in sorted(DECODERS.items()):
+        decoder = decoder_class()
+        iterators[name + ' loads'] = \
+            lambda text, decoder=decoder: iter(decoder.loads(text)['data'])
+        iterators[name + ' iter_items'] = \
+            lambda text, decoder=decoder: decoder.iter_items(text, 'data', {})
+    return iterators
+
+
+def measure(iterate, text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = sum(1 for _ in iterate(text))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    for _ in iterate(text):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return count / best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--entries', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    text = make_listing(args.entries)
+    print("{} entries, {} bytes".format(args.entries, len(text)))
+    print("{:<20} {:>12} {:>12}".format("decoder", "entries/s", "peak KiB"))
+    for name, iterate in _iterators().items():
+        # yaml is slow enough that one pass is plenty
+        repeat = 1 if name.startswith('yaml') else args.repeat
+        rate, peak = measure(iterate, text, repeat)
+        print("{:<20} {:>12.0f} {:>12.1f}".format(name, rate, peak / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+Replays synthetic harvest batch workloads through
+HelloTransactionHandler.apply against an in-memory validator context and
+reports transactions/s, p50/p99 latency and allocations per transaction.
+
+Results can be written as JSON with --output and compared with an earlier
+run with --baseline, to catch regressions between commits.
+
+usage: python benchmarks/bench_handler.py [--transactions N] [--latency S]
+           [--workload NAME ...] [--output FILE] [--baseline FILE]
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from mock_context import MockContext
+from mock_context import MockTransaction
+
+from handler import HelloTransactionHandler
+from helloMetrics import Metrics
+from hellotxp_codec import BINARY_FAMILY_VERSION
+from hellotxp_codec import CSV_FAMILY_VERSION
+from hellotxp_codec import encode_payload
+from hellotxp_codec import encode_payloads
+from hellotxp_codec import FIELD_VOLUME
+from hellotxp_codec import NO_LONGITUDE
+
+# Operations per transaction of the multi workload.
+MULTI_SIZE = 10
+
+# Transactions replayed with tracemalloc on, which slows everything down.
+ALLOCATION_SAMPLE = 2000
+
+
+def _record(i):
+    return ('coop-{:07d}'.format(i), 'create', i, 100.0 + i % 1000,
+            52.0 + (i % 997) / 1000.0, 4.0 + (i % 991) / 1000.0,
+            'user-{}'.format(i % 50))
+
+
+def _create(count):
+    return [
+        MockTransaction(encode_payload(*_record(i)), BINARY_FAMILY_VERSION)
+        for i in range(count)
+    ]
+
+
+def _create_csv(count):
+    # the csv payload has a single latlong field instead of the longitude
+    return [
+        MockTransaction(
+            ','.join(str(field) for field in _record(i)[:5] + _record(i)[6:])
+            .encode(),
+            CSV_FAMILY_VERSION)
+        for i in range(count)
+    ]
+
+
+def _lifecycle(count):
+    # create every batch, update its volume and delete it, in that order
+    # per batch
+    transactions = []
+    for i in range(count // 3):
+        name, _, batchnr, volume, latitude, longitude, username = _record(i)
+        for payload in (
+                encode_payload(name, 'create', batchnr, volume, latitude,
+                               longitude, username),
+                encode_payload(name, 'update', 0, volume + 1, NO_LONGITUDE,
+                               NO_LONGITUDE, '', FIELD_VOLUME, 0),
+                encode_payload(name, 'delete', batchnr, volume, latitude,
+                               longitude, username)):
+            transactions.append(
+                MockTransaction(payload, BINARY_FAMILY_VERSION))
+    return transactions
+
+
+def _multi(count):
+    return [
+        MockTransaction(
+            encode_payloads(
+                [_record(i * MULTI_SIZE + j) for j in range(MULTI_SIZE)]),
+            BINARY_FAMILY_VERSION)
+        for i in range(count // MULTI_SIZE)
+    ]
+
+
+def _invalid(count):
+    # every other transaction creates a batch that already exists
+    rng = random.Random(0)
+    transactions = _create(count // 2)
+    transactions.extend(
+        MockTransaction(encode_payload(*_record(rng.randrange(count // 2))),
+                        BINARY_FAMILY_VERSION)
+        for _ in range(count - count // 2))
+    return transactions
+
+
+WORKLOADS = {
+    'create': _create,
+    'create_csv': _create_csv,
+    'lifecycle': _lifecycle,
+    'multi': _multi,
+    'invalid': _invalid,
+}
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def replay(transactions, latency=0.0):
+    """
+    apply every transaction against a fresh MockContext
+    :return: (seconds per transaction in order, context, invalid count)
+    """
+    handler = HelloTransactionHandler(Metrics())
+    context = MockContext(latency=latency)
+    # every transaction gets a context limited to its declared addresses,
+    # as from the validator
+    scoped = [context.for_transaction(t) for t in transactions]
+    durations = []
+    invalid = 0
+    clock = time.perf_counter
+
+    for transaction, transaction_context in zip(transactions, scoped):
+        start = clock()
+        try:
+            handler.apply(transaction, transaction_context)
+        except Exception:
+            invalid += 1
+        durations.append(clock() - start)
+
+    return durations, context, invalid
+
+
+def measure_allocations(transactions):
+    """
+    :return: (bytes allocated per transaction, peak traced bytes)
+    """
+    handler = HelloTransactionHandler(Metrics())
+    context = MockContext()
+    scoped = [context.for_transaction(t) for t in transactions]
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for transaction, transaction_context in zip(transactions, scoped):
+            try:
+                handler.apply(transaction, transaction_context)
+            except Exception:
+                pass
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (after - before) / len(transactions), peak - before
+
+
+def run_workload(name, count, latency):
+    transactions = WORKLOADS[name](count)
+    durations, context, invalid = replay(transactions, latency)
+    total = sum(durations)
+    durations.sort()
+    retained, peak = measure_allocations(
+        WORKLOADS[name](min(count, ALLOCATION_SAMPLE)))
+
+    return {
+        'transactions': len(transactions),
+        'invalid': invalid,
+        'tps': len(transactions) / total,
+        'mean_us': total / len(transactions) * 1e6,
+        'p50_us': _percentile(durations, 0.50) * 1e6,
+        'p99_us': _percentile(durations, 0.99) * 1e6,
+        'retained_bytes_per_txn': retained,
+        'peak_bytes': peak,
+        'state_calls': context.calls,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_results(results, baseline):
+    print("{:<12} {:>8} {:>10} {:>9} {:>9} {:>12} {:>10}".format(
+        "workload", "txns", "txns/s", "p50 us", "p99 us", "bytes/txn",
+        "vs base"))
+    for name, result in results.items():
+        change = ''
+        if baseline and name in baseline:
+            change = '{:+.1%}'.format(result['tps'] / baseline[name]['tps'] - 1)
+        print("{:<12} {:>8} {:>10.0f} {:>9.1f} {:>9.1f} {:>12.0f} {:>10}".format(
+            name, result['transactions'], result['tps'], result['p50_us'],
+            result['p99_us'], result['retained_bytes_per_txn'], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--transactions', type=int, default=20000)
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='simulated seconds per get_state/set_state/delete_state call')
+    parser.add_argument(
+        '--workload', nargs='+', choices=sorted(WORKLOADS),
+        default=sorted(WORKLOADS))
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument(
+        '--baseline', help='JSON file of an earlier run to compare with')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    results = {
+        name: run_workload(name, args.transactions, args.latency)
+        for name in args.workload
+    }
+    _print_results(results, baseline)
+
+    if args.output:
+        report = {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'transactions': args.transactions,
+            'latency': args.latency,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'results': results,
+        }
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        print("Results written to {}".format(args.output), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
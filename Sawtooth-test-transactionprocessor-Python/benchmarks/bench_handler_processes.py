@@ -0,0 +1,94 @@
+"""
+Measures how HelloTransactionHandler.apply throughput scales across
+forked processes, an upper bound for the workers of main.py --workers.
+
+Every process applies its share of independent 'create' transactions
+with HelloTransactionHandler.apply against its own in-memory context, the
+way the validator hands independent transactions to different
+processors. The supervisor of main.py, the SDK's TransactionProcessor
+and validator round trips are not involved, so this shows how far the
+handler itself scales, not the throughput of a deployed processor.
+
+usage: python benchmarks/bench_handler_processes.py [--transactions N] [--processes 1 2 4 ...]
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+from mock_context import MockContext
+from mock_context import MockTransaction
+
+from handler import HelloTransactionHandler
+from hellotxp_codec import BINARY_FAMILY_VERSION
+from hellotxp_codec import encode_payload
+
+
+def make_transactions(count, prefix):
+    return [
+        MockTransaction(
+            encode_payload(
+                '{}-{}'.format(prefix, i), 'create', i, 100.0 + i,
+                52.0 + (i % 997) / 1000.0, 4.0 + (i % 991) / 1000.0,
+                'bench-{}'.format(i % 50)),
+            BINARY_FAMILY_VERSION)
+        for i in range(count)
+    ]
+
+
+def _run_worker(count, prefix, start_event, result_queue):
+    transactions = make_transactions(count, prefix)
+    handler = HelloTransactionHandler()
+    context = MockContext()
+    scoped = [context.for_transaction(t) for t in transactions]
+    start_event.wait()
+
+    start = time.perf_counter()
+    for transaction, transaction_context in zip(transactions, scoped):
+        handler.apply(transaction, transaction_context)
+    result_queue.put(time.perf_counter() - start)
+
+
+def measure(workers, transactions):
+    start_event = multiprocessing.Event()
+    result_queue = multiprocessing.Queue()
+    share = transactions // workers
+    processes = [
+        multiprocessing.Process(
+            target=_run_worker,
+            args=(share, 'w{}'.format(index), start_event, result_queue))
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    # give the workers time to build their transactions
+    time.sleep(0.5)
+    start = time.perf_counter()
+    start_event.set()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    return share * workers / elapsed
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--transactions', type=int, default=20000)
+    parser.add_argument(
+        '--processes', type=int, nargs='+',
+        default=sorted({1, 2, 4, cpus}))
+    args = parser.parse_args()
+
+    print("{:>8} {:>12} {:>8}".format("procs", "txns/s", "speedup"))
+    baseline = None
+    for processes in args.processes:
+        rate = measure(processes, args.transactions)
+        baseline = baseline or rate
+        print("{:>8} {:>12.0f} {:>7.2f}x".format(processes, rate, rate / baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Measures transaction signing throughput of ParallelSigner against the
+number of worker processes.
+
+usage: python benchmarks/bench_signing.py [--headers N] [--workers 1 2 4 ...]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sawtooth_signing import create_context
+from sawtooth_signing import CryptoFactory
+
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+
+from hellotxp_client import SignerIdentity
+from hellotxp_signing import ParallelSigner
+
+
+def make_identity():
+    context = create_context('secp256k1')
+    private_key = context.new_random_private_key()
+    signer = CryptoFactory(context).new_signer(private_key)
+    return SignerIdentity(
+        signer=signer,
+        public_key=signer.get_public_key().as_hex(),
+        private_key=private_key.as_hex())
+
+
+def make_headers(identity, count):
+    return [
+        TransactionHeader(
+            signer_public_key=identity.public_key,
+            family_name="hellotxp",
+            family_version="0.1",
+            inputs=["{:070x}".format(i)],
+            outputs=["{:070x}".format(i)],
+            payload_sha512="{:0128x}".format(i),
+            batcher_public_key=identity.public_key,
+            nonce=str(i)
+        ).SerializeToString()
+        for i in range(count)
+    ]
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--headers', type=int, default=5000)
+    parser.add_argument(
+        '--workers', type=int, nargs='+',
+        default=sorted({1, 2, 4, cpus}))
+    args = parser.parse_args()
+
+    identity = make_identity()
+    headers = make_headers(identity, args.headers)
+
+    print("{:>8} {:>12} {:>8}".format("workers", "sigs/s", "speedup"))
+    baseline = None
+    for workers in args.workers:
+        with ParallelSigner(identity, workers=workers) as signer:
+            # start the pool outside of the measurement
+            signer.sign_all(headers[:signer.workers * 100])
+
+            start = time.perf_counter()
+            signatures = signer.sign_all(headers)
+            elapsed = time.perf_counter() - start
+
+        assert len(signatures) == len(headers)
+        rate = len(headers) / elapsed
+        baseline = baseline or rate
+        print("{:>8} {:>12.0f} {:>7.2f}x".format(workers, rate, rate / baseline))
+
+
+if __name__ == '__main__':
+    main()
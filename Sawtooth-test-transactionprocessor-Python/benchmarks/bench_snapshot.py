@@ -0,0 +1,83 @@
+"""
+Measures snapshots of hellotxp_snapshot: writing a snapshot of synthetic
+state, its size next to the base64 REST API listing of the same entries,
+and the latency of offline show and find against the memory-mapped file.
+
+usage: python benchmarks/bench_snapshot.py [--batches N] [--chunk-size N]
+"""
+import argparse
+import base64
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hellotxp_addressing import batch_address
+from hellotxp_addressing import index_address
+from hellotxp_codec import encode_index
+from hellotxp_codec import encode_state
+from hellotxp_codec import INDEX_BATCHNR
+from hellotxp_snapshot import DEFAULT_CHUNK_SIZE
+from hellotxp_snapshot import SnapshotReader
+from hellotxp_snapshot import SnapshotWriter
+
+
+def make_state(count):
+    # a harvest batch and its batchnr index record per name
+    state = {}
+    for i in range(count):
+        name = 'coop-{:02d}/batch-{:07d}'.format(i % 20, i)
+        batchnr = str(i % 1000)
+        state[batch_address(name)] = encode_state([(
+            name, i % 1000, 100.0, 52.37, 4.89, 'user-{}'.format(i % 50), 0)])
+        state[index_address(INDEX_BATCHNR, batchnr, name)] = \
+            encode_index({batchnr: [name]})
+    return sorted(state.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--batches', type=int, default=100000)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--lookups', type=int, default=10000)
+    args = parser.parse_args()
+
+    entries = make_state(args.batches)
+    listing = sum(
+        len(address) + len(base64.b64encode(data)) for address, data in entries)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'snapshot')
+        start = time.perf_counter()
+        with SnapshotWriter(path, 'f' * 128, args.chunk_size) as writer:
+            for address, data in entries:
+                writer.add(address, data)
+        elapsed = time.perf_counter() - start
+        print("write {:>12.0f} entries/s".format(len(entries) / elapsed))
+        print("size  {:>12} bytes, {:.2f} of the REST API listing".format(
+            os.path.getsize(path), os.path.getsize(path) / listing))
+
+        names = [
+            'coop-{:02d}/batch-{:07d}'.format(i % 20, i)
+            for i in random.sample(range(args.batches),
+                                   min(args.lookups, args.batches))
+        ]
+        with SnapshotReader(path) as snapshot:
+            start = time.perf_counter()
+            for name in names:
+                snapshot.show(name)
+            elapsed = time.perf_counter() - start
+            print("show  {:>12.1f} us".format(elapsed / len(names) * 1e6))
+
+            start = time.perf_counter()
+            for batchnr in range(100):
+                snapshot.find(batchnr=batchnr)
+            elapsed = time.perf_counter() - start
+            print("find  {:>12.1f} us".format(elapsed / 100 * 1e6))
+
+
+if __name__ == '__main__':
+    main()
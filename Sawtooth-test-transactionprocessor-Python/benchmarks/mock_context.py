@@ -0,0 +1,139 @@
+"""
+In-memory stand-ins for the transaction processor SDK's Context and
+transaction objects, for running HelloTransactionHandler.apply without a
+validator.
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'transactionprocessor'))
+
+from sawtooth_sdk.processor.exceptions import AuthorizationException
+
+from hellotxp_addressing import legacy_batch_address
+from hellotxp_addressing import operation_addresses
+from hellotxp_codec import CSV_FAMILY_VERSION
+from hellotxp_codec import decode_payload
+from hellotxp_codec import legacy_layout
+
+
+class MockStateEntry(object):
+    __slots__ = ('address', 'data')
+
+    def __init__(self, address, data):
+        self.address = address
+        self.data = data
+
+
+class MockContext(object):
+    """
+    dict backed replacement for sawtooth_sdk.processor.context.Context.
+    Every call sleeps for latency seconds to stand in for the round trip
+    to the validator, and is counted in calls. Like the validator, a
+    context with inputs and outputs raises AuthorizationException for
+    reads of addresses outside its inputs and writes outside its outputs.
+    """
+
+    def __init__(self, state=None, latency=0.0, inputs=None, outputs=None):
+        """
+        :param inputs: addresses and address prefixes that may be read,
+            None for any
+        :param outputs: addresses and address prefixes that may be
+            written, None for any
+        """
+        self.state = {} if state is None else state
+        self.latency = latency
+        self.inputs = inputs
+        self.outputs = outputs
+        self.calls = {'get_state': 0, 'set_state': 0, 'delete_state': 0}
+
+    def for_transaction(self, transaction):
+        """
+        :return: a context on the same state and call counters, limited
+            to the inputs and outputs the transaction's header declares
+        """
+        context = MockContext(
+            self.state, self.latency, transaction.header.inputs,
+            transaction.header.outputs)
+        context.calls = self.calls
+        return context
+
+    def _round_trip(self, method):
+        self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _authorize(addresses, declared, kind):
+        if declared is None:
+            return
+        for address in addresses:
+            if not address.startswith(tuple(declared)):
+                raise AuthorizationException(
+                    'Tried to {} unauthorized address {}'.format(kind, address))
+
+    def get_state(self, addresses, timeout=None):
+        self._round_trip('get_state')
+        self._authorize(addresses, self.inputs, 'get')
+        state = self.state
+        return [
+            MockStateEntry(address, state[address])
+            for address in addresses if state.get(address)
+        ]
+
+    def set_state(self, entries, timeout=None):
+        self._round_trip('set_state')
+        self._authorize(entries, self.outputs, 'set')
+        self.state.update(entries)
+        return list(entries)
+
+    def delete_state(self, addresses, timeout=None):
+        self._round_trip('delete_state')
+        self._authorize(addresses, self.outputs, 'delete')
+        for address in addresses:
+            self.state.pop(address, None)
+        return list(addresses)
+
+
+class MockHeader(object):
+    __slots__ = ('signer_public_key', 'family_version', 'inputs', 'outputs')
+
+    def __init__(self, signer_public_key, family_version, inputs, outputs):
+        self.signer_public_key = signer_public_key
+        self.family_version = family_version
+        self.inputs = inputs
+        self.outputs = outputs
+
+
+class MockTransaction(object):
+    __slots__ = ('header', 'payload')
+
+    def __init__(self, payload, family_version, signer_public_key='02' + '00' * 32,
+                 addresses=None):
+        """
+        :param addresses: the inputs and outputs of the header, by default
+            those hellotxpClient declares for the payload
+        """
+        if addresses is None:
+            addresses = declared_addresses(payload, family_version)
+        self.header = MockHeader(
+            signer_public_key, family_version, addresses, addresses)
+        self.payload = payload
+
+
+def declared_addresses(payload, family_version):
+    """
+    :return: sorted list of the addresses a client declares as inputs and
+        outputs of a transaction with payload
+    """
+    if family_version == CSV_FAMILY_VERSION:
+        # csv clients declare the legacy address of the batch only
+        return [legacy_batch_address(payload.decode().split(',')[0])]
+    legacy = legacy_layout(payload, family_version)
+    addresses = set()
+    for operation in decode_payload(payload):
+        addresses.update(operation_addresses(operation, legacy))
+    return sorted(addresses)
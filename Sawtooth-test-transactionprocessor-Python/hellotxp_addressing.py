@@ -0,0 +1,251 @@
+"""
+Addresses of the hellotxp namespace, shared by the client and the
+transaction processor.
+
+Addresses are 70 hex characters: NAMESPACE_PREFIX, the first 6
+characters of the sha512 of the family name, then two characters telling
+harvest batches (hellotxp_codec.BATCH_KIND) and the index kinds
+(hellotxp_codec.INDEX_KINDS) apart. Every harvest batch and every index
+record of a batch is a leaf at an address of its own, so transactions on
+different batches never share an address and the scheduler can run them
+in parallel:
+
+  00 <group 8>  <name 54>  harvest batch: sha512 of its co-op group (see
+                           hellotxp_codec.GROUP_SEPARATOR) and of its name
+  01 <key 30>   <name 32>  batchnr index: sha512 of the batchnr and name
+  02 <key 30>   <name 32>  user index: sha512 of the username and name
+  03 <cell 10>  <name 52>  location index: the cell (see hellotxp_geo)
+                           unhashed, so enclosing cells are prefixes,
+                           and sha512 of the name
+
+The leaves of one key, cell or co-op are read by listing their prefix.
+
+Transactions of family version 0.1 and binary payloads before payload
+format 5 (see hellotxp_codec.legacy_layout) keep the legacy layout they
+were written with, so existing chains replay to the same state:
+
+  <name 64>                harvest batch: sha512 of its name
+  01 <key 62>              batchnr index of all batches with the batchnr
+  02 <key 62>              user index of all batches of the username
+  03 <cell 62>             location index of all batches in the cell, the
+                           cell unhashed and padded with zeros
+
+Legacy harvest batch entries can fall under any kind prefix, the first
+byte of the data tells them apart from index entries (see
+hellotxp_codec.is_index_entry). Listings read the kinds that hold
+harvest batches only, see batch_prefixes; the legacy batches under an
+index kind, about 3 in 256, are read by name. Legacy index entries start
+with the index_key_prefix of their key, so listing that prefix reads both
+layouts.
+Creates also declare the address of their batch in the other layout, so
+the transaction processor can refuse names taken there. Creates of csv
+and older clients declared only their own address; replaying them cannot
+check the other layout, so a name created that way may be held in both
+layouts. Clients then read the leaf layout first.
+
+The prefixes are computed once, on import. Bulk submits and the
+transaction processor derive the addresses of the same names over and
+over, so the addresses of the last ADDRESS_CACHE_SIZE names, keys and
+index records are kept in LRU caches instead of hashing them again.
+"""
+import functools
+import hashlib
+
+from hellotxp_codec import BATCH_KIND
+from hellotxp_codec import FIELD_BATCHNR
+from hellotxp_codec import FIELD_LOCATION
+from hellotxp_codec import FIELD_OWNER
+from hellotxp_codec import GROUP_SEPARATOR
+from hellotxp_codec import INDEX_BATCHNR
+from hellotxp_codec import INDEX_KINDS
+from hellotxp_codec import INDEX_LOCATION
+from hellotxp_codec import INDEX_USER
+from hellotxp_codec import INDEXED_FIELDS
+from hellotxp_geo import cell_key
+from hellotxp_geo import valid_position
+
+FAMILY_NAME = 'hellotxp'
+
+# Entries per LRU cache; an entry takes about 250 bytes.
+ADDRESS_CACHE_SIZE = 1 << 16
+
+
+def _sha512(value):
+    return hashlib.sha512(value.encode('utf-8')).hexdigest()
+
+
+NAMESPACE_PREFIX = _sha512(FAMILY_NAME)[:6]
+BATCH_PREFIX = NAMESPACE_PREFIX + BATCH_KIND
+INDEX_PREFIXES = {
+    kind: NAMESPACE_PREFIX + code for kind, code in INDEX_KINDS.items()
+}
+# The two character kinds that no harvest batch or index record of the
+# leaf layout uses, so only legacy harvest batches fall under them.
+LEGACY_BATCH_PREFIXES = tuple(
+    NAMESPACE_PREFIX + code
+    for code in map('{:02x}'.format, range(256))
+    if code != BATCH_KIND and code not in INDEX_KINDS.values()
+)
+
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def batch_prefix(group=None):
+    """
+    :param group: co-op group, None for the prefix of all harvest batches
+    :return: address prefix of the harvest batches of group
+    """
+    if group is None:
+        return BATCH_PREFIX
+    return BATCH_PREFIX + _sha512(group)[:8]
+
+
+def batch_prefixes(group=None):
+    """
+    :param group: co-op group, None for all harvest batches
+    :return: sorted list of the address prefixes to list for the harvest
+        batches of group. Without a group these are BATCH_PREFIX and
+        LEGACY_BATCH_PREFIXES; legacy batches under an index kind prefix
+        sit between index records and are left out.
+    """
+    if group is None:
+        return [BATCH_PREFIX] + list(LEGACY_BATCH_PREFIXES)
+    return [batch_prefix(group)]
+
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def batch_address(name):
+    """
+    :return: address of the harvest batch name
+    """
+    return batch_prefix(name.split(GROUP_SEPARATOR, 1)[0]) + _sha512(name)[:54]
+
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def legacy_batch_address(name):
+    """
+    :return: address of the harvest batch name in the legacy layout
+    """
+    return NAMESPACE_PREFIX + _sha512(name)[:64]
+
+
+def addresses_for(names):
+    """
+    addresses of many harvest batches, e.g. the operations of a bulk
+    transaction
+    :return: list of addresses, in the order of names
+    """
+    return list(map(batch_address, names))
+
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def index_key_prefix(kind, key):
+    """
+    :param kind: hellotxp_codec.INDEX_BATCHNR, INDEX_USER or INDEX_LOCATION
+    :param key: the batchnr or username as a string, or a location cell
+        or cell prefix
+    :return: address prefix of the index records of key
+    """
+    if kind == INDEX_LOCATION:
+        return INDEX_PREFIXES[kind] + key
+    return INDEX_PREFIXES[kind] + _sha512(key)[:30]
+
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def index_address(kind, key, name):
+    """
+    :return: address of the index record of key for the harvest batch name
+    """
+    length = 52 if kind == INDEX_LOCATION else 32
+    return index_key_prefix(kind, key) + _sha512(name)[:length]
+
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def legacy_index_address(kind, key):
+    """
+    :return: address of the index entry of key in the legacy layout, which
+        holds the records of every harvest batch with that key
+    """
+    if kind == INDEX_LOCATION:
+        return INDEX_PREFIXES[kind] + key.ljust(62, '0')
+    return INDEX_PREFIXES[kind] + _sha512(key)[:62]
+
+
+def index_keys(batchnr, latitude, longitude, owner, fields=INDEXED_FIELDS):
+    """
+    :param fields: FIELD_* bits of the indexed fields to look at
+    :return: list of the (index kind, key) a harvest batch with these
+        values is indexed under
+    """
+    keys = []
+    if fields & FIELD_BATCHNR:
+        keys.append((INDEX_BATCHNR, str(batchnr)))
+    if fields & FIELD_OWNER and owner:
+        keys.append((INDEX_USER, owner))
+    if fields & FIELD_LOCATION and valid_position(latitude, longitude):
+        keys.append((INDEX_LOCATION, cell_key(latitude, longitude)))
+    return keys
+
+
+def index_addresses(operation):
+    """
+    the index addresses an operation reads and writes, besides the address
+    of its harvest batch: the index records the transaction processor
+    keeps for it. Deletes and updates of indexed fields also change the
+    records of the stored values they replace. Without those values, as
+    in payloads before payload format 5, they get the whole prefix of the
+    index kind instead.
+    :param operation: (name, action, batchnr, volume, latitude, longitude,
+        username), with (fields, expected_revision, stored) for updates
+        and (0, NO_REVISION, stored) for deletes, see
+        hellotxp_codec.encode_payloads
+    :return: list of addresses and index kind prefixes
+    """
+    name, action, batchnr, _, latitude, longitude, username = operation[:7]
+    fields = operation[7] if len(operation) > 7 else 0
+    stored = operation[9] if len(operation) > 9 else None
+    if action == 'create':
+        keys = index_keys(batchnr, latitude, longitude, username)
+    elif action == 'delete':
+        if stored is None:
+            return [INDEX_PREFIXES[INDEX_BATCHNR], INDEX_PREFIXES[INDEX_USER],
+                    INDEX_PREFIXES[INDEX_LOCATION]]
+        keys = index_keys(*stored)
+    elif action == 'update':
+        fields &= INDEXED_FIELDS
+        if stored is None:
+            return [
+                INDEX_PREFIXES[kind] for kind, field in (
+                    (INDEX_BATCHNR, FIELD_BATCHNR), (INDEX_USER, FIELD_OWNER),
+                    (INDEX_LOCATION, FIELD_LOCATION))
+                if fields & field
+            ]
+        keys = index_keys(*stored, fields=fields) + index_keys(
+            batchnr, latitude, longitude, username, fields)
+    else:
+        return []
+    # an update keeping a value changes the same record twice
+    return list(dict.fromkeys(
+        index_address(kind, key, name) for kind, key in keys))
+
+
+def operation_addresses(operation, legacy=False):
+    """
+    :param legacy: the operation's transaction uses the legacy layout
+    :return: list of the addresses and index kind prefixes an operation
+        reads and writes, see index_addresses. A create also declares the
+        address of its batch in the other layout.
+    """
+    name, action, batchnr, _, latitude, longitude, username = operation[:7]
+    if not legacy:
+        addresses = [batch_address(name)] + index_addresses(operation)
+        if action == 'create':
+            addresses.append(legacy_batch_address(name))
+        return addresses
+
+    # legacy deletes and updates carry no stored values
+    if action != 'create':
+        return [legacy_batch_address(name)] + index_addresses(operation[:9])
+    return [legacy_batch_address(name)] + [
+        legacy_index_address(kind, key)
+        for kind, key in index_keys(batchnr, latitude, longitude, username)
+    ] + [batch_address(name)]
@@ -0,0 +1,579 @@
+import asyncio
+import base64
+import concurrent.futures
+import functools
+import json
+import logging
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+
+from hellotxp_addressing import batch_address
+from hellotxp_addressing import batch_prefixes
+from hellotxp_addressing import index_key_prefix
+from hellotxp_addressing import INDEX_PREFIXES
+from hellotxp_addressing import legacy_batch_address
+from hellotxp_client import hellotxpClient
+from hellotxp_client import DEFAULT_PAGE_SIZE
+from hellotxp_client import DEFAULT_TIMEOUT
+from hellotxp_client import MAX_PAGE_SIZE
+from hellotxp_client import MAX_TRANSACTIONS_PER_BATCH
+from hellotxp_client import MAX_BATCHES_PER_BATCH_LIST
+from hellotxp_client import MAX_WAIT
+from hellotxp_codec import INDEX_LOCATION
+from hellotxp_codec import NO_REVISION
+from hellotxp_common import add_located
+from hellotxp_common import collect_results
+from hellotxp_common import expand_results
+from hellotxp_common import group_records
+from hellotxp_common import index_lookup
+from hellotxp_common import index_names
+from hellotxp_common import list_queries
+from hellotxp_common import location_queries
+from hellotxp_common import make_headers
+from hellotxp_common import make_url
+from hellotxp_common import near_boxes
+from hellotxp_common import near_results
+from hellotxp_common import planned_results
+from hellotxp_common import resolve_operations
+from hellotxp_common import stored_names
+from hellotxp_common import stored_values
+from hellotxp_common import update_operation
+from hellotxp_exceptions import HellotxpException
+from hellotxp_planner import plan_operations
+
+LOGGER = logging.getLogger(__name__)
+
+# Number of requests the client keeps in flight at once.
+DEFAULT_CONCURRENCY = 16
+
+# Batch ids sent per batch_statuses request. Ids are 128 hex characters, so
+# this keeps request bodies small while still covering whole BatchLists.
+STATUS_IDS_PER_REQUEST = 500
+
+
+class AsyncHellotxpClient:
+    """
+    asyncio counterpart of hellotxpClient. Transactions are built and signed
+    by a hellotxpClient on a thread of its own, so signing does not block
+    the event loop; requests go through one aiohttp session with at most
+    `concurrency` requests in flight.
+    """
+
+    def __init__(self, base_url, keyfile=None, concurrency=DEFAULT_CONCURRENCY,
+                 timeout=DEFAULT_TIMEOUT, signing_workers=1, decoder=None):
+        if aiohttp is None:
+            raise HellotxpException(
+                'AsyncHellotxpClient requires the aiohttp package')
+
+        self._base_url = base_url
+        self._txn_client = hellotxpClient(
+            base_url, keyfile=keyfile, signing_workers=signing_workers,
+            decoder=decoder)
+        self._decoder = self._txn_client.decoder
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._semaphore = None
+        self._session = None
+        # one thread, so the hellotxpClient and its signer pool are used
+        # by one caller at a time
+        self._signing_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self._signing_executor.shutdown()
+        self._txn_client.close()
+
+    async def create(self, name, batchnr, volume, latitude, longitude, username,
+                     wait=None, auth_user=None, auth_password=None):
+        return await self._send_hellotxp_txn(
+            name, "create", batchnr, volume, latitude, longitude, username,
+            wait=wait,
+            auth_user=auth_user,
+            auth_password=auth_password)
+
+    async def delete(self, name, username, wait=None, auth_user=None,
+                     auth_password=None):
+        """
+        delete a harvest batch, see hellotxpClient.delete
+        """
+        [operation], [legacy] = await self._resolve_operations(
+            [(name, "delete", 0, 0.0, 0.0, 0.0, username)],
+            auth_user, auth_password)
+        return await self._send_hellotxp_txn(
+            *operation[:7],
+            wait=wait,
+            auth_user=auth_user,
+            auth_password=auth_password,
+            stored=operation[9] if len(operation) > 9 else None,
+            legacy=legacy)
+
+    async def update(self, name, batchnr=None, volume=None, latitude=None,
+                     longitude=None, owner=None, expected_revision=None,
+                     wait=None, auth_user=None, auth_password=None):
+        """
+        change the given fields of a harvest batch, see hellotxpClient.update
+        """
+        [operation], [legacy] = await self._resolve_operations(
+            [update_operation(
+                name, batchnr, volume, latitude, longitude, owner,
+                expected_revision)],
+            auth_user, auth_password)
+        return await self._send_hellotxp_txn(
+            *operation[:7],
+            wait=wait,
+            auth_user=auth_user,
+            auth_password=auth_password,
+            fields=operation[7],
+            expected_revision=operation[8],
+            stored=operation[9] if len(operation) > 9 else None,
+            legacy=legacy)
+
+    async def list(self, auth_user=None, auth_password=None,
+                   page_size=DEFAULT_PAGE_SIZE, start=None, limit=None,
+                   group=None):
+        """
+        iterate over the harvest batch state entries, see hellotxpClient.list
+        :return: async generator of state entry bytes
+        """
+        async for _, data in self.list_entries(
+                auth_user=auth_user,
+                auth_password=auth_password,
+                page_size=page_size,
+                start=start,
+                limit=limit,
+                group=group):
+            yield data
+
+    async def list_entries(self, auth_user=None, auth_password=None,
+                           page_size=DEFAULT_PAGE_SIZE, start=None,
+                           limit=None, group=None):
+        """
+        iterate over the harvest batch state entries with their addresses,
+        see hellotxpClient.list_entries
+        :return: async generator of (address, state entry bytes)
+        """
+        if limit is not None and limit <= 0:
+            return
+
+        count = 0
+        for prefix, prefix_start in list_queries(batch_prefixes(group), start):
+            async for entry in self._iter_state(
+                    prefix, auth_user, auth_password,
+                    page_size=page_size, start=prefix_start):
+                yield entry
+                count += 1
+                if count == limit:
+                    return
+
+    async def show(self, name, auth_user=None, auth_password=None):
+        """
+        :return: the state entry bytes holding the harvest batch name, see
+            hellotxpClient.show
+        """
+        return (await self._read_batch(name, auth_user, auth_password))[1]
+
+    async def _read_batch(self, name, auth_user=None, auth_password=None):
+        """
+        :return: (True for the legacy layout, state entry bytes), see
+            hellotxpClient._read_batch
+        """
+        for legacy, address in ((False, batch_address(name)),
+                                (True, legacy_batch_address(name))):
+            entries = await self._get_state_entries(
+                address, auth_user, auth_password)
+            if entries:
+                return legacy, entries[0][1]
+        raise HellotxpException("No such batch: {}".format(name))
+
+    async def find(self, batchnr=None, username=None, auth_user=None,
+                   auth_password=None):
+        """
+        look up harvest batches by batchnr or username, see
+        hellotxpClient.find
+        :return: sorted list of harvest batch names, empty if none match
+        """
+        kind, key = index_lookup(batchnr, username)
+        names = set()
+        async for _, data in self._iter_state(
+                index_key_prefix(kind, key), auth_user, auth_password):
+            names.update(index_names(data, key))
+        return sorted(names)
+
+    async def within(self, min_lat, min_lon, max_lat, max_lon, auth_user=None,
+                     auth_password=None):
+        """
+        find the harvest batches located in a bounding box, see
+        hellotxpClient.within
+        :return: list of (name, latitude, longitude), sorted by name
+        """
+        box = (min_lat, min_lon, max_lat, max_lon)
+        located = await self._find_located([box], auth_user, auth_password)
+        return sorted(
+            (name, latitude, longitude)
+            for name, (latitude, longitude) in located.items())
+
+    async def near(self, latitude, longitude, radius_km, auth_user=None,
+                   auth_password=None):
+        """
+        find the harvest batches within radius_km of a location, see
+        hellotxpClient.near
+        :return: list of (distance_km, name, latitude, longitude), nearest
+            first
+        """
+        boxes = near_boxes(latitude, longitude, radius_km)
+        located = await self._find_located(boxes, auth_user, auth_password)
+        return near_results(latitude, longitude, radius_km, located)
+
+    async def _find_located(self, boxes, auth_user, auth_password):
+        queries = location_queries(boxes)
+        prefix = INDEX_PREFIXES[INDEX_LOCATION]
+        cells = await asyncio.gather(*[
+            self._get_state_entries(prefix + cell, auth_user, auth_password)
+            for _, cell in queries
+        ])
+
+        located = {}
+        for (box, _), entries in zip(queries, cells):
+            for _, data in entries:
+                add_located(box, data, located)
+        return located
+
+    async def _resolve_operations(self, operations, auth_user, auth_password):
+        """
+        read the batches whose layout and stored values operations need,
+        concurrently, see hellotxp_common.resolve_operations
+        """
+        operations = list(operations)
+        names = stored_names(operations)
+        entries = await asyncio.gather(*[
+            self._read_batch(name, auth_user, auth_password) for name in names
+        ])
+        return resolve_operations(
+            operations,
+            {name: stored_values(data, name)
+             for name, (_, data) in zip(names, entries)},
+            [name for name, (legacy, _) in zip(names, entries) if legacy])
+
+    async def _get_state_entries(self, address, auth_user=None,
+                                 auth_password=None):
+        return [
+            entry async for entry
+            in self._iter_state(address, auth_user, auth_password)
+        ]
+
+    async def _iter_state(self, address, auth_user=None, auth_password=None,
+                          page_size=DEFAULT_PAGE_SIZE, start=None):
+        """
+        read every state entry under an address prefix, following the REST
+        API's paging one page per request
+        :return: async generator of (address, state entry bytes)
+        """
+        if not 1 <= page_size <= MAX_PAGE_SIZE:
+            raise HellotxpException(
+                'page_size must be between 1 and {}'.format(MAX_PAGE_SIZE))
+
+        suffix = "state?address={}&limit={}".format(address, page_size)
+        if start is not None:
+            suffix += "&start={}".format(start)
+        while True:
+            result = await self._send_request(
+                suffix,
+                auth_user=auth_user,
+                auth_password=auth_password)
+            # entries are decoded one at a time as they are consumed
+            fields = {}
+            try:
+                for entry in self._decoder.iter_items(result, "data", fields):
+                    yield entry["address"], base64.b64decode(entry["data"])
+                next_position = fields.get("paging", {}).get("next_position")
+            except (KeyError, TypeError, ValueError) as err:
+                raise HellotxpException(err)
+
+            if not next_position:
+                return
+            suffix = "state?address={}&limit={}&start={}".format(
+                address, page_size, next_position)
+
+    async def create_many(self, records, wait=None, auth_user=None,
+                          auth_password=None,
+                          batch_size=MAX_TRANSACTIONS_PER_BATCH,
+                          batches_per_list=MAX_BATCHES_PER_BATCH_LIST,
+                          records_per_transaction=1):
+        """
+        create a harvest batch for every record, see hellotxpClient.create_many
+        :param records: iterable of
+            (name, batchnr, volume, latitude, longitude, username)
+        :return: one status dict per record, in the order of records
+        """
+        groups = group_records(records, "create", records_per_transaction)
+        transactions = await self._sign(
+            self._txn_client.create_transactions, groups)
+
+        results = await self.submit_many(
+            transactions,
+            wait=wait,
+            auth_user=auth_user,
+            auth_password=auth_password,
+            batch_size=batch_size,
+            batches_per_list=batches_per_list)
+
+        return expand_results(groups, results)
+
+    async def submit_many(self, transactions, wait=None, auth_user=None,
+                          auth_password=None,
+                          batch_size=MAX_TRANSACTIONS_PER_BATCH,
+                          batches_per_list=MAX_BATCHES_PER_BATCH_LIST):
+        """
+        pack signed transactions into BatchLists and post them concurrently,
+        then report the commit status of every transaction
+        :param transactions: list of signed Transactions
+        :return: one status dict per transaction, in the order given
+        """
+        if batches_per_list < 1:
+            raise HellotxpException('batches_per_list must be positive')
+
+        batches = await self._sign(
+            self._txn_client.create_batches, transactions, batch_size)
+        failed = await self._post_batches(
+            batches, auth_user, auth_password, batches_per_list)
+
+        statuses = await self.wait_for_batches(
+            [b.header_signature for b in batches if b.header_signature not in failed],
+            wait,
+            auth_user=auth_user,
+            auth_password=auth_password)
+
+        return collect_results(batches, statuses, failed)
+
+    async def submit_planned(self, operations, wait=None, auth_user=None,
+                             auth_password=None,
+                             batch_size=MAX_TRANSACTIONS_PER_BATCH,
+                             batches_per_list=MAX_BATCHES_PER_BATCH_LIST):
+        """
+        submit operations that may touch the same harvest batches in one
+        go, see hellotxpClient.submit_planned. The BatchLists of a wave are
+        posted concurrently, the waves one after the other, so batches
+        reach the validator after the batches they depend on.
+        :return: one status dict per operation, in the order of operations
+        """
+        if batches_per_list < 1:
+            raise HellotxpException('batches_per_list must be positive')
+
+        plan = plan_operations(*await self._resolve_operations(
+            operations, auth_user, auth_password))
+        transactions, waves = await self._sign(
+            self._txn_client.create_planned_batches, plan, batch_size)
+
+        failed = {}
+        for batches in waves:
+            failed.update(await self._post_batches(
+                batches, auth_user, auth_password, batches_per_list))
+
+        batches = [batch for batches in waves for batch in batches]
+        statuses = await self.wait_for_batches(
+            [b.header_signature for b in batches if b.header_signature not in failed],
+            wait,
+            auth_user=auth_user,
+            auth_password=auth_password)
+
+        return planned_results(
+            plan, transactions, collect_results(batches, statuses, failed))
+
+    async def _post_batches(self, batches, auth_user, auth_password,
+                            batches_per_list):
+        """
+        post Batches in BatchLists of batches_per_list, concurrently
+        :return: dict of batch id to the error that kept it from being
+            submitted
+        """
+        chunks = [
+            batches[i:i + batches_per_list]
+            for i in range(0, len(batches), batches_per_list)
+        ]
+
+        errors = await asyncio.gather(*[
+            self._submit_chunk(chunk, auth_user, auth_password)
+            for chunk in chunks
+        ])
+
+        failed = {}
+        for chunk, error in zip(chunks, errors):
+            if error is not None:
+                for batch in chunk:
+                    failed[batch.header_signature] = error
+        return failed
+
+    async def wait_for_batches(self, batch_ids, wait=None, auth_user=None,
+                               auth_password=None):
+        """
+        poll the status of many batches, STATUS_IDS_PER_REQUEST ids per
+        batch_statuses request, until none is PENDING or wait seconds
+        have passed
+        :return: dict of batch id to its status entry
+        """
+        statuses = {}
+        pending = list(batch_ids)
+        start_time = time.time()
+
+        while pending:
+            remaining = 0
+            if wait and wait > 0:
+                remaining = max(0, int(wait - (time.time() - start_time)))
+                # a request waits MAX_WAIT at most, the loop polls again
+                remaining = min(remaining, MAX_WAIT)
+
+            pages = await asyncio.gather(*[
+                self._get_statuses(
+                    pending[i:i + STATUS_IDS_PER_REQUEST], remaining,
+                    auth_user, auth_password)
+                for i in range(0, len(pending), STATUS_IDS_PER_REQUEST)
+            ])
+            for page in pages:
+                for entry in page:
+                    statuses[entry['id']] = entry
+
+            pending = [
+                batch_id for batch_id in pending
+                if statuses.get(batch_id, {}).get('status') == 'PENDING'
+            ]
+            if not remaining:
+                break
+
+        return statuses
+
+    async def _get_statuses(self, batch_ids, wait, auth_user, auth_password):
+        suffix = 'batch_statuses'
+        if wait:
+            suffix = 'batch_statuses?wait={}'.format(wait)
+
+        result = await self._send_request(
+            suffix, json.dumps(batch_ids).encode(),
+            'application/json',
+            wait=wait,
+            auth_user=auth_user,
+            auth_password=auth_password)
+        try:
+            return self._decoder.loads(result)['data']
+        except BaseException as err:
+            raise HellotxpException(err)
+
+    async def _submit_chunk(self, batches, auth_user, auth_password):
+        batch_list = BatchList(batches=batches)
+        try:
+            await self._send_request(
+                "batches", batch_list.SerializeToString(),
+                'application/octet-stream',
+                auth_user=auth_user,
+                auth_password=auth_password)
+        except HellotxpException as err:
+            LOGGER.warning('Failed to submit %d batches: %s', len(batches), err)
+            return str(err)
+        return None
+
+    async def _send_hellotxp_txn(self, name, action, batchnr, volume, latitude,
+                                 longitude, username, wait=None, auth_user=None,
+                                 auth_password=None, fields=0,
+                                 expected_revision=NO_REVISION, stored=None,
+                                 legacy=False):
+        transaction = await self._sign(
+            self._txn_client.create_transaction,
+            name, action, batchnr, volume, latitude, longitude, username,
+            fields, expected_revision, stored, legacy)
+        batch_list = await self._sign(
+            self._txn_client.create_batch_list, [transaction])
+
+        response = await self._send_request(
+            "batches", batch_list.SerializeToString(),
+            'application/octet-stream',
+            auth_user=auth_user,
+            auth_password=auth_password)
+
+        if wait and wait > 0:
+            await self.wait_for_batches(
+                [batch_list.batches[0].header_signature], wait,
+                auth_user=auth_user,
+                auth_password=auth_password)
+
+        return response
+
+    async def _sign(self, create, *args):
+        """
+        run a transaction or batch builder of the hellotxpClient, which
+        signs, on the signing thread
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._signing_executor, functools.partial(create, *args))
+
+    def _get_session(self):
+        # aiohttp sessions and semaphores belong to the running event loop,
+        # so they are created on first use rather than in __init__
+        if self._session is None:
+            connect_timeout, read_timeout = self._timeout
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._concurrency),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=connect_timeout, sock_read=read_timeout))
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        return self._session
+
+    async def _send_request(self,
+                            suffix,
+                            data=None,
+                            content_type=None,
+                            name=None,
+                            auth_user=None,
+                            auth_password=None,
+                            wait=None):
+        url = make_url(self._base_url, suffix)
+        headers = make_headers(content_type, auth_user, auth_password)
+        session = self._get_session()
+
+        options = {'headers': headers}
+        if wait:
+            connect_timeout, read_timeout = self._timeout
+            options['timeout'] = aiohttp.ClientTimeout(
+                sock_connect=connect_timeout,
+                sock_read=read_timeout + min(wait, MAX_WAIT))
+
+        async with self._semaphore:
+            try:
+                if data is not None:
+                    request = session.post(url, data=data, **options)
+                else:
+                    request = session.get(url, **options)
+
+                async with request as result:
+                    if result.status == 404:
+                        raise HellotxpException(
+                            "No such batch: {}".format(name))
+
+                    elif result.status >= 400:
+                        raise HellotxpException("Error {}: {}".format(
+                            result.status, result.reason))
+
+                    return await result.text()
+
+            except aiohttp.ClientConnectionError as err:
+                raise HellotxpException(
+                    'Failed to connect to {}: {}'.format(url, str(err)))
+
+            except (HellotxpException, asyncio.CancelledError):
+                raise
+
+            except BaseException as err:
+                raise HellotxpException(err)
@@ -0,0 +1,162 @@
+"""
+On-disk read-through cache of REST API state responses.
+
+Entries are keyed by the state request they answer and the block head id
+the request was pinned to, in an sqlite database read through mmap. Only
+entries of the current head are served: when the chain moves on to a new
+head every entry of the old one is dropped. Entries are evicted least
+recently used first once they take more than max_bytes.
+
+The head itself is kept in the database with the time it was checked, so
+separate processes polling the same names share it and do not ask the
+REST API for the head more than once per head_ttl seconds.
+"""
+import os
+import sqlite3
+import time
+
+from hellotxp_exceptions import HellotxpException
+
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+DEFAULT_HEAD_TTL = 2.0
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS entries ('
+    ' request TEXT PRIMARY KEY,'
+    ' head TEXT NOT NULL,'
+    ' response TEXT NOT NULL,'
+    ' size INTEGER NOT NULL,'
+    ' used REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS entries_used ON entries (used)',
+    'CREATE TABLE IF NOT EXISTS head ('
+    ' id INTEGER PRIMARY KEY CHECK (id = 0),'
+    ' head TEXT NOT NULL,'
+    ' checked REAL NOT NULL)',
+)
+
+
+class StateCache(object):
+    def __init__(self, path, max_bytes=DEFAULT_CACHE_SIZE,
+                 head_ttl=DEFAULT_HEAD_TTL):
+        """
+        :param path: database file, created if missing
+        :param max_bytes: size of the cached responses kept at most
+        :param head_ttl: seconds a checked head is trusted before asking
+            the REST API again
+        """
+        self.max_bytes = max_bytes
+        self.head_ttl = head_ttl
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # autocommit; writes are single statements or explicit BEGINs
+            self._db = sqlite3.connect(
+                path, timeout=5.0, isolation_level=None,
+                check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('PRAGMA mmap_size={}'.format(
+                max(max_bytes * 2, 1 << 20)))
+            for statement in _SCHEMA:
+                self._db.execute(statement)
+        except (OSError, sqlite3.Error) as err:
+            raise HellotxpException(
+                'Cannot open state cache {}: {}'.format(path, err))
+
+    def close(self):
+        self._db.close()
+
+    def head(self):
+        """
+        :return: the cached head id, or None if it is unknown or was
+            checked more than head_ttl seconds ago
+        """
+        row = self._db.execute(
+            'SELECT head, checked FROM head WHERE id = 0').fetchone()
+        if row is None or time.time() - row[1] > self.head_ttl:
+            return None
+        return row[0]
+
+    def set_head(self, head):
+        """
+        record the current head, dropping the entries of any other head
+        """
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._db.execute(
+                'INSERT OR REPLACE INTO head (id, head, checked) '
+                'VALUES (0, ?, ?)', (head, time.time()))
+            self._db.execute('DELETE FROM entries WHERE head != ?', (head,))
+            self._db.execute('COMMIT')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+
+    def expire_head(self):
+        """
+        make the next read check the head again, e.g. after submitting
+        batches that may change state
+        """
+        self._db.execute('UPDATE head SET checked = 0 WHERE id = 0')
+
+    def get(self, request, head):
+        """
+        :return: the cached response to request at head, or None
+        """
+        row = self._db.execute(
+            'SELECT response FROM entries WHERE request = ? AND head = ?',
+            (request, head)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._db.execute(
+            'UPDATE entries SET used = ? WHERE request = ?',
+            (time.time(), request))
+        return row[0]
+
+    def put(self, request, head, response):
+        size = len(request) + len(response)
+        if size > self.max_bytes:
+            return
+
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries '
+                '(request, head, response, size, used) VALUES (?, ?, ?, ?, ?)',
+                (request, head, response, size, time.time()))
+            self._evict()
+            self._db.execute('COMMIT')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+
+    def stats(self):
+        """
+        :return: dict with hits and misses of this process, and the
+            entries and bytes in the cache
+        """
+        entries, size = self._db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': entries, 'bytes': size}
+
+    def _evict(self):
+        total = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = []
+        for request, size in self._db.execute(
+                'SELECT request, size FROM entries ORDER BY used'):
+            evicted.append((request,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self._db.executemany('DELETE FROM entries WHERE request = ?', evicted)
@@ -1,21 +1,39 @@
 from __future__ import print_function
 
 import argparse
+import csv
 import getpass
+import json
 import logging
 import os
 import traceback
 import sys
+import shlex
 import pkg_resources
 
 from colorlog import ColoredFormatter
 
 from hellotxp_client import hellotxpClient
+from hellotxp_client import load_identity
+from hellotxp_client import MAX_TRANSACTIONS_PER_BATCH
+from hellotxp_client import MAX_BATCHES_PER_BATCH_LIST
+from hellotxp_client import DEFAULT_PAGE_SIZE
+from hellotxp_cache import DEFAULT_HEAD_TTL
+from hellotxp_cache import StateCache
+from hellotxp_codec import CodecError
+from hellotxp_codec import decode_state
 from hellotxp_exceptions import HellotxpException
+from hellotxp_snapshot import DEFAULT_CHUNK_SIZE
+from hellotxp_snapshot import export_snapshot
+from hellotxp_snapshot import SnapshotReader
 
 DISTRIBUTION_NAME = 'sawtooth-hellotxp'
 DEFAULT_URL = 'http://127.0.0.1:8008'
 
+# Clients built by _get_client, reused by every command run in the same
+# process (see the shell subcommand).
+_CLIENTS = {}
+
 def create_console_handler(verbose_level):
     clog = logging.StreamHandler()
     formatter = ColoredFormatter(
@@ -74,9 +92,15 @@ def add_create_parser(subparsers, parent_parser):
     )
 
     parser.add_argument(
-        'latlong',
+        'latitude',
+        type=float,
+        help='latitude of the batch location, in degrees'
+    )
+
+    parser.add_argument(
+        'longitude',
         type=float,
-        help='location of batch at certain point'
+        help='longitude of the batch location, in degrees'
     )
 
    # parser.add_argument(
@@ -128,6 +152,99 @@ def add_create_parser(subparsers, parent_parser):
         type=int,
         help='set time, in seconds, to wait for game to commit')
 
+    parser.add_argument(
+        '--events-url',
+        type=str,
+        help='wait for commits on events from this validator endpoint, '
+             'e.g. tcp://localhost:4004, instead of polling the REST API')
+
+def add_bulk_create_parser(subparsers, parent_parser):
+    parser = subparsers.add_parser(
+        'bulk-create',
+        help='Creates many harvestbatches from a CSV or JSONL file',
+        description='Sends transactions to create a harvestbatch for every '
+        'record in <file>, packed into as few batches as possible. CSV files '
+        'need a header row; both formats use the fields name, batchnr, '
+        'volume, latitude, longitude and optionally username.',
+        parents=[parent_parser])
+
+    parser.add_argument(
+        'file',
+        type=str,
+        help='CSV or JSONL file with one harvestbatch per record')
+
+    parser.add_argument(
+        '--format',
+        choices=['csv', 'jsonl'],
+        help='format of <file>, guessed from its extension if omitted')
+
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=MAX_TRANSACTIONS_PER_BATCH,
+        help='maximum number of transactions per batch. A batch commits '
+             'atomically, so one invalid record fails its whole batch')
+
+    parser.add_argument(
+        '--batches-per-list',
+        type=int,
+        default=MAX_BATCHES_PER_BATCH_LIST,
+        help='maximum number of batches sent per request')
+
+    parser.add_argument(
+        '--records-per-transaction',
+        type=int,
+        default=1,
+        help='number of records created by one transaction; the records of '
+             'a transaction commit or fail together')
+
+    parser.add_argument(
+        '--signing-workers',
+        type=int,
+        default=1,
+        help='number of processes signing transactions, 0 for one per CPU')
+
+    parser.add_argument(
+        '--username',
+        type=str,
+        help="identify name of user's private key file, also used for "
+             "records without a username")
+
+    parser.add_argument(
+        '--url',
+        type=str,
+        help='specify URL of REST API')
+
+    parser.add_argument(
+        '--key-dir',
+        type=str,
+        help="identify directory of user's private key file")
+
+    parser.add_argument(
+        '--auth-user',
+        type=str,
+        help='specify username for authentication if REST API '
+             'is using Basic Auth')
+
+    parser.add_argument(
+        '--auth-password',
+        type=str,
+        help='specify password for authentication if REST API '
+             'is using Basic Auth')
+
+    parser.add_argument(
+        '--wait',
+        nargs='?',
+        const=sys.maxsize,
+        type=int,
+        help='set time, in seconds, to wait for the batches to commit')
+
+    parser.add_argument(
+        '--events-url',
+        type=str,
+        help='wait for commits on events from this validator endpoint, '
+             'e.g. tcp://localhost:4004, instead of polling the REST API')
+
 def add_delete_parser(subparsers, parent_parser):
     parser = subparsers.add_parser('delete', parents=[parent_parser])
 
@@ -170,6 +287,12 @@ def add_delete_parser(subparsers, parent_parser):
         type=int,
         help='set time, in seconds, to wait for delete transaction to commit')
 
+    parser.add_argument(
+        '--events-url',
+        type=str,
+        help='wait for commits on events from this validator endpoint, '
+             'e.g. tcp://localhost:4004, instead of polling the REST API')
+
 def add_list_parser(subparsers, parent_parser):
     parser = subparsers.add_parser(
         'list',
@@ -180,6 +303,30 @@ def add_list_parser(subparsers, parent_parser):
 
     )
 
+    parser.add_argument(
+        '--limit',
+        type=int,
+        help='show at most this many state entries, then print the --start '
+             'position that continues the listing')
+
+    parser.add_argument(
+        '--start',
+        type=str,
+        help='continue a listing from the position printed by --limit')
+
+    parser.add_argument(
+        '--page-size',
+        type=int,
+        default=DEFAULT_PAGE_SIZE,
+        help='state entries fetched per request (default: %(default)s)')
+
+    parser.add_argument(
+        '--coop',
+        type=str,
+        help='only list the harvest batches of a co-op, named <coop>/<batch>')
+
+    _add_cache_arguments(parser)
+
     parser.add_argument(
         '--url',
         type=str,
@@ -207,6 +354,51 @@ def add_list_parser(subparsers, parent_parser):
         help='specify password for authentication if REST API '
              'is using Basic Auth')
 
+def add_export_parser(subparsers, parent_parser):
+    parser = subparsers.add_parser(
+        'export',
+        help='writes all harvest batches to a snapshot file',
+        description='Writes every hellotxp state entry at the current chain '
+        'head to the compressed snapshot <file>, which show and find can '
+        'read offline with --snapshot',
+        parents=[parent_parser])
+
+    parser.add_argument(
+        'file',
+        type=str,
+        help='snapshot file to write')
+
+    parser.add_argument(
+        '--page-size',
+        type=int,
+        default=DEFAULT_PAGE_SIZE,
+        help='state entries fetched per request (default: %(default)s)')
+
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help='bytes of state entries compressed together; smaller chunks '
+        'make offline reads faster and the file larger (default: '
+        '%(default)s)')
+
+    parser.add_argument(
+        '--url',
+        type=str,
+        help='specify URL of REST API')
+
+    parser.add_argument(
+        '--auth-user',
+        type=str,
+        help='specify username for authentication if REST API '
+        'is using Basic Auth')
+
+    parser.add_argument(
+        '--auth-password',
+        type=str,
+        help='specify password for authentication if REST API '
+        'is using Basic Auth')
+
 def add_show_parser(subparsers, parent_parser):
     parser = subparsers.add_parser(
         'show',
@@ -220,6 +412,9 @@ def add_show_parser(subparsers, parent_parser):
         type=str,
         help='identifier for the harvestbatch')
 
+    _add_cache_arguments(parser)
+    _add_snapshot_argument(parser)
+
     parser.add_argument(
         '--url',
         type=str,
@@ -247,11 +442,128 @@ def add_show_parser(subparsers, parent_parser):
         help='specify password for authentication if REST API '
         'is using Basic Auth')
 
+def add_find_parser(subparsers, parent_parser):
+    parser = subparsers.add_parser(
+        'find',
+        help='Finds harvest batches by batchnr or user',
+        description='Displays the names of the harvest batches with batch '
+        'number <batchnr>, or created by <user>, reading the index '
+        'records of that value from state. Batches created with family '
+        'version 0.1 (csv) payloads are not indexed and never found; use '
+        'show or list for them.',
+        parents=[parent_parser])
+
+    lookup = parser.add_mutually_exclusive_group(required=True)
+
+    lookup.add_argument(
+        '--batchnr',
+        type=int,
+        help='batch number to look up')
+
+    lookup.add_argument(
+        '--user',
+        type=str,
+        help='username that created the harvest batches')
+
+    _add_snapshot_argument(parser)
+
+    parser.add_argument(
+        '--url',
+        type=str,
+        help='specify URL of REST API')
+
+    parser.add_argument(
+        '--auth-user',
+        type=str,
+        help='specify username for authentication if REST API '
+        'is using Basic Auth')
+
+    parser.add_argument(
+        '--auth-password',
+        type=str,
+        help='specify password for authentication if REST API '
+        'is using Basic Auth')
+
+def add_near_parser(subparsers, parent_parser):
+    parser = subparsers.add_parser(
+        'near',
+        help='Finds harvest batches near a location',
+        description='Displays the harvest batches within <radius> km of '
+        '<latitude> <longitude>, nearest first, reading only the location '
+        'index cells around it',
+        parents=[parent_parser])
+
+    parser.add_argument('latitude', type=float, help='latitude in degrees')
+    parser.add_argument('longitude', type=float, help='longitude in degrees')
+    parser.add_argument('radius', type=float, help='radius in km')
+
+    _add_query_arguments(parser)
+
+def add_within_parser(subparsers, parent_parser):
+    parser = subparsers.add_parser(
+        'within',
+        help='Finds harvest batches in a bounding box',
+        description='Displays the harvest batches located in the bounding '
+        'box from <min-lat> <min-lon> to <max-lat> <max-lon>, reading only '
+        'the location index cells covering it',
+        parents=[parent_parser])
+
+    parser.add_argument(
+        'bbox',
+        type=float,
+        nargs=4,
+        metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'),
+        help='corners of the bounding box in degrees')
+
+    _add_query_arguments(parser)
+
+def _add_query_arguments(parser):
+    parser.add_argument(
+        '--url',
+        type=str,
+        help='specify URL of REST API')
+
+    parser.add_argument(
+        '--auth-user',
+        type=str,
+        help='specify username for authentication if REST API '
+        'is using Basic Auth')
+
+    parser.add_argument(
+        '--auth-password',
+        type=str,
+        help='specify password for authentication if REST API '
+        'is using Basic Auth')
+
+def _add_cache_arguments(parser):
+    parser.add_argument(
+        '--cache',
+        type=str,
+        metavar='FILE',
+        help='answer repeated reads from this on-disk cache while the '
+        'chain head is unchanged')
+
+    parser.add_argument(
+        '--cache-ttl',
+        type=float,
+        default=DEFAULT_HEAD_TTL,
+        help='seconds to trust the cached chain head before checking it '
+        'again (default: %(default)s)')
+
+def _add_snapshot_argument(parser):
+    parser.add_argument(
+        '--snapshot',
+        type=str,
+        metavar='FILE',
+        help='read from a snapshot file written by export instead of the '
+        'REST API')
+
 def add_update_parser(subparsers, parent_parser):
     parser = subparsers.add_parser(
         'update',
-        help='sends a transaction to change values of a previous batch (batchnr in test)',
-        description='Sends a hellotxp transaction to set <batchnr> to a new value',
+        help='sends a transaction to change values of a previous batch',
+        description='Sends a hellotxp transaction changing only the given '
+        'fields of the harvest batch <name>, in a single state write',
         parents=[parent_parser]
     )
 
@@ -260,6 +572,47 @@ def add_update_parser(subparsers, parent_parser):
         type=str,
         help='name to be updated')
 
+    parser.add_argument(
+        '--batchnr',
+        type=int,
+        help='new batch number')
+
+    parser.add_argument(
+        '--volume',
+        type=float,
+        help='new volume')
+
+    parser.add_argument(
+        '--location',
+        type=float,
+        nargs=2,
+        metavar=('LATITUDE', 'LONGITUDE'),
+        help='new location in degrees')
+
+    parser.add_argument(
+        '--owner',
+        type=str,
+        help='new owner')
+
+    parser.add_argument(
+        '--expected-revision',
+        type=int,
+        help='only update if the batch is still at this revision, as '
+        'printed by show')
+
+    parser.add_argument(
+        '--wait',
+        nargs='?',
+        const=sys.maxsize,
+        type=int,
+        help='set time, in seconds, to wait for the update to commit')
+
+    parser.add_argument(
+        '--events-url',
+        type=str,
+        help='wait for commits on events from this validator endpoint, '
+             'e.g. tcp://localhost:4004, instead of polling the REST API')
+
     parser.add_argument(
         '--url',
         type=str,
@@ -288,6 +641,17 @@ def add_update_parser(subparsers, parent_parser):
              'is using Basic Auth')
 
 
+def add_shell_parser(subparsers, parent_parser):
+    subparsers.add_parser(
+        'shell',
+        help='Runs hellotxp commands read from stdin',
+        description='Reads one hellotxp command per line from stdin and runs '
+        'it in this process, so private keys are loaded and connections '
+        'opened once for the whole session. Empty lines and lines starting '
+        'with # are skipped; "exit" or end of input stops the shell.',
+        parents=[parent_parser])
+
+
 def create_parent_parser(prog_name):
     parent_parser = argparse.ArgumentParser(prog=prog_name, add_help=False)
     parent_parser.add_argument(
@@ -322,10 +686,16 @@ def create_parser(prog_name):
     subparsers.required = True
 
     add_create_parser(subparsers, parent_parser)
+    add_bulk_create_parser(subparsers, parent_parser)
     add_list_parser(subparsers, parent_parser)
+    add_export_parser(subparsers, parent_parser)
     add_show_parser(subparsers, parent_parser)
+    add_find_parser(subparsers, parent_parser)
+    add_near_parser(subparsers, parent_parser)
+    add_within_parser(subparsers, parent_parser)
     add_update_parser(subparsers, parent_parser)
     add_delete_parser(subparsers, parent_parser)
+    add_shell_parser(subparsers, parent_parser)
 
     return parser
 
@@ -334,38 +704,105 @@ def do_create(args):
     name = args.name
     batchnr = args.batchnr
     volume = args.volume
-    username = args.username
-    latlong = args.latlong
-
-    print(args)
+    username = getpass.getuser() if args.username is None else args.username
+    latitude = args.latitude
+    longitude = args.longitude
 
     url = _get_url(args)
     keyfile = _get_keyfile(args)
     auth_user, auth_password = _get_auth_info(args)
 
-    client = hellotxpClient(base_url=url, keyfile=keyfile)
+    client = _get_client(url, keyfile, events_url=args.events_url)
 
     if args.wait and args.wait > 0:
         response = client.create(
-            name,batchnr,volume,latlong,username, wait=args.wait,
+            name,batchnr,volume,latitude,longitude,username, wait=args.wait,
             auth_user=auth_user,
             auth_password=auth_password)
     else:
         response = client.create(
-            name, batchnr, volume,latlong, username, auth_user=auth_user,
+            name, batchnr, volume,latitude, longitude, username, auth_user=auth_user,
             auth_password=auth_password)
 
     print("Response: {}".format(response))
 
+def do_bulk_create(args):
+    username = getpass.getuser() if args.username is None else args.username
+    records = _read_records(args.file, args.format, username)
+
+    url = _get_url(args)
+    keyfile = _get_keyfile(args)
+    auth_user, auth_password = _get_auth_info(args)
+
+    client = _get_client(url, keyfile, signing_workers=args.signing_workers,
+                         events_url=args.events_url)
+
+    results = client.create_many(
+        records,
+        wait=args.wait,
+        auth_user=auth_user,
+        auth_password=auth_password,
+        batch_size=args.batch_size,
+        batches_per_list=args.batches_per_list,
+        records_per_transaction=args.records_per_transaction)
+
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+        if result['message']:
+            print("{}: {} ({})".format(
+                result['name'], result['status'], result['message']))
+        else:
+            print("{}: {}".format(result['name'], result['status']))
+
+    print("{} records: {}".format(len(results), ", ".join(
+        "{} {}".format(count, status) for status, count in sorted(counts.items()))))
+
+def _read_records(filename, file_format, username):
+    '''
+    read harvestbatch records from a CSV (with header row) or JSONL file
+    :return: list of (name, batchnr, volume, latitude, longitude, username)
+        tuples
+    '''
+    if file_format is None:
+        file_format = 'jsonl' if filename.endswith(('.jsonl', '.json')) else 'csv'
+
+    try:
+        with open(filename, newline='') as fd:
+            if file_format == 'csv':
+                rows = list(csv.DictReader(fd))
+            else:
+                rows = [json.loads(line) for line in fd if line.strip()]
+    except (OSError, ValueError) as err:
+        raise HellotxpException(
+            'Failed to read records from {}: {}'.format(filename, err))
+
+    records = []
+    for number, row in enumerate(rows, 1):
+        try:
+            records.append((
+                str(row['name']),
+                int(row['batchnr']),
+                float(row['volume']),
+                float(row['latitude']),
+                float(row['longitude']),
+                row.get('username') or username,
+            ))
+        except (KeyError, TypeError, ValueError) as err:
+            raise HellotxpException(
+                'Invalid record {} in {}: {}'.format(number, filename, err))
+
+    return records
+
 def do_delete(args):
     name = args.name
-    username = args.username
+    username = getpass.getuser() if args.username is None else args.username
 
     url = _get_url(args)
     keyfile = _get_keyfile(args)
     auth_user, auth_password = _get_auth_info(args)
 
-    client = hellotxpClient(base_url=url, keyfile=keyfile)
+    client = _get_client(url, keyfile, events_url=args.events_url)
 
     if args.wait and args.wait > 0:
         response = client.delete(
@@ -381,7 +818,8 @@ def do_delete(args):
 
 def do_list(args):
     '''
-    show a list of hellotxp related batches
+    show a list of hellotxp related batches, printed page by page as they
+    arrive
     :param args:
     :return:
     '''
@@ -389,104 +827,226 @@ def do_list(args):
     auth_user, auth_password = _get_auth_info(args)
 
     url = _get_url(args)
-    client = hellotxpClient(base_url=url,keyfile=None)
-
-    harvest_list = [
-        batch.split(',')
-        for batches in client.list(auth_user=auth_user,
-                                   auth_password=auth_password)
-        for batch in batches.decode().split('|')
-
-    ]
-    print(harvest_list)
-    if harvest_list is not None:
-        for batch_data in harvest_list:
-            if len(batch_data) < 2:
-                name = batch_data
-                print(name)
-            elif len(batch_data) < 3:
-                name,batchnr = batch_data
-                print(name,batchnr)
-            elif len(batch_data) < 4:
-                name, batchnr,volume = batch_data
-                print(name,batchnr,volume)
-            elif len(batch_data) >= 4:
-                name,batchnr,volume,latlong = batch_data
-                print(name,batchnr,volume,latlong)
+    client = _get_client(url, None, cache=_get_cache(args))
+
+    # one entry past the limit gives the position to continue from
+    limit = None if args.limit is None else args.limit + 1
+    entries = client.list_entries(
+        auth_user=auth_user,
+        auth_password=auth_password,
+        page_size=args.page_size,
+        start=args.start,
+        limit=limit,
+        group=args.coop)
+
+    count = 0
+    for address, data in entries:
+        if count == args.limit:
+            print("More entries: --start {}".format(address), file=sys.stderr)
+            break
+        count += 1
+        for name, batchnr, volume, latitude, longitude, owner, revision in \
+                _decode_batches(data):
+            print(name, batchnr, volume, latitude, longitude, owner, revision)
+
+    if not count:
+        raise HellotxpException("No harvest batches to list")
+
+def do_export(args):
+    url = _get_url(args)
+    auth_user, auth_password = _get_auth_info(args)
 
+    client = _get_client(url, None)
 
-    else:
-        raise HellotxpException("No harvest batches to list")
+    head, count = export_snapshot(
+        client, os.path.expanduser(args.file),
+        auth_user=auth_user,
+        auth_password=auth_password,
+        page_size=args.page_size,
+        chunk_size=args.chunk_size)
+
+    print("{} state entries at head {}".format(count, head))
 
 def do_show(args):
     name = args.name
 
-    url = _get_url(args)
-    auth_user, auth_password = _get_auth_info(args)
+    if args.snapshot is not None:
+        with SnapshotReader(os.path.expanduser(args.snapshot)) as snapshot:
+            data = snapshot.show(name)
+    else:
+        url = _get_url(args)
+        auth_user, auth_password = _get_auth_info(args)
 
-    client = hellotxpClient(base_url=url, keyfile=None)
+        client = _get_client(url, None, cache=_get_cache(args))
 
-    data = client.show(name, auth_user=auth_user, auth_password=auth_password)
+        data = client.show(
+            name, auth_user=auth_user, auth_password=auth_password)
 
     if data is not None:
 
-        batch_str, str_batchnr, str_volume,str_latlong = {
-            name: (name,batchnr,volume,latlong)
-            for name, batchnr, volume,latlong in [
-                batch.split(',')
-                for batch in data.decode().split('|')
-            ]
-        }[name]
+        batches = {batch[0]: batch for batch in _decode_batches(data)}
+        if name not in batches:
+            raise HellotxpException("Batch not found: {}".format(name))
 
-        batch = list(batch_str.replace("-", " "))
+        batch_str, str_batchnr, str_volume, latitude, longitude, owner, \
+            revision = batches[name]
 
         print("\nNAME:     : {}".format(batch_str))
         print("BATCHNR  : {}".format(str_batchnr))
         print("VOLUME  : {}".format(str_volume))
-        print("LATLONG  : {}".format(str_latlong))
+        print("LATITUDE  : {}".format(latitude))
+        print("LONGITUDE  : {}".format(longitude))
+        print("OWNER  : {}".format(owner))
+        print("REVISION  : {}".format(revision))
         print("")
 
     else:
         raise HellotxpException("Batch not found: {}".format(name))
 
+def do_find(args):
+    if args.snapshot is not None:
+        with SnapshotReader(os.path.expanduser(args.snapshot)) as snapshot:
+            names = snapshot.find(batchnr=args.batchnr, username=args.user)
+    else:
+        url = _get_url(args)
+        auth_user, auth_password = _get_auth_info(args)
+
+        client = _get_client(url, None)
+
+        names = client.find(
+            batchnr=args.batchnr, username=args.user,
+            auth_user=auth_user, auth_password=auth_password)
+
+    if not names:
+        raise HellotxpException("No harvest batches found")
+    for name in names:
+        print(name)
+
+def do_near(args):
+    url = _get_url(args)
+    auth_user, auth_password = _get_auth_info(args)
+
+    client = _get_client(url, None)
+
+    results = client.near(
+        args.latitude, args.longitude, args.radius,
+        auth_user=auth_user, auth_password=auth_password)
+
+    if not results:
+        raise HellotxpException("No harvest batches found")
+    for distance, name, latitude, longitude in results:
+        print("{} {} {} {:.3f}km".format(name, latitude, longitude, distance))
+
+def do_within(args):
+    url = _get_url(args)
+    auth_user, auth_password = _get_auth_info(args)
+
+    client = _get_client(url, None)
+
+    results = client.within(
+        *args.bbox, auth_user=auth_user, auth_password=auth_password)
+
+    if not results:
+        raise HellotxpException("No harvest batches found")
+    for name, latitude, longitude in results:
+        print(name, latitude, longitude)
+
 def do_update(args):
     '''
     update data from a batch
     :param args:
     :return:
     '''
-    name = args.name
-    print(args)
-    batchnr = args.batchnr
+    latitude, longitude = args.location or (None, None)
 
     url = _get_url(args)
     keyfile = _get_keyfile(args)
     auth_user, auth_password = _get_auth_info(args)
 
-    client = hellotxpClient(base_url=url,keyfile=keyfile)
+    client = _get_client(url, keyfile, events_url=args.events_url)
 
-    if args.wait and args.wait > 0:
-        response = client.upate(
-            name, batchnr, wait=args.wait,
-            auth_user=auth_user,
-            auth_password=auth_password
-        )
-    else:
-        response = client.update(
-            name, batchnr,
-            auth_user=auth_user,
-            auth_password=auth_password
-        )
+    response = client.update(
+        args.name,
+        batchnr=args.batchnr,
+        volume=args.volume,
+        latitude=latitude,
+        longitude=longitude,
+        owner=args.owner,
+        expected_revision=args.expected_revision,
+        wait=args.wait,
+        auth_user=auth_user,
+        auth_password=auth_password)
+
+    print("Response: {}".format(response))
+
+
+
+def do_shell(parser):
+    interactive = sys.stdin.isatty()
+
+    while True:
+        if interactive:
+            print("hellotxp> ", end="", flush=True)
+        line = sys.stdin.readline()
+        if not line:
+            break
 
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line in ('exit', 'quit'):
+            break
 
+        try:
+            args = parser.parse_args(shlex.split(line))
+            if args.command == 'shell':
+                raise HellotxpException("already running a shell")
+            _run_command(args)
+        except (HellotxpException, ValueError) as err:
+            print("Error: {}".format(err), file=sys.stderr)
+        except SystemExit:
+            # argparse exits on --help and on invalid arguments
+            pass
+
+    sys.stdout.flush()
+
+def _get_client(url, keyfile, signing_workers=1, cache=None, events_url=None):
+    '''
+    get a client for url signing with keyfile, reusing an earlier client
+    while the key file is unchanged
+    :param cache: (path, head ttl) of the client's state cache, or None
+    '''
+    public_key = None if keyfile is None else load_identity(keyfile).public_key
+    key = (url, keyfile, public_key, signing_workers, cache, events_url)
+
+    client = _CLIENTS.get(key)
+    if client is None:
+        state_cache = None
+        if cache is not None:
+            state_cache = StateCache(cache[0], head_ttl=cache[1])
+        client = hellotxpClient(
+            base_url=url, keyfile=keyfile, signing_workers=signing_workers,
+            cache=state_cache, events_url=events_url)
+        _CLIENTS[key] = client
+
+    return client
+
+def _get_cache(args):
+    if args.cache is None:
+        return None
+    return os.path.expanduser(args.cache), args.cache_ttl
+
+def _decode_batches(data):
+    try:
+        return decode_state(data)
+    except CodecError as err:
+        raise HellotxpException(err)
 
 def _get_url(args):
     return DEFAULT_URL if args.url is None else args.url
 
 
 def _get_keyfile(args):
-    print(args)
-    print("t.get_keyfile args  ")
     username = getpass.getuser() if args.username is None else args.username
     home = os.path.expanduser("~")
     key_dir = os.path.join(home, ".sawtooth", "keys")
@@ -514,14 +1074,30 @@ def main(prog_name=os.path.basename(sys.argv[0]), args=None):
 
     setup_loggers(verbose_level=verbose_level)
 
+    if args.command == 'shell':
+        do_shell(parser)
+    else:
+        _run_command(args)
+
+
+def _run_command(args):
     if args.command == 'create':
         do_create(args)
+    elif args.command == 'bulk-create':
+        do_bulk_create(args)
     elif args.command == 'list':
         do_list(args)
+    elif args.command == 'export':
+        do_export(args)
     elif args.command == 'show':
         do_show(args)
+    elif args.command == 'find':
+        do_find(args)
+    elif args.command == 'near':
+        do_near(args)
+    elif args.command == 'within':
+        do_within(args)
     elif args.command == 'update':
-        print(args)
         do_update(args)
     elif args.command == 'delete':
         do_delete(args)
@@ -1,9 +1,13 @@
 import hashlib
 import base64
-from base64 import b64encode
+import collections
+import json
+import logging
+import os
 import time
 import requests
-import yaml
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from sawtooth_signing import create_context
 from sawtooth_signing import CryptoFactory
@@ -16,42 +20,228 @@ from sawtooth_sdk.protobuf.batch_pb2 import BatchList
 from sawtooth_sdk.protobuf.batch_pb2 import BatchHeader
 from sawtooth_sdk.protobuf.batch_pb2 import Batch
 
+from hellotxp_addressing import batch_address
+from hellotxp_addressing import batch_prefixes
+from hellotxp_addressing import FAMILY_NAME
+from hellotxp_addressing import index_key_prefix
+from hellotxp_addressing import INDEX_PREFIXES
+from hellotxp_addressing import legacy_batch_address
+from hellotxp_addressing import NAMESPACE_PREFIX
+from hellotxp_addressing import operation_addresses
+from hellotxp_codec import BINARY_FAMILY_VERSION
+from hellotxp_codec import CodecError
+from hellotxp_codec import encode_payload
+from hellotxp_codec import encode_payloads
+from hellotxp_codec import INDEX_LOCATION
+from hellotxp_codec import NO_REVISION
+from hellotxp_codec import PAYLOAD_FORMAT_V4
+from hellotxp_codec import PAYLOAD_FORMAT_V5
+from hellotxp_cache import StateCache
+from hellotxp_common import add_located
+from hellotxp_common import collect_results
+from hellotxp_common import expand_results
+from hellotxp_common import group_records
+from hellotxp_common import index_lookup
+from hellotxp_common import list_queries
+from hellotxp_common import index_names
+from hellotxp_common import location_queries
+from hellotxp_common import make_headers
+from hellotxp_common import make_url
+from hellotxp_common import near_boxes
+from hellotxp_common import near_results
+from hellotxp_common import planned_results
+from hellotxp_common import resolve_operations
+from hellotxp_common import stored_names
+from hellotxp_common import stored_values
+from hellotxp_common import update_operation
+from hellotxp_events import CommitWaiter
+from hellotxp_events import ZmqEventSource
 from hellotxp_exceptions import HellotxpException
+from hellotxp_json import get_decoder
+from hellotxp_planner import plan_operations
+from hellotxp_signing import ParallelSigner
+
+LOGGER = logging.getLogger(__name__)
+
+# Upper bounds used when packing bulk submissions. Keep them at or below
+# the limits the validator is configured with.
+MAX_TRANSACTIONS_PER_BATCH = 100
+MAX_BATCHES_PER_BATCH_LIST = 100
+
+# State entries requested per page when listing. The REST API accepts at
+# most 1000.
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+
+# Connection settings of the REST API session. Timeouts are (connect, read)
+# in seconds; requests that wait on the validator get the wait added to the
+# read timeout.
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = (3.05, 30)
+
+# Seconds a single batch_statuses request asks the REST API to wait. The
+# REST API waits at most its --timeout, 300 seconds by default, so longer
+# waits, such as the sys.maxsize of a bare --wait, poll again instead.
+MAX_WAIT = 300
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.3
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# A loaded private key with its signer and public key, see load_identity.
+SignerIdentity = collections.namedtuple(
+    'SignerIdentity', ['signer', 'public_key', 'private_key'])
+
+# Identities loaded by load_identity, keyed by (key file path, mtime) so a
+# replaced key file is read again.
+_IDENTITIES = {}
+_CRYPTO_FACTORY = None
 
 def _sha512(data):
     return hashlib.sha512(data).hexdigest()
 
+def load_identity(keyfile):
+    """
+    load the signer for a private key file. The key is read, parsed and
+    turned into a signer once per process and key file version.
+    :param keyfile: path of the hex encoded secp256k1 private key
+    :return: SignerIdentity
+    """
+    global _CRYPTO_FACTORY
+
+    path = os.path.abspath(keyfile)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError as err:
+        raise HellotxpException(
+            'Failed to read private key {}: {}'.format(keyfile, str(err)))
+
+    identity = _IDENTITIES.get((path, mtime))
+    if identity is not None:
+        return identity
+
+    try:
+        with open(path) as fd:
+            private_key_str = fd.read().strip()
+    except OSError as err:
+        raise HellotxpException(
+            'Failed to read private key {}: {}'.format(keyfile, str(err))
+        )
+
+    try:
+        private_key = Secp256k1PrivateKey.from_hex(private_key_str)
+    except ParseError as e:
+        raise HellotxpException('Unable to load private key: {}'.format(str(e)))
+
+    if _CRYPTO_FACTORY is None:
+        _CRYPTO_FACTORY = CryptoFactory(create_context('secp256k1'))
+    signer = _CRYPTO_FACTORY.new_signer(private_key)
+
+    identity = SignerIdentity(
+        signer=signer,
+        public_key=signer.get_public_key().as_hex(),
+        private_key=private_key_str)
+
+    for key in [k for k in _IDENTITIES if k[0] == path]:
+        del _IDENTITIES[key]
+    _IDENTITIES[(path, mtime)] = identity
+
+    return identity
+
+
 class hellotxpClient:
-    def __init__(self, base_url, keyfile=None):
+    def __init__(self, base_url, keyfile=None, pool_size=DEFAULT_POOL_SIZE,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, signing_workers=1, decoder=None,
+                 cache=None, events_url=None):
+        """
+        :param decoder: JSON decoder for REST API responses, a name from
+            hellotxp_json.DECODERS or a decoder object, by default orjson
+            when installed and the standard library otherwise
+        :param cache: path of an on-disk state cache, or a
+            hellotxp_cache.StateCache, to serve repeated state reads
+            from while the chain head is unchanged
+        :param events_url: client endpoint of the validator, e.g.
+            tcp://localhost:4004, to wait for commits on block commit
+            events instead of polling batch statuses
+        """
         self._base_url = base_url
+        self._timeout = timeout
+        self._decoder = get_decoder(decoder)
+        self._cache = StateCache(cache) if isinstance(cache, str) else cache
+        self._events_url = events_url
+        self._waiter = None
+        self._session_options = (pool_size, retries, backoff)
+        self._session = None
+        self._parallel_signer = None
 
         if keyfile is None:
             self._signer = None
+            self._public_key = None
             return
 
-        try:
-            with open(keyfile) as fd:
-                private_key_str = fd.read().strip()
-        except OSError as err:
-            raise HellotxpException(
-                'Failed to read private key {}: {}'.format(keyfile, str(err))
-            )
-
-        try:
-            private_key = Secp256k1PrivateKey.from_hex(private_key_str)
-        except ParseError as e:
-            raise hellotxpClient('Unable to load private key: {}'.format(str(e)))
-
-        self._signer = CryptoFactory(create_context('secp256k1')) .new_signer(private_key)
-
-    def create(self, name, batchnr,volume,latlong, username, wait=None, auth_user=None, auth_password=None):
-        print("batchnr in create" + str(batchnr))
+        identity = load_identity(keyfile)
+        self._signer = identity.signer
+        self._public_key = identity.public_key
+        if signing_workers != 1:
+            # bulk operations sign on a process pool, started on first use
+            self._parallel_signer = ParallelSigner(
+                identity, workers=signing_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        if self._parallel_signer is not None:
+            self._parallel_signer.close()
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+        if self._waiter is not None:
+            self._waiter.close()
+            self._waiter = None
+
+    @property
+    def decoder(self):
+        """
+        the hellotxp_json decoder of REST API responses
+        """
+        return self._decoder
+
+    def pool_stats(self):
+        """
+        connection reuse counters of the session's pools. A hit is a request
+        sent on a kept-alive connection, a miss one that opened a new
+        connection.
+        :return: dict with hits and misses
+        """
+        hits = 0
+        misses = 0
+        adapters = self._session.adapters.values() if self._session else []
+        # the same adapter is mounted for http:// and https://
+        for adapter in set(adapters):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                misses += pool.num_connections
+                hits += pool.num_requests - pool.num_connections
+
+        return {'hits': hits, 'misses': misses}
+
+    def create(self, name, batchnr,volume,latitude, longitude, username, wait=None, auth_user=None, auth_password=None):
+        LOGGER.debug("batchnr in create %s", batchnr)
         return self._send_hellotxp_txn(
             name,
             "create",
             batchnr,
             volume,
-            latlong,
+            latitude,
+            longitude,
             username,
             wait=wait,
             auth_user=auth_user,
@@ -59,76 +249,493 @@ class hellotxpClient:
         )
 
     def delete(self, name, username, wait=None, auth_user=None, auth_password=None):
+        """
+        delete a harvest batch. The batch is read first: the delete
+        carries its stored values, see hellotxp_common.resolve_operations.
+        """
+        [operation], [legacy] = self._resolve_operations(
+            [(name, "delete", 0, 0.0, 0.0, 0.0, username)],
+            auth_user, auth_password)
+
         return self._send_hellotxp_txn(
-            name,
-            "delete",
-            username,
+            *operation[:7],
             wait=wait,
             auth_user=auth_user,
-            auth_password=auth_password)
+            auth_password=auth_password,
+            stored=operation[9] if len(operation) > 9 else None,
+            legacy=legacy)
+
+    def update(self, name, batchnr=None, volume=None, latitude=None,
+               longitude=None, owner=None, expected_revision=None, wait=None,
+               auth_user=None, auth_password=None):
+        """
+        change the given fields of a harvest batch in one transaction,
+        leaving the others as stored. Fields left None are not sent.
+        :param latitude: new location, given together with longitude
+        :param owner: new owner
+        :param expected_revision: apply only if the batch is still at this
+            revision, as shown by show; the update is invalid otherwise
+
+        The batch is read first, to find its address layout and to send
+        the values an update of batchnr, location or owner replaces along.
+        """
+        [operation], [legacy] = self._resolve_operations(
+            [update_operation(
+                name, batchnr, volume, latitude, longitude, owner,
+                expected_revision)],
+            auth_user, auth_password)
 
-    def update(self,name, batchnr, wait=None, auth_user=None, auth_password=None):
         return self._send_hellotxp_txn(
-            name,
-            "update",
-            batchnr,
+            *operation[:7],
             wait=wait,
             auth_user=auth_user,
-            auth_password=auth_password
-        )
-
-    def list(self, auth_user=None,auth_password=None):
-        hellotxp_prefix = self._get_prefix()
-
-        result = self._send_request(
-            "state?address={}".format(hellotxp_prefix),
-            auth_user = auth_user,
-            auth_password = auth_password
-        )
-
-        try:
-            encoded_entries = yaml.safe_load(result)["data"]
+            auth_password=auth_password,
+            fields=operation[7],
+            expected_revision=operation[8],
+            stored=operation[9] if len(operation) > 9 else None,
+            legacy=legacy)
+
+    def create_many(self, records, wait=None, auth_user=None, auth_password=None,
+                    batch_size=MAX_TRANSACTIONS_PER_BATCH,
+                    batches_per_list=MAX_BATCHES_PER_BATCH_LIST,
+                    records_per_transaction=1):
+        """
+        create a harvest batch for every record, packing the transactions
+        into as few Batches and BatchLists as possible. With
+        records_per_transaction above 1, each transaction creates that many
+        records, and they commit or fail together.
+        :param records: iterable of
+            (name, batchnr, volume, latitude, longitude, username)
+        :return: one status dict per record, in the order of records
+        """
+        groups = group_records(records, "create", records_per_transaction)
+        transactions = self.create_transactions(groups)
+
+        results = self.submit_many(
+            transactions,
+            wait=wait,
+            auth_user=auth_user,
+            auth_password=auth_password,
+            batch_size=batch_size,
+            batches_per_list=batches_per_list)
+
+        return expand_results(groups, results)
+
+    def submit_many(self, transactions, wait=None, auth_user=None, auth_password=None,
+                    batch_size=MAX_TRANSACTIONS_PER_BATCH,
+                    batches_per_list=MAX_BATCHES_PER_BATCH_LIST):
+        """
+        pack signed transactions into Batches of at most batch_size
+        transactions, post them batches_per_list Batches at a time and
+        report the commit status of every transaction.
+
+        A Batch is committed atomically, so one invalid transaction
+        invalidates every other transaction in the same Batch.
+        :param transactions: list of signed Transactions
+        :return: one status dict per transaction, in the order given
+        """
+        if batch_size < 1 or batches_per_list < 1:
+            raise HellotxpException(
+                'batch_size and batches_per_list must be positive')
+
+        batches = self.create_batches(transactions, batch_size)
+        return self._submit_batches(
+            batches, wait, auth_user, auth_password, batches_per_list)
+
+    def submit_planned(self, operations, wait=None, auth_user=None,
+                       auth_password=None,
+                       batch_size=MAX_TRANSACTIONS_PER_BATCH,
+                       batches_per_list=MAX_BATCHES_PER_BATCH_LIST):
+        """
+        submit operations that may touch the same harvest batches, e.g. a
+        create and later updates of the new batch, in one go instead of
+        waiting for each to commit. Every operation becomes a transaction
+        depending on the earlier ones it conflicts with, and the
+        operations that do not conflict share Batches, see hellotxp_planner.
+
+        A transaction whose dependency is invalid is not applied either.
+        The batches that deletes and updates change are read first, see
+        hellotxp_common.resolve_operations.
+        :param operations: list of (name, action, batchnr, volume, latitude,
+            longitude, username), with (fields, expected_revision) for
+            updates, in the order they are to apply
+        :return: one status dict per operation, in the order of operations
+        """
+        if batch_size < 1 or batches_per_list < 1:
+            raise HellotxpException(
+                'batch_size and batches_per_list must be positive')
+
+        plan = plan_operations(*self._resolve_operations(
+            operations, auth_user, auth_password))
+        transactions, waves = self.create_planned_batches(plan, batch_size)
+        results = self._submit_batches(
+            [batch for batches in waves for batch in batches],
+            wait, auth_user, auth_password, batches_per_list)
+
+        return planned_results(plan, transactions, results)
+
+    def _submit_batches(self, batches, wait, auth_user, auth_password,
+                        batches_per_list):
+        """
+        post Batches batches_per_list at a time, in order, and report the
+        commit status of every transaction, see submit_many
+        """
+        waiter = self._get_waiter() if wait and wait > 0 else None
+        if waiter is not None:
+            waiter.watch([batch.header_signature for batch in batches])
+
+        failed = {}
+        for i in range(0, len(batches), batches_per_list):
+            chunk = batches[i:i + batches_per_list]
+            batch_list = BatchList(batches=chunk)
+            try:
+                self._send_request(
+                    "batches", batch_list.SerializeToString(),
+                    'application/octet-stream',
+                    auth_user=auth_user,
+                    auth_password=auth_password)
+            except HellotxpException as err:
+                LOGGER.warning('Failed to submit %d batches: %s', len(chunk), err)
+                for batch in chunk:
+                    failed[batch.header_signature] = str(err)
+
+        submitted = [
+            b.header_signature for b in batches if b.header_signature not in failed]
+        if waiter is not None:
+            waiter.forget(failed)
+            statuses = waiter.wait(
+                submitted, wait, self._status_poller(auth_user, auth_password))
+        else:
+            statuses = self._get_statuses(
+                submitted,
+                wait,
+                auth_user=auth_user,
+                auth_password=auth_password)
 
-            return [
-                base64.b64decode(entry["data"]) for entry in encoded_entries
-            ]
+        return collect_results(batches, statuses, failed)
+
+    def list(self, auth_user=None, auth_password=None,
+             page_size=DEFAULT_PAGE_SIZE, start=None, limit=None, group=None):
+        """
+        iterate over the harvest batch state entries. Entries are requested
+        page_size at a time as the generator is consumed, so memory use
+        does not grow with the size of the namespace.
+        :return: generator of state entry bytes
+        """
+        for _, data in self.list_entries(
+                auth_user=auth_user,
+                auth_password=auth_password,
+                page_size=page_size,
+                start=start,
+                limit=limit,
+                group=group):
+            yield data
+
+    def list_entries(self, auth_user=None, auth_password=None,
+                     page_size=DEFAULT_PAGE_SIZE, start=None, limit=None,
+                     group=None):
+        """
+        iterate over the harvest batch state entries with their addresses,
+        see list. An entry's address is the start position that resumes
+        the listing from that entry.
+        :param page_size: entries per REST API request, at most MAX_PAGE_SIZE
+        :param start: address to start from, as returned by an earlier listing
+        :param limit: stop after this many harvest batch entries
+        :param group: only list the batches of this co-op, named
+            <group>/<batch>. Batches kept in the legacy layout (see
+            hellotxp_addressing) are not grouped, only listed without group,
+            and those under an index kind prefix only by show.
+        :return: generator of (address, state entry bytes)
+        """
+        if limit is not None and limit <= 0:
+            return
 
-        except BaseException:
-            return None
+        # the index records are not read, see batch_prefixes
+        count = 0
+        for prefix, prefix_start in list_queries(batch_prefixes(group), start):
+            for entry in self.iter_state(
+                    prefix, auth_user, auth_password,
+                    page_size=page_size, start=prefix_start):
+                yield entry
+                count += 1
+                if count == limit:
+                    return
 
     def show(self, name, auth_user=None, auth_password=None):
-        address = self._get_address(name)
+        """
+        :return: the state entry bytes holding the harvest batch name
+        """
+        return self._read_batch(name, auth_user, auth_password)[1]
+
+    def _read_batch(self, name, auth_user=None, auth_password=None):
+        """
+        read the state entry holding a harvest batch at its address, or
+        at its legacy address for batches kept in the legacy layout. A name
+        that csv or older clients created in both layouts is read from the
+        leaf layout.
+        :return: (True for the legacy layout, state entry bytes)
+        """
+        for legacy, address in ((False, batch_address(name)),
+                                (True, legacy_batch_address(name))):
+            # listing the one address returns no entries instead of a 404
+            for _, data in self.iter_state(address, auth_user, auth_password):
+                return legacy, data
+        raise HellotxpException("No such batch: {}".format(name))
+
+    def find(self, batchnr=None, username=None, auth_user=None,
+             auth_password=None):
+        """
+        look up harvest batches by batchnr or by the username that created
+        them, listing the index leaves of that value. Batches created by
+        family version 0.1 (csv) transactions are not indexed, since their
+        headers declare only the batch address, so find never returns them;
+        show and list do.
+        :return: sorted list of harvest batch names, empty if none match
+        """
+        kind, key = index_lookup(batchnr, username)
+
+        names = set()
+        for _, data in self.iter_state(
+                index_key_prefix(kind, key), auth_user, auth_password):
+            names.update(index_names(data, key))
+        return sorted(names)
+
+    def within(self, min_lat, min_lon, max_lat, max_lon, auth_user=None,
+               auth_password=None):
+        """
+        find the harvest batches located in a bounding box, reading only
+        the location index cells that cover it
+        :return: list of (name, latitude, longitude), sorted by name
+        """
+        box = (min_lat, min_lon, max_lat, max_lon)
+        located = self._find_located([box], auth_user, auth_password)
+        return sorted(
+            (name, latitude, longitude)
+            for name, (latitude, longitude) in located.items())
+
+    def near(self, latitude, longitude, radius_km, auth_user=None,
+             auth_password=None):
+        """
+        find the harvest batches within radius_km of a location, reading
+        only the location index cells around it
+        :return: list of (distance_km, name, latitude, longitude), nearest
+            first
+        """
+        boxes = near_boxes(latitude, longitude, radius_km)
+        located = self._find_located(boxes, auth_user, auth_password)
+        return near_results(latitude, longitude, radius_km, located)
+
+    def _find_located(self, boxes, auth_user, auth_password):
+        located = {}
+        for box, cell in location_queries(boxes):
+            address = INDEX_PREFIXES[INDEX_LOCATION] + cell
+            for _, data in self.iter_state(address, auth_user, auth_password):
+                add_located(box, data, located)
+        return located
+
+    def _resolve_operations(self, operations, auth_user, auth_password):
+        """
+        read the batches whose layout and stored values operations need,
+        see hellotxp_common.resolve_operations
+        """
+        operations = list(operations)
+        stored = {}
+        legacy = []
+        for name in stored_names(operations):
+            in_legacy, data = self._read_batch(name, auth_user, auth_password)
+            stored[name] = stored_values(data, name)
+            if in_legacy:
+                legacy.append(name)
+        return resolve_operations(operations, stored, legacy)
+
+    def iter_state(self, address, auth_user=None, auth_password=None,
+                   page_size=DEFAULT_PAGE_SIZE, start=None, head=None):
+        """
+        read every state entry under an address prefix, following the REST
+        API's paging one page per request
+        :param head: block id to read every page at, bypassing the cache,
+            e.g. from fetch_head
+        :return: generator of (address, state entry bytes)
+        """
+        if not 1 <= page_size <= MAX_PAGE_SIZE:
+            raise HellotxpException(
+                'page_size must be between 1 and {}'.format(MAX_PAGE_SIZE))
+
+        suffix = "state?address={}&limit={}".format(address, page_size)
+        if start is not None:
+            suffix += "&start={}".format(start)
+        while True:
+            if head is None:
+                result = self._read_state(
+                    suffix,
+                    auth_user=auth_user,
+                    auth_password=auth_password)
+            else:
+                result = self._send_request(
+                    "{}&head={}".format(suffix, head),
+                    auth_user=auth_user,
+                    auth_password=auth_password)
+            # entries are decoded one at a time as they are consumed
+            fields = {}
+            try:
+                for entry in self._decoder.iter_items(result, "data", fields):
+                    yield entry["address"], base64.b64decode(entry["data"])
+                next_position = fields.get("paging", {}).get("next_position")
+            except (KeyError, TypeError, ValueError) as err:
+                raise HellotxpException(err)
+
+            if not next_position:
+                return
+            suffix = "state?address={}&limit={}&start={}".format(
+                address, page_size, next_position)
+
+    def _read_state(self, suffix, name=None, auth_user=None,
+                    auth_password=None):
+        """
+        send a state request, or answer it from the cache if the request
+        was already sent at the current head
+        """
+        if self._cache is None:
+            return self._send_request(
+                suffix,
+                name=name,
+                auth_user=auth_user,
+                auth_password=auth_password)
 
+        head = self._get_head(auth_user, auth_password)
+        result = self._cache.get(suffix, head)
+        if result is None:
+            # pinned to the head so the response matches the cache key
+            result = self._send_request(
+                "{}{}head={}".format(suffix, '&' if '?' in suffix else '?', head),
+                name=name,
+                auth_user=auth_user,
+                auth_password=auth_password)
+            self._cache.put(suffix, head, result)
+        return result
+
+    def _get_head(self, auth_user=None, auth_password=None):
+        head = self._cache.head()
+        if head is None:
+            head = self.fetch_head(auth_user, auth_password)
+            self._cache.set_head(head)
+        return head
+
+    def fetch_head(self, auth_user=None, auth_password=None):
+        """
+        :return: the id of the chain head block, asking the REST API
+        """
         result = self._send_request(
-            "state/{}".format(address),
-            name=name,
+            "blocks?limit=1",
             auth_user=auth_user,
             auth_password=auth_password)
         try:
-            return base64.b64decode(yaml.safe_load(result)["data"])
-
-        except BaseException:
-            return None
+            return self._decoder.loads(result)["head"]
+        except BaseException as err:
+            raise HellotxpException(err)
 
     def _get_status(self, batch_id, wait, auth_user=None, auth_password=None):
+        wait = min(wait, MAX_WAIT)
         try:
             result = self._send_request(
                 'batch_statuses?id={}&wait={}'.format(batch_id, wait),
+                timeout=self._wait_timeout(wait),
                 auth_user=auth_user,
                 auth_password=auth_password)
-            return yaml.safe_load(result)['data'][0]['status']
+            return self._decoder.loads(result)['data'][0]['status']
         except BaseException as err:
 
             raise HellotxpException(err)
 
-    def _get_prefix(self):
-        return _sha512('hellotxp'.encode('utf-8'))[0:6]
-
-    def _get_address(self, name):
-        hellotxp_prefix = self._get_prefix()
-        hellotxp_address = _sha512(name.encode('utf-8'))[0:64]
-
-        return hellotxp_prefix + hellotxp_address
+    def _get_statuses(self, batch_ids, wait=None, auth_user=None, auth_password=None):
+        """
+        fetch the status of many batches with one request per poll,
+        re-polling only the batches that are still PENDING until wait
+        seconds have passed
+        :return: dict of batch id to its status entry
+        """
+        statuses = {}
+        pending = list(batch_ids)
+        start_time = time.time()
+
+        while pending:
+            remaining = 0
+            if wait and wait > 0:
+                remaining = max(0, int(wait - (time.time() - start_time)))
+            # a request waits MAX_WAIT at most, the loop polls again
+            remaining = min(remaining, MAX_WAIT)
+            suffix = 'batch_statuses'
+            if remaining:
+                suffix = 'batch_statuses?wait={}'.format(remaining)
+
+            try:
+                result = self._send_request(
+                    suffix, json.dumps(pending).encode(),
+                    'application/json',
+                    timeout=self._wait_timeout(remaining),
+                    auth_user=auth_user,
+                    auth_password=auth_password)
+                for entry in self._decoder.loads(result)['data']:
+                    statuses[entry['id']] = entry
+            except BaseException as err:
+                raise HellotxpException(err)
+
+            pending = [
+                batch_id for batch_id in pending
+                if statuses.get(batch_id, {}).get('status') == 'PENDING'
+            ]
+            if not remaining:
+                break
+
+        return statuses
+
+    def _status_poller(self, auth_user=None, auth_password=None):
+        def poll(batch_ids, wait):
+            return self._get_statuses(
+                batch_ids, wait, auth_user=auth_user, auth_password=auth_password)
+        return poll
+
+    def _get_waiter(self):
+        """
+        :return: the CommitWaiter following the validator's events, started
+            on first use, or None to poll batch statuses
+        """
+        if self._waiter is None and self._events_url is not None:
+            try:
+                source = ZmqEventSource(self._events_url, NAMESPACE_PREFIX)
+                source.connect()
+            except HellotxpException as err:
+                LOGGER.warning('Polling batch statuses instead of events: %s', err)
+                self._events_url = None
+                return None
+            self._waiter = CommitWaiter(source)
+            self._waiter.start()
+        return self._waiter
+
+    def _wait_timeout(self, wait):
+        connect_timeout, read_timeout = self._timeout
+        return connect_timeout, read_timeout + min(wait or 0, MAX_WAIT)
+
+    @staticmethod
+    def _create_session(pool_size, retries, backoff):
+        # Transient failures are retried with exponential backoff. Posting a
+        # BatchList again is safe: batch ids are signatures, so the
+        # validator drops batches it has already seen.
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['GET', 'POST']),
+            raise_on_status=False)
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry)
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
     def _send_request(self,
                       suffix,
@@ -136,26 +743,22 @@ class hellotxpClient:
                       content_type=None,
                       name=None,
                       auth_user=None,
-                      auth_password=None):
-        if self._base_url.startswith("http://"):
-            url = "{}/{}".format(self._base_url,suffix)
-        else:
-            url = "http://{}/{}".format(self._base_url,suffix)
-        headers = {}
-        if auth_user is not None:
-            auth_string = "{}:{}".format(auth_user, auth_password)
-            b64_string = b64encode(auth_string.encode()).decode()
-            auth_header = 'Basic {}'.format(b64_string)
-            headers['Authorization'] = auth_header
+                      auth_password=None,
+                      timeout=None):
+        url = make_url(self._base_url, suffix)
+        headers = make_headers(content_type, auth_user, auth_password)
 
-        if content_type is not None:
-            headers['Content-Type'] = content_type
+        if timeout is None:
+            timeout = self._timeout
+        if self._session is None:
+            self._session = self._create_session(*self._session_options)
 
         try:
             if data is not None:
-                result = requests.post(url, headers=headers, data=data)
+                result = self._session.post(
+                    url, headers=headers, data=data, timeout=timeout)
             else:
-                result = requests.get(url, headers=headers)
+                result = self._session.get(url, headers=headers, timeout=timeout)
 
             if result.status_code == 404:
                 raise HellotxpException("No such batch: {}".format(name))
@@ -171,38 +774,154 @@ class hellotxpClient:
         except BaseException as err:
             raise HellotxpException(err)
 
+        if suffix == "batches" and self._cache is not None:
+            # submitted batches may change state: check the head on the
+            # next read instead of trusting it for head_ttl
+            self._cache.expire_head()
+
         return result.text
 
-    def _send_hellotxp_txn(self,name,action,batchnr,volume,latlong,username,wait=None,auth_user=None,auth_password=None):
-        # create a new utf-8 encoded string for serialization
-        print("name in send txn")
-        payload = ",".join([name,action,str(batchnr),str(volume),str(latlong),username]).encode()
-        print("payload " + str(payload))
-        address = self._get_address(name)
+    def create_transaction(self, name, action, batchnr, volume, latitude,
+                           longitude, username, fields=0,
+                           expected_revision=NO_REVISION, stored=None,
+                           legacy=False):
+        """
+        build and sign the transaction of a single operation
+        :param legacy: address the batch in the legacy layout, see
+            hellotxp_addressing
+        :return: Transaction
+        """
+        header, payload = self._create_transaction_header(
+            [(name, action, batchnr, volume, latitude, longitude, username,
+              fields, expected_revision, stored)], legacy=legacy)
+
+        signature = self._signer.sign(header)
+        return Transaction(
+            header=header,
+            payload=payload,
+            header_signature=signature
+        )
+
+    def create_transactions(self, groups):
+        """
+        build and sign one transaction per group of operations, serializing
+        every header first so they can be signed in bulk
+        :param groups: list of lists of
+            (name, action, batchnr, volume, latitude, longitude, username)
+        :return: list of Transactions, in the order of groups
+        """
+        headers = []
+        payloads = []
+        for operations in groups:
+            header, payload = self._create_transaction_header(operations)
+            headers.append(header)
+            payloads.append(payload)
+
+        return [
+            Transaction(header=header, payload=payload, header_signature=signature)
+            for header, payload, signature
+            in zip(headers, payloads, self._sign_all(headers))
+        ]
+
+    def create_planned_batches(self, plan, batch_size):
+        """
+        build and sign the transactions of a plan wave by wave, as a
+        transaction's header holds the ids of its dependencies, and pack
+        every wave into Batches of its own
+        :param plan: hellotxp_planner.Plan
+        :return: (list of Transactions, in the order of the operations;
+            list of the Batches of every wave, first wave first)
+        """
+        transactions = [None] * len(plan.operations)
+        waves = []
+        for wave in plan.waves:
+            headers = []
+            payloads = []
+            for i in wave:
+                header, payload = self._create_transaction_header(
+                    [plan.operations[i]],
+                    [transactions[d].header_signature
+                     for d in plan.dependencies[i]],
+                    plan.legacy[i])
+                headers.append(header)
+                payloads.append(payload)
+
+            for i, header, payload, signature in zip(
+                    wave, headers, payloads, self._sign_all(headers)):
+                transactions[i] = Transaction(
+                    header=header, payload=payload, header_signature=signature)
+            waves.append(self.create_batches(
+                [transactions[i] for i in wave], batch_size))
+
+        return transactions, waves
+
+    def _sign_all(self, headers):
+        if self._parallel_signer is not None:
+            return self._parallel_signer.sign_all(headers)
+        return [self._signer.sign(header) for header in headers]
+
+    def _create_transaction_header(self, operations, dependencies=(),
+                                   legacy=False):
+        # a transaction declares the address of every batch and index entry
+        # it touches, and the ids of the transactions it must follow.
+        # Operations on batches kept in the legacy layout go in payload
+        # format 4, which the transaction processor applies to that layout.
+        payload_format = PAYLOAD_FORMAT_V4 if legacy else PAYLOAD_FORMAT_V5
+        try:
+            if len(operations) == 1:
+                payload = encode_payload(
+                    *operations[0], payload_format=payload_format)
+            else:
+                payload = encode_payloads(operations, payload_format)
+        except CodecError as err:
+            raise HellotxpException(err)
+        LOGGER.debug("payload %s", payload)
+        addresses = set()
+        for operation in operations:
+            addresses.update(operation_addresses(operation, legacy))
+        addresses = sorted(addresses)
 
         header = TransactionHeader(
-            signer_public_key= self._signer.get_public_key().as_hex(),
-            family_name="hellotxp",
-            family_version="0.1",
-            inputs=[address],
-            outputs=[address],
-            dependencies=[],
+            signer_public_key= self._public_key,
+            family_name=FAMILY_NAME,
+            family_version=BINARY_FAMILY_VERSION,
+            inputs=addresses,
+            outputs=addresses,
+            dependencies=dependencies,
             payload_sha512=_sha512(payload),
-            batcher_public_key=self._signer.get_public_key().as_hex(),
+            batcher_public_key=self._public_key,
             nonce=time.time().hex().encode()
 
         ).SerializeToString()
 
-        signature = self._signer.sign(header)
-        transaction = Transaction(
-            header=header,
-            payload=payload,
-            header_signature=signature
-        )
+        return header, payload
+
+    def _send_hellotxp_txn(self,name,action,batchnr,volume,latitude,longitude,username,wait=None,auth_user=None,auth_password=None,
+                           fields=0, expected_revision=NO_REVISION,
+                           stored=None, legacy=False):
+        transaction = self.create_transaction(
+            name, action, batchnr, volume, latitude, longitude, username,
+            fields, expected_revision, stored, legacy)
 
-        batch_list = self._create_batch_list([transaction])
+        batch_list = self.create_batch_list([transaction])
         batch_id = batch_list.batches[0].header_signature
 
+        waiter = self._get_waiter() if wait and wait > 0 else None
+        if waiter is not None:
+            waiter.watch([batch_id])
+            try:
+                response = self._send_request(
+                    "batches", batch_list.SerializeToString(),
+                    'application/octet-stream',
+                    auth_user=auth_user,
+                    auth_password=auth_password)
+            except HellotxpException:
+                waiter.forget([batch_id])
+                raise
+            waiter.wait(
+                [batch_id], wait, self._status_poller(auth_user, auth_password))
+            return response
+
         if wait and wait > 0:
             wait_time = 0
             start_time = time.time()
@@ -231,23 +950,46 @@ class hellotxpClient:
             auth_password=auth_password
         )
 
-    def _create_batch_list(self, transactions):
-        transaction_signatures = [t.header_signature for t in transactions]
-
-
-        header = BatchHeader(
-            signer_public_key=self._signer.get_public_key().as_hex(),
-            transaction_ids=transaction_signatures
-        ).SerializeToString()
+    def create_batch_list(self, transactions):
+        """
+        :return: BatchList of one signed Batch holding transactions
+        """
+        return BatchList(batches=[self._create_batch(transactions)])
+
+    def create_batches(self, transactions, batch_size=MAX_TRANSACTIONS_PER_BATCH):
+        """
+        pack transactions into Batches of at most batch_size, signed in bulk
+        :return: list of Batches, in the order of transactions
+        """
+        if batch_size < 1:
+            raise HellotxpException('batch_size must be positive')
+
+        groups = [
+            transactions[i:i + batch_size]
+            for i in range(0, len(transactions), batch_size)
+        ]
+        headers = [self._create_batch_header(group) for group in groups]
+
+        return [
+            Batch(header=header, transactions=group, header_signature=signature)
+            for group, header, signature
+            in zip(groups, headers, self._sign_all(headers))
+        ]
+
+    def _create_batch(self, transactions):
+        header = self._create_batch_header(transactions)
 
         signature = self._signer.sign(header)
 
-        batch = Batch(
+        return Batch(
             header=header,
             transactions=transactions,
             header_signature=signature)
 
-        return BatchList(batches=[batch])
-
-
+    def _create_batch_header(self, transactions):
+        transaction_signatures = [t.header_signature for t in transactions]
 
+        return BatchHeader(
+            signer_public_key=self._public_key,
+            transaction_ids=transaction_signatures
+        ).SerializeToString()
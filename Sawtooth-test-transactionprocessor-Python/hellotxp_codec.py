@@ -0,0 +1,710 @@
+"""
+Binary wire formats shared by the hellotxp client and transaction processor.
+
+Family version 0.1 carries a utf-8 csv payload
+(name,action,batchnr,volume,latlong,username). Family version 1.0 carries
+the binary payload below, whose first byte is the payload format version
+so the format can evolve without another family version. All integers are
+little endian and strings are utf-8, prefixed with their length as an
+unsigned 16 bit integer.
+
+Payload format 1, one action on one harvest batch:
+    B   payload format version (1)
+    B   action code, the index of the action in ACTIONS
+    q   batchnr
+    d   volume
+    d   latlong
+    H   name length, followed by the name
+    H   username length, followed by the username
+
+Payload format 2, actions on several harvest batches applied in order:
+    B   payload format version (2)
+    H   number of actions, then for each action the fields of payload
+        format 1 from the action code on
+
+Payload format 3 replaces latlong with separate coordinates:
+    B   payload format version (3)
+    H   number of actions, then for each action:
+        B   action code
+        q   batchnr
+        d   volume
+        d   latitude
+        d   longitude
+        H   name length, followed by the name
+        H   username length, followed by the username
+
+Payload format 4 adds update deltas. Create and delete actions keep the
+fields of payload format 3; an update carries the fields it changes only:
+    B   payload format version (4)
+    H   number of actions, then for each action:
+        B   action code
+        for create and delete, the fields of payload format 3 from
+        batchnr on; for update:
+        B   field mask, the FIELD_* bits of the fields that follow
+        q   expected revision of the batch, or NO_REVISION
+        H   name length, followed by the name
+        q   batchnr, if FIELD_BATCHNR
+        d   volume, if FIELD_VOLUME
+        d   latitude, if FIELD_LOCATION
+        d   longitude, if FIELD_LOCATION
+        H   owner length, followed by the owner, if FIELD_OWNER
+
+Payload format 5 carries the stored values a delete or an update
+replaces, so its transaction can declare the exact index records it
+changes (see hellotxp_addressing.index_addresses); the transaction
+processor rejects the action when they differ from the stored batch.
+Create actions keep the fields of payload format 3, and so does a delete,
+with the batchnr, latitude, longitude and username of the stored batch.
+An update carries the fields of payload format 4, followed by the stored
+values of the indexed fields it changes:
+    B   payload format version (5)
+    H   number of actions, then for each action:
+        B   action code
+        for create and delete, the fields of payload format 3 from
+        batchnr on; for update, the fields of payload format 4 from the
+        field mask on, followed by
+        q   stored batchnr, if FIELD_BATCHNR
+        d   stored latitude, if FIELD_LOCATION
+        d   stored longitude, if FIELD_LOCATION
+        H   stored owner length, followed by the owner, if FIELD_OWNER
+
+Updates in earlier payload formats have an empty field mask and change
+nothing.
+
+The csv payload and payload formats 1 and 2 carry a single latlong value.
+It decodes as the latitude with a NaN longitude, which marks a batch
+without a known position.
+
+State entries hold the harvest batches stored at one address. Entries
+written before state format 1 are utf-8 text (name,batchnr,volume,latlong
+records joined by |); their first byte is printable, so it never equals a
+state format version. Family version 0.1 transactions still write that
+text format, see encode_text_state, so existing chains replay to the same
+state.
+
+State format 1:
+    B   state format version (1)
+    H   number of harvest batches, then for each batch:
+        q   batchnr
+        d   volume
+        d   latlong
+        H   name length, followed by the name
+
+State format 2 adds the owner, the username that created the batch:
+    B   state format version (2)
+    H   number of harvest batches, then for each batch the fields of
+        state format 1, followed by
+        H   owner length, followed by the owner
+
+State format 3 replaces latlong with separate coordinates:
+    B   state format version (3)
+    H   number of harvest batches, then for each batch:
+        q   batchnr
+        d   volume
+        d   latitude
+        d   longitude
+        H   name length, followed by the name
+        H   owner length, followed by the owner
+
+State format 4 adds the revision of every batch, which starts at 0 and
+counts the updates applied to it:
+    B   state format version (4)
+    H   number of harvest batches, then for each batch:
+        q   batchnr
+        d   volume
+        d   latitude
+        d   longitude
+        Q   revision
+        H   name length, followed by the name
+        H   owner length, followed by the owner
+
+Index entries map a batchnr or a username to the names of the harvest
+batches holding it. They live at index addresses (see INDEX_KINDS) next
+to the harvest batch entries, and their first byte tells them apart:
+    B   index format version (16)
+    H   number of keys, then for each key:
+        H   key length, followed by the key
+        H   number of names, then for each name
+            H   name length, followed by the name
+
+Location index entries hold the harvest batches in one cell of the
+location grid (see hellotxp_geo) with their coordinates, so queries can
+filter them without reading the batches:
+    B   location index format version (17)
+    H   number of harvest batches, then for each batch:
+        d   latitude
+        d   longitude
+        H   name length, followed by the name
+"""
+import math
+import struct
+
+CSV_FAMILY_VERSION = '0.1'
+BINARY_FAMILY_VERSION = '1.0'
+
+PAYLOAD_FORMAT_V1 = 1
+PAYLOAD_FORMAT_V2 = 2
+PAYLOAD_FORMAT_V3 = 3
+PAYLOAD_FORMAT_V4 = 4
+PAYLOAD_FORMAT_V5 = 5
+STATE_FORMAT_V1 = 1
+STATE_FORMAT_V2 = 2
+STATE_FORMAT_V3 = 3
+STATE_FORMAT_V4 = 4
+INDEX_FORMAT_V1 = 16
+GEO_INDEX_FORMAT_V1 = 17
+
+# Longitude of batches stored with a single latlong value, see above.
+NO_LONGITUDE = math.nan
+
+# Fields an update changes, the bits of its field mask.
+FIELD_BATCHNR = 1
+FIELD_VOLUME = 2
+FIELD_LOCATION = 4
+FIELD_OWNER = 8
+UPDATE_FIELDS = FIELD_BATCHNR | FIELD_VOLUME | FIELD_LOCATION | FIELD_OWNER
+# Fields the transaction processor keeps index records of.
+INDEXED_FIELDS = FIELD_BATCHNR | FIELD_LOCATION | FIELD_OWNER
+
+# Expected revision of an update that applies to any revision.
+NO_REVISION = -1
+
+# Secondary indexes kept by the transaction processor, with the two hex
+# characters that follow the namespace prefix in their addresses. Harvest
+# batches follow the prefix with BATCH_KIND.
+INDEX_BATCHNR = 'batchnr'
+INDEX_USER = 'user'
+INDEX_LOCATION = 'location'
+INDEX_KINDS = {INDEX_BATCHNR: '01', INDEX_USER: '02', INDEX_LOCATION: '03'}
+BATCH_KIND = '00'
+
+# Names of the form <co-op>/<batch> are grouped by co-op: the batches of a
+# co-op share an address prefix. Other names form a group of their own.
+GROUP_SEPARATOR = '/'
+
+ACTIONS = ('create', 'delete', 'update', 'list')
+_ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+
+_OPERATION = struct.Struct('<BqddH')
+_OPERATION_V3 = struct.Struct('<BqdddH')
+_UPDATE_HEADER = struct.Struct('<BBqH')
+_BATCHNR = struct.Struct('<q')
+_VOLUME = struct.Struct('<d')
+_LOCATION = struct.Struct('<dd')
+_LENGTH = struct.Struct('<H')
+_PAYLOAD_V2_HEADER = struct.Struct('<BH')
+_STATE_RECORD_V1 = struct.Struct('<qddH')
+_STATE_RECORD_V3 = struct.Struct('<qdddH')
+_STATE_RECORD_V4 = struct.Struct('<qdddQH')
+_STATE_HEADER = struct.Struct('<BH')
+_INDEX_HEADER = struct.Struct('<BH')
+_GEO_RECORD = struct.Struct('<ddH')
+
+
+class CodecError(ValueError):
+    pass
+
+
+def legacy_layout(payload, family_version):
+    """
+    :param payload: transaction payload bytes
+    :param family_version: family_version from the transaction header
+    :return: True if the transaction addresses state in the layout used
+        before payload format 5, with one address per batch name and per
+        index key
+    """
+    return family_version != BINARY_FAMILY_VERSION or \
+        not payload or payload[0] < PAYLOAD_FORMAT_V5
+
+
+def encode_payload(name, action, batchnr, volume, latitude, longitude,
+                   username, fields=0, expected_revision=NO_REVISION,
+                   stored=None, payload_format=PAYLOAD_FORMAT_V5):
+    """
+    encode one action as a payload, see encode_payloads
+    :return: payload bytes
+    """
+    return encode_payloads(
+        [(name, action, batchnr, volume, latitude, longitude, username,
+          fields, expected_revision, stored)], payload_format)
+
+
+def encode_payloads(operations, payload_format=PAYLOAD_FORMAT_V5):
+    """
+    encode actions on one or more harvest batches as a payload format 5
+    payload
+    :param operations: list of
+        (name, action, batchnr, volume, latitude, longitude, username),
+        optionally followed by the field mask and expected revision of an
+        update and by stored, the (batchnr, latitude, longitude, owner) of
+        the batch an update replaces. An update writes only the fields in
+        its mask, with username as the new owner. A delete carries the
+        stored values in its own fields.
+    :param payload_format: PAYLOAD_FORMAT_V4 leaves out the stored values
+    :return: payload bytes
+    """
+    if not operations or len(operations) > 0xffff:
+        raise CodecError('Invalid number of actions: {}'.format(len(operations)))
+    if payload_format not in (PAYLOAD_FORMAT_V4, PAYLOAD_FORMAT_V5):
+        raise CodecError(
+            'Unsupported payload format: {}'.format(payload_format))
+
+    parts = [_PAYLOAD_V2_HEADER.pack(payload_format, len(operations))]
+    parts.extend(_encode_operation(payload_format, *operation)
+                 for operation in operations)
+    return b''.join(parts)
+
+
+def decode_payload(data):
+    """
+    decode a binary payload of any payload format
+    :param data: payload bytes
+    :return: list of
+        (name, action, batchnr, volume, latitude, longitude, username,
+        fields, expected_revision, stored). Fields an update leaves
+        unchanged are 0, NaN or ''. stored is the (batchnr, latitude,
+        longitude, owner) a payload format 5 delete or update replaces,
+        with the same placeholders for fields the update leaves alone, and
+        None before payload format 5.
+    """
+    if not data:
+        raise CodecError('Empty payload')
+
+    try:
+        if data[0] == PAYLOAD_FORMAT_V1:
+            operation, offset = _decode_operation(data, 1)
+            operations = [operation]
+        elif data[0] in (PAYLOAD_FORMAT_V2, PAYLOAD_FORMAT_V3,
+                         PAYLOAD_FORMAT_V4, PAYLOAD_FORMAT_V5):
+            decode_operation = _decode_operation
+            if data[0] == PAYLOAD_FORMAT_V3:
+                decode_operation = _decode_operation_v3
+            elif data[0] == PAYLOAD_FORMAT_V4:
+                decode_operation = _decode_operation_v4
+            elif data[0] == PAYLOAD_FORMAT_V5:
+                decode_operation = _decode_operation_v5
+            _, count = _PAYLOAD_V2_HEADER.unpack_from(data)
+            offset = _PAYLOAD_V2_HEADER.size
+            operations = []
+            for _ in range(count):
+                operation, offset = decode_operation(data, offset)
+                operations.append(operation)
+        else:
+            raise CodecError('Unsupported payload format: {}'.format(data[0]))
+    except (struct.error, UnicodeDecodeError, IndexError) as err:
+        raise CodecError('Invalid payload serialization: {}'.format(err))
+
+    if offset != len(data):
+        raise CodecError('Invalid payload serialization: wrong length')
+
+    return operations
+
+
+def _encode_operation(payload_format, name, action, batchnr, volume,
+                      latitude, longitude, username, fields=0,
+                      expected_revision=NO_REVISION, stored=None):
+    if action == 'update':
+        update = _encode_update(name, batchnr, volume, latitude, longitude,
+                                username, fields, expected_revision)
+        if payload_format == PAYLOAD_FORMAT_V5:
+            update += _encode_stored(fields, stored)
+        return update
+
+    encoded_name = _encode_str(name)
+    try:
+        head = _OPERATION_V3.pack(
+            _ACTION_CODES[action], int(batchnr), float(volume),
+            float(latitude), float(longitude), len(encoded_name))
+    except KeyError:
+        raise CodecError('Invalid Action: {}'.format(action))
+    except struct.error as err:
+        raise CodecError('Invalid payload field: {}'.format(err))
+
+    return b''.join([head, encoded_name, _pack_str(username)])
+
+
+def _encode_update(name, batchnr, volume, latitude, longitude, owner,
+                   fields, expected_revision):
+    if fields & ~UPDATE_FIELDS:
+        raise CodecError('Invalid update fields: {}'.format(fields))
+
+    encoded_name = _encode_str(name)
+    try:
+        parts = [_UPDATE_HEADER.pack(
+            _ACTION_CODES['update'], fields, int(expected_revision),
+            len(encoded_name)), encoded_name]
+        if fields & FIELD_BATCHNR:
+            parts.append(_BATCHNR.pack(int(batchnr)))
+        if fields & FIELD_VOLUME:
+            parts.append(_VOLUME.pack(float(volume)))
+        if fields & FIELD_LOCATION:
+            parts.append(_LOCATION.pack(float(latitude), float(longitude)))
+    except struct.error as err:
+        raise CodecError('Invalid payload field: {}'.format(err))
+    if fields & FIELD_OWNER:
+        parts.append(_pack_str(owner))
+
+    return b''.join(parts)
+
+
+def _encode_stored(fields, stored):
+    if not fields & INDEXED_FIELDS:
+        return b''
+    if stored is None:
+        raise CodecError('An update of indexed fields needs the stored values')
+
+    batchnr, latitude, longitude, owner = stored
+    parts = []
+    try:
+        if fields & FIELD_BATCHNR:
+            parts.append(_BATCHNR.pack(int(batchnr)))
+        if fields & FIELD_LOCATION:
+            parts.append(_LOCATION.pack(float(latitude), float(longitude)))
+    except struct.error as err:
+        raise CodecError('Invalid payload field: {}'.format(err))
+    if fields & FIELD_OWNER:
+        parts.append(_pack_str(owner))
+
+    return b''.join(parts)
+
+
+def _decode_operation_v5(data, offset):
+    operation, offset = _decode_operation_v4(data, offset)
+    _, action, batchnr, _, latitude, longitude, username, fields = \
+        operation[:8]
+    if action == 'create':
+        return operation, offset
+    if action != 'update':
+        return operation[:9] + ((batchnr, latitude, longitude, username),), \
+            offset
+
+    batchnr = 0
+    latitude = longitude = NO_LONGITUDE
+    owner = ''
+    if fields & FIELD_BATCHNR:
+        (batchnr,) = _BATCHNR.unpack_from(data, offset)
+        offset += _BATCHNR.size
+    if fields & FIELD_LOCATION:
+        latitude, longitude = _LOCATION.unpack_from(data, offset)
+        offset += _LOCATION.size
+    if fields & FIELD_OWNER:
+        owner, offset = _unpack_str(data, offset)
+
+    return operation[:9] + ((batchnr, latitude, longitude, owner),), offset
+
+
+def _decode_operation_v4(data, offset):
+    if data[offset] != _ACTION_CODES['update']:
+        return _decode_operation_v3(data, offset)
+
+    _, fields, expected_revision, name_length = \
+        _UPDATE_HEADER.unpack_from(data, offset)
+    if fields & ~UPDATE_FIELDS:
+        raise CodecError('Invalid update fields: {}'.format(fields))
+    start = offset + _UPDATE_HEADER.size
+    offset = start + name_length
+    name = data[start:offset].decode('utf-8')
+
+    batchnr = 0
+    volume = 0.0
+    latitude = longitude = NO_LONGITUDE
+    owner = ''
+    if fields & FIELD_BATCHNR:
+        (batchnr,) = _BATCHNR.unpack_from(data, offset)
+        offset += _BATCHNR.size
+    if fields & FIELD_VOLUME:
+        (volume,) = _VOLUME.unpack_from(data, offset)
+        offset += _VOLUME.size
+    if fields & FIELD_LOCATION:
+        latitude, longitude = _LOCATION.unpack_from(data, offset)
+        offset += _LOCATION.size
+    if fields & FIELD_OWNER:
+        owner, offset = _unpack_str(data, offset)
+
+    return (name, 'update', batchnr, volume, latitude, longitude, owner,
+            fields, expected_revision, None), offset
+
+
+def _decode_operation_v3(data, offset):
+    action_code, batchnr, volume, latitude, longitude, name_length = \
+        _OPERATION_V3.unpack_from(data, offset)
+    start = offset + _OPERATION_V3.size
+    name_end = start + name_length
+    username, end = _unpack_str(data, name_end)
+
+    name = data[start:name_end].decode('utf-8')
+    return (name, ACTIONS[action_code], batchnr, volume, latitude, longitude,
+            username, 0, NO_REVISION, None), end
+
+
+def _decode_operation(data, offset):
+    # payload formats 1 and 2
+    action_code, batchnr, volume, latlong, name_length = \
+        _OPERATION.unpack_from(data, offset)
+    start = offset + _OPERATION.size
+    name_end = start + name_length
+    username, end = _unpack_str(data, name_end)
+
+    name = data[start:name_end].decode('utf-8')
+    return (name, ACTIONS[action_code], batchnr, volume, latlong,
+            NO_LONGITUDE, username, 0, NO_REVISION, None), end
+
+
+def encode_state(batches):
+    """
+    encode harvest batches as a state format 4 entry, sorted by name
+    :param batches: iterable of
+        (name, batchnr, volume, latitude, longitude, owner, revision)
+    :return: state entry bytes
+    """
+    records = sorted(batches, key=lambda batch: batch[0])
+    if len(records) > 0xffff:
+        raise CodecError('Too many batches at one address: {}'.format(len(records)))
+
+    parts = [_STATE_HEADER.pack(STATE_FORMAT_V4, len(records))]
+    try:
+        for name, batchnr, volume, latitude, longitude, owner, revision \
+                in records:
+            encoded_name = _encode_str(name)
+            parts.append(_STATE_RECORD_V4.pack(
+                int(batchnr), float(volume), float(latitude), float(longitude),
+                int(revision), len(encoded_name)))
+            parts.append(encoded_name)
+            parts.append(_pack_str(owner))
+    except struct.error as err:
+        raise CodecError('Invalid state field: {}'.format(err))
+
+    return b''.join(parts)
+
+
+def encode_text_state(batches):
+    """
+    encode harvest batches in the text format of family version 0.1
+    :param batches: iterable of (name, batchnr, volume, latlong), the
+        numbers as the text the csv payload carried them in
+    :return: state entry bytes
+    """
+    return "|".join(sorted(",".join(batch) for batch in batches)).encode()
+
+
+def decode_state(data):
+    """
+    decode a harvest batch state entry in any state format or the legacy
+    text format. Batches stored before state format 2 have owner '',
+    before state format 3 a NaN longitude and before state format 4
+    revision 0.
+    :param data: state entry bytes
+    :return: list of
+        (name, batchnr, volume, latitude, longitude, owner, revision)
+    """
+    if not data:
+        return []
+    if is_index_entry(data):
+        raise CodecError('Not a harvest batch entry: index entry')
+    if data[0] in (STATE_FORMAT_V3, STATE_FORMAT_V4):
+        return _decode_state_v3(data)
+    if data[0] not in (STATE_FORMAT_V1, STATE_FORMAT_V2):
+        return _decode_text_state(data)
+
+    has_owner = data[0] == STATE_FORMAT_V2
+    owner = ''
+    batches = []
+    unpack_record = _STATE_RECORD_V1.unpack_from
+    record_size = _STATE_RECORD_V1.size
+    try:
+        _, count = _STATE_HEADER.unpack_from(data)
+        offset = _STATE_HEADER.size
+        for _ in range(count):
+            batchnr, volume, latlong, name_length = unpack_record(data, offset)
+            offset += record_size
+            end = offset + name_length
+            name = data[offset:end].decode('utf-8')
+            offset = end
+            if has_owner:
+                owner, offset = _unpack_str(data, offset)
+            batches.append(
+                (name, batchnr, volume, latlong, NO_LONGITUDE, owner, 0))
+    except (struct.error, UnicodeDecodeError) as err:
+        raise CodecError('Invalid state serialization: {}'.format(err))
+
+    if offset != len(data):
+        raise CodecError('Invalid state serialization: wrong length')
+
+    return batches
+
+
+def _decode_state_v3(data):
+    # state formats 3 and 4
+    has_revision = data[0] == STATE_FORMAT_V4
+    revision = 0
+    batches = []
+    record = _STATE_RECORD_V4 if has_revision else _STATE_RECORD_V3
+    unpack_record = record.unpack_from
+    record_size = record.size
+    try:
+        _, count = _STATE_HEADER.unpack_from(data)
+        offset = _STATE_HEADER.size
+        for _ in range(count):
+            if has_revision:
+                batchnr, volume, latitude, longitude, revision, name_length = \
+                    unpack_record(data, offset)
+            else:
+                batchnr, volume, latitude, longitude, name_length = \
+                    unpack_record(data, offset)
+            offset += record_size
+            end = offset + name_length
+            name = data[offset:end].decode('utf-8')
+            owner, offset = _unpack_str(data, end)
+            batches.append(
+                (name, batchnr, volume, latitude, longitude, owner, revision))
+    except (struct.error, UnicodeDecodeError) as err:
+        raise CodecError('Invalid state serialization: {}'.format(err))
+
+    if offset != len(data):
+        raise CodecError('Invalid state serialization: wrong length')
+
+    return batches
+
+
+def is_index_entry(data):
+    """
+    :return: True if the state entry data is an index or location index
+        entry
+    """
+    return bool(data) and data[0] in (INDEX_FORMAT_V1, GEO_INDEX_FORMAT_V1)
+
+
+def encode_index(index):
+    """
+    encode an index entry, keys and names sorted
+    :param index: dict of key to an iterable of harvest batch names
+    :return: state entry bytes
+    """
+    if len(index) > 0xffff:
+        raise CodecError('Too many keys at one address: {}'.format(len(index)))
+
+    parts = [_INDEX_HEADER.pack(INDEX_FORMAT_V1, len(index))]
+    for key in sorted(index):
+        names = sorted(index[key])
+        if len(names) > 0xffff:
+            raise CodecError('Too many names for key {}: {}'.format(key, len(names)))
+        parts.append(_pack_str(key))
+        parts.append(_LENGTH.pack(len(names)))
+        parts.extend(_pack_str(name) for name in names)
+
+    return b''.join(parts)
+
+
+def decode_index(data):
+    """
+    decode an index entry
+    :param data: state entry bytes
+    :return: dict of key to the list of harvest batch names
+    """
+    if not data or data[0] != INDEX_FORMAT_V1:
+        raise CodecError('Not an index entry')
+
+    index = {}
+    try:
+        _, count = _INDEX_HEADER.unpack_from(data)
+        offset = _INDEX_HEADER.size
+        for _ in range(count):
+            key, offset = _unpack_str(data, offset)
+            (name_count,) = _LENGTH.unpack_from(data, offset)
+            offset += _LENGTH.size
+            names = []
+            for _ in range(name_count):
+                name, offset = _unpack_str(data, offset)
+                names.append(name)
+            index[key] = names
+    except (struct.error, UnicodeDecodeError) as err:
+        raise CodecError('Invalid index serialization: {}'.format(err))
+
+    if offset != len(data):
+        raise CodecError('Invalid index serialization: wrong length')
+
+    return index
+
+
+def encode_geo_index(locations):
+    """
+    encode a location index entry, sorted by name
+    :param locations: dict of harvest batch name to (latitude, longitude)
+    :return: state entry bytes
+    """
+    if len(locations) > 0xffff:
+        raise CodecError('Too many batches in one cell: {}'.format(len(locations)))
+
+    parts = [_INDEX_HEADER.pack(GEO_INDEX_FORMAT_V1, len(locations))]
+    for name in sorted(locations):
+        latitude, longitude = locations[name]
+        encoded_name = _encode_str(name)
+        parts.append(_GEO_RECORD.pack(latitude, longitude, len(encoded_name)))
+        parts.append(encoded_name)
+
+    return b''.join(parts)
+
+
+def decode_geo_index(data):
+    """
+    decode a location index entry
+    :param data: state entry bytes
+    :return: dict of harvest batch name to (latitude, longitude)
+    """
+    if not data or data[0] != GEO_INDEX_FORMAT_V1:
+        raise CodecError('Not a location index entry')
+
+    locations = {}
+    try:
+        _, count = _INDEX_HEADER.unpack_from(data)
+        offset = _INDEX_HEADER.size
+        for _ in range(count):
+            latitude, longitude, name_length = \
+                _GEO_RECORD.unpack_from(data, offset)
+            offset += _GEO_RECORD.size
+            end = offset + name_length
+            locations[data[offset:end].decode('utf-8')] = (latitude, longitude)
+            offset = end
+    except (struct.error, UnicodeDecodeError) as err:
+        raise CodecError('Invalid location index serialization: {}'.format(err))
+
+    if offset != len(data):
+        raise CodecError('Invalid location index serialization: wrong length')
+
+    return locations
+
+
+def _decode_text_state(data):
+    batches = []
+    try:
+        for batch in data.decode().split("|"):
+            name, batchnr, volume, latlong = batch.split(",")
+            batches.append((name, int(batchnr), float(volume), float(latlong),
+                            NO_LONGITUDE, '', 0))
+    except ValueError as err:
+        raise CodecError('Invalid state serialization: {}'.format(err))
+
+    return batches
+
+
+def _encode_str(value):
+    if not isinstance(value, str):
+        raise CodecError('Expected a string, not {!r}'.format(value))
+    encoded = value.encode('utf-8')
+    if len(encoded) > 0xffff:
+        raise CodecError('String too long: {} bytes'.format(len(encoded)))
+    return encoded
+
+
+def _pack_str(value):
+    encoded = _encode_str(value)
+    return _LENGTH.pack(len(encoded)) + encoded
+
+
+def _unpack_str(data, offset):
+    (length,) = _LENGTH.unpack_from(data, offset)
+    start = offset + _LENGTH.size
+    end = start + length
+    if end > len(data):
+        raise struct.error('string runs past the end of the entry')
+    return data[start:end].decode('utf-8'), end
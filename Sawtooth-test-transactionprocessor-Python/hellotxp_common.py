@@ -0,0 +1,338 @@
+"""
+Helpers shared by hellotxpClient, AsyncHellotxpClient and snapshots: REST
+API urls and headers, the prefixes of a listing, the index and location
+lookups behind find, within and near, the operations sent for updates
+with the stored values sent along, and the status dicts reported for
+bulk submissions.
+"""
+from base64 import b64encode
+
+from hellotxp_codec import CodecError
+from hellotxp_codec import decode_geo_index
+from hellotxp_codec import decode_index
+from hellotxp_codec import decode_state
+from hellotxp_codec import FIELD_BATCHNR
+from hellotxp_codec import FIELD_LOCATION
+from hellotxp_codec import FIELD_OWNER
+from hellotxp_codec import FIELD_VOLUME
+from hellotxp_codec import INDEX_BATCHNR
+from hellotxp_codec import INDEX_USER
+from hellotxp_codec import INDEXED_FIELDS
+from hellotxp_codec import NO_LONGITUDE
+from hellotxp_codec import NO_REVISION
+from hellotxp_exceptions import HellotxpException
+from hellotxp_geo import covering_cells
+from hellotxp_geo import distance_km
+from hellotxp_geo import in_box
+from hellotxp_geo import radius_boxes
+from hellotxp_geo import valid_position
+
+# Operations packed into one transaction at most.
+MAX_OPERATIONS_PER_TRANSACTION = 1000
+
+
+def make_url(base_url, suffix):
+    if base_url.startswith("http://"):
+        return "{}/{}".format(base_url, suffix)
+    return "http://{}/{}".format(base_url, suffix)
+
+
+def make_headers(content_type=None, auth_user=None, auth_password=None):
+    headers = {}
+    if auth_user is not None:
+        auth_string = "{}:{}".format(auth_user, auth_password)
+        b64_string = b64encode(auth_string.encode()).decode()
+        auth_header = 'Basic {}'.format(b64_string)
+        headers['Authorization'] = auth_header
+
+    if content_type is not None:
+        headers['Content-Type'] = content_type
+
+    return headers
+
+
+def list_queries(prefixes, start=None):
+    """
+    the address prefixes of a listing, each with the position to list it
+    from
+    :param prefixes: sorted address prefixes, see
+        hellotxp_addressing.batch_prefixes
+    :param start: address to resume the listing at, None from the start
+    :return: list of (prefix, start position or None)
+    """
+    queries = []
+    for prefix in prefixes:
+        if start is not None and start.startswith(prefix):
+            queries.append((prefix, start))
+        elif start is None or prefix > start:
+            queries.append((prefix, None))
+    return queries
+
+
+def index_lookup(batchnr, username):
+    """
+    :return: (index kind, key) of a find by batchnr or by username
+    """
+    if (batchnr is None) == (username is None):
+        raise HellotxpException('Find by exactly one of batchnr or username')
+    if batchnr is not None:
+        return INDEX_BATCHNR, str(int(batchnr))
+    return INDEX_USER, username
+
+
+def index_names(data, key):
+    try:
+        return sorted(decode_index(data).get(key, []))
+    except CodecError as err:
+        raise HellotxpException(err)
+
+
+def location_queries(boxes):
+    """
+    the location index cells to read for bounding box queries
+    :param boxes: list of (min_lat, min_lon, max_lat, max_lon)
+    :return: list of (box, cell prefix)
+    """
+    for min_lat, min_lon, max_lat, max_lon in boxes:
+        if not (valid_position(min_lat, min_lon) and
+                valid_position(max_lat, max_lon) and
+                min_lat <= max_lat and min_lon <= max_lon):
+            raise HellotxpException('Invalid bounding box: {}, {}, {}, {}'.format(
+                min_lat, min_lon, max_lat, max_lon))
+    return [(box, cell) for box in boxes for cell in covering_cells(*box)]
+
+
+def add_located(box, data, located):
+    """
+    add the batches of a location index entry that lie in box to the
+    located dict of name to (latitude, longitude)
+    """
+    try:
+        locations = decode_geo_index(data)
+    except CodecError as err:
+        raise HellotxpException(err)
+    for name, location in locations.items():
+        if in_box(location[0], location[1], *box):
+            located[name] = location
+
+
+def near_results(latitude, longitude, radius_km, located):
+    results = []
+    for name, (batch_latitude, batch_longitude) in located.items():
+        distance = distance_km(
+            latitude, longitude, batch_latitude, batch_longitude)
+        if distance <= radius_km:
+            results.append((distance, name, batch_latitude, batch_longitude))
+    return sorted(results)
+
+
+def near_boxes(latitude, longitude, radius_km):
+    if not valid_position(latitude, longitude) or not radius_km >= 0:
+        raise HellotxpException('Invalid location or radius: {}, {}, {}'.format(
+            latitude, longitude, radius_km))
+    return radius_boxes(latitude, longitude, radius_km)
+
+
+def update_operation(name, batchnr, volume, latitude, longitude, owner,
+                     expected_revision):
+    """
+    the operation of an update changing the fields that are not None
+    :return: (name, 'update', batchnr, volume, latitude, longitude, owner,
+        fields, expected_revision)
+    """
+    fields = 0
+    if batchnr is not None:
+        fields |= FIELD_BATCHNR
+    if volume is not None:
+        fields |= FIELD_VOLUME
+    if (latitude is None) != (longitude is None):
+        raise HellotxpException('Update latitude and longitude together')
+    if latitude is not None:
+        if not valid_position(latitude, longitude):
+            raise HellotxpException('Invalid location: {}, {}'.format(
+                latitude, longitude))
+        fields |= FIELD_LOCATION
+    if owner is not None:
+        fields |= FIELD_OWNER
+    if not fields:
+        raise HellotxpException('Nothing to update')
+
+    return (
+        name,
+        'update',
+        0 if batchnr is None else batchnr,
+        0.0 if volume is None else volume,
+        NO_LONGITUDE if latitude is None else latitude,
+        NO_LONGITUDE if longitude is None else longitude,
+        '' if owner is None else owner,
+        fields,
+        NO_REVISION if expected_revision is None else expected_revision,
+    )
+
+
+def stored_names(operations):
+    """
+    the harvest batches to read for resolve_operations: those deleted or
+    updated before any create of them in operations
+    :return: list of names, without duplicates
+    """
+    created = set()
+    names = {}
+    for operation in operations:
+        name, action = operation[:2]
+        if action == 'create':
+            created.add(name)
+        elif name not in created and action in ('delete', 'update'):
+            names[name] = None
+    return list(names)
+
+
+def stored_values(data, name):
+    """
+    :param data: the state entry holding name, as show returns it
+    :return: (batchnr, latitude, longitude, owner) of the harvest batch
+        name, None if the entry does not hold it
+    """
+    try:
+        batches = decode_state(data or b'')
+    except CodecError as err:
+        raise HellotxpException(err)
+    for batch in batches:
+        if batch[0] == name:
+            return batch[1], batch[3], batch[4], batch[5]
+    return None
+
+
+def resolve_operations(operations, stored, legacy=()):
+    """
+    add to every delete, and every update of indexed fields, the stored
+    values it replaces, so its transaction declares the exact index
+    records it changes. Operations on batches created or changed by an
+    earlier operation get the values that operation leaves.
+    :param stored: dict of name to (batchnr, latitude, longitude, owner),
+        or None, for the stored_names of operations
+    :param legacy: names in stored kept in the legacy layout (see
+        hellotxp_addressing). Operations on them are left as they are and
+        go in legacy transactions, until a create of the name.
+    :return: (list of operations, see hellotxp_codec.encode_payloads;
+        list of the operations' legacy flags)
+    """
+    values = dict(stored)
+    legacy = set(legacy)
+    resolved = []
+    layouts = []
+    for operation in operations:
+        name, action, batchnr, volume, latitude, longitude, owner = \
+            operation[:7]
+        if action == 'create':
+            values[name] = (batchnr, latitude, longitude, owner)
+            legacy.discard(name)
+        elif action in ('delete', 'update'):
+            current = values.pop(name, None)
+            if current is None:
+                raise HellotxpException('No such batch: {}'.format(name))
+            if action == 'update':
+                fields = operation[7] if len(operation) > 7 else 0
+                values[name] = (
+                    batchnr if fields & FIELD_BATCHNR else current[0],
+                    latitude if fields & FIELD_LOCATION else current[1],
+                    longitude if fields & FIELD_LOCATION else current[2],
+                    owner if fields & FIELD_OWNER else current[3])
+            # legacy transactions carry no stored values
+            if action == 'delete' and name not in legacy:
+                # a delete carries the stored values in its own fields
+                operation = (name, action, current[0], volume) + \
+                    tuple(current[1:]) + (0, NO_REVISION, current)
+            elif _updates_indexed(operation) and name not in legacy:
+                operation = tuple(operation[:9]) + (current,)
+        resolved.append(operation)
+        layouts.append(name in legacy)
+    return resolved, layouts
+
+
+def _updates_indexed(operation):
+    return operation[1] == 'update' and len(operation) > 7 and \
+        operation[7] & INDEXED_FIELDS
+
+
+def group_records(records, action, records_per_transaction):
+    """
+    turn (name, batchnr, volume, latitude, longitude, username) records into
+    groups of at most records_per_transaction operations, one group per
+    transaction
+    """
+    if not 1 <= records_per_transaction <= MAX_OPERATIONS_PER_TRANSACTION:
+        raise HellotxpException(
+            'records_per_transaction must be between 1 and {}'.format(
+                MAX_OPERATIONS_PER_TRANSACTION))
+
+    operations = [
+        (name, action, batchnr, volume, latitude, longitude, username)
+        for name, batchnr, volume, latitude, longitude, username in records
+    ]
+    return [
+        operations[i:i + records_per_transaction]
+        for i in range(0, len(operations), records_per_transaction)
+    ]
+
+
+def expand_results(groups, results):
+    """
+    turn one status dict per transaction into one per operation, named
+    after the operation's harvest batch
+    """
+    expanded = []
+    for group, result in zip(groups, results):
+        for operation in group:
+            record_result = dict(result)
+            record_result['name'] = operation[0]
+            expanded.append(record_result)
+    return expanded
+
+
+def planned_results(plan, transactions, results):
+    """
+    reorder the status dicts of planned transactions into one per
+    operation, named after the operation's harvest batch
+    :param results: status dicts of the transactions, as collect_results
+        reports them
+    :return: one status dict per operation, in the order of the plan
+    """
+    by_id = {result['transaction_id']: result for result in results}
+    planned = []
+    for operation, transaction in zip(plan.operations, transactions):
+        result = dict(by_id[transaction.header_signature])
+        result['name'] = operation[0]
+        planned.append(result)
+    return planned
+
+
+def collect_results(batches, statuses, failed):
+    """
+    expand batch statuses into one status dict per transaction
+    :param batches: the submitted Batches
+    :param statuses: dict of batch id to its batch_statuses entry
+    :param failed: dict of batch id to the error that kept it from being submitted
+    :return: one status dict per transaction, in submission order
+    """
+    results = []
+    for batch in batches:
+        batch_id = batch.header_signature
+        if batch_id in failed:
+            status = {'status': 'UNKNOWN', 'invalid_transactions': []}
+        else:
+            status = statuses.get(batch_id, {'status': 'UNKNOWN'})
+        invalid = {
+            txn['id']: txn.get('message')
+            for txn in status.get('invalid_transactions') or []
+        }
+        for transaction in batch.transactions:
+            txn_id = transaction.header_signature
+            results.append({
+                'transaction_id': txn_id,
+                'batch_id': batch_id,
+                'status': status['status'],
+                'message': invalid.get(txn_id, failed.get(batch_id)),
+            })
+
+    return results
@@ -0,0 +1,365 @@
+"""
+Waiting for batch commits on validator events instead of polling the
+REST API batch by batch.
+
+An event source yields a BlockCommit for every block the validator
+commits, with the ids of the batches in it. CommitWaiter follows an event
+source on a background thread and resolves the batch ids being waited on
+as their blocks arrive. Invalid batches never show up in a block, so the
+batches still pending are polled with one batch_statuses request every
+poll_interval seconds; if the event source fails, waits fall back to
+polling altogether.
+
+ZmqEventSource subscribes to sawtooth/block-commit events and to the
+sawtooth/state-delta events of the hellotxp namespace on the validator's
+client endpoint. Every valid hellotxp batch changes state in the
+namespace, so only blocks with a state delta are fetched to read their
+batch ids. LocalEventSource is an in-process stand-in fed by commit().
+"""
+import collections
+import logging
+import queue
+import threading
+import time
+import uuid
+
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
+from sawtooth_sdk.protobuf.block_pb2 import BlockHeader
+from sawtooth_sdk.protobuf.client_block_pb2 import ClientBlockGetByIdRequest
+from sawtooth_sdk.protobuf.client_block_pb2 import ClientBlockGetResponse
+from sawtooth_sdk.protobuf.client_event_pb2 import ClientEventsSubscribeRequest
+from sawtooth_sdk.protobuf.client_event_pb2 import ClientEventsSubscribeResponse
+from sawtooth_sdk.protobuf.client_event_pb2 import ClientEventsUnsubscribeRequest
+from sawtooth_sdk.protobuf.events_pb2 import EventFilter
+from sawtooth_sdk.protobuf.events_pb2 import EventList
+from sawtooth_sdk.protobuf.events_pb2 import EventSubscription
+from sawtooth_sdk.protobuf.network_pb2 import PingResponse
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+from hellotxp_exceptions import HellotxpException
+
+LOGGER = logging.getLogger(__name__)
+
+# Seconds between batch_statuses polls of the batches events have not
+# resolved, such as invalid batches.
+DEFAULT_POLL_INTERVAL = 5.0
+
+# Seconds to wait for the validator to answer a request.
+DEFAULT_REQUEST_TIMEOUT = 10.0
+
+# Milliseconds an idle event source waits for a message before checking
+# whether it was closed.
+_RECEIVE_POLL_MS = 200
+
+BlockCommit = collections.namedtuple(
+    'BlockCommit', ['block_id', 'block_num', 'batch_ids'])
+
+
+def _committed_status(batch_id):
+    return {'id': batch_id, 'status': 'COMMITTED', 'invalid_transactions': []}
+
+
+def _pending_status(batch_id):
+    return {'id': batch_id, 'status': 'PENDING', 'invalid_transactions': []}
+
+
+class CommitWaiter(object):
+    def __init__(self, source, poll_interval=DEFAULT_POLL_INTERVAL):
+        """
+        :param source: event source, whose commits() yields BlockCommits
+            until its close() is called
+        """
+        self.poll_interval = poll_interval
+        self._source = source
+        self._condition = threading.Condition()
+        # batch id to True once committed, for the batches watched
+        self._watched = {}
+        self._error = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='hellotxp-commit-waiter', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._source.close()
+        if self._thread is not None:
+            self._thread.join(timeout=DEFAULT_REQUEST_TIMEOUT)
+            self._thread = None
+
+    def watch(self, batch_ids):
+        """
+        start tracking batches before submitting them, so commits that
+        arrive before wait is called are not missed
+        """
+        with self._condition:
+            for batch_id in batch_ids:
+                self._watched.setdefault(batch_id, False)
+
+    def forget(self, batch_ids):
+        with self._condition:
+            for batch_id in batch_ids:
+                self._watched.pop(batch_id, None)
+
+    def wait(self, batch_ids, timeout, poll):
+        """
+        wait up to timeout seconds for batches to leave PENDING
+        :param poll: function of (batch ids, wait) returning a dict of
+            batch id to status entry from the REST API, used for the
+            batches events do not resolve
+        :return: dict of batch id to status entry
+        """
+        deadline = time.time() + timeout
+        next_poll = time.time() + self.poll_interval
+        pending = set(batch_ids)
+        statuses = {}
+        self.watch(batch_ids)
+
+        try:
+            while pending:
+                with self._condition:
+                    self._condition.wait_for(
+                        lambda: self._error is not None or
+                        any(self._watched.get(b) for b in pending),
+                        timeout=max(0, min(deadline, next_poll) - time.time()))
+                    committed = [b for b in pending if self._watched.get(b)]
+                    error = self._error
+
+                for batch_id in committed:
+                    statuses[batch_id] = _committed_status(batch_id)
+                    pending.discard(batch_id)
+                if not pending:
+                    break
+
+                now = time.time()
+                if error is not None:
+                    statuses.update(
+                        poll(sorted(pending), max(0, int(deadline - now))))
+                    break
+                if now < next_poll and now < deadline:
+                    continue
+
+                polled = poll(sorted(pending), None)
+                for batch_id, entry in polled.items():
+                    if batch_id in pending and entry['status'] != 'PENDING':
+                        statuses[batch_id] = entry
+                        pending.discard(batch_id)
+                if now >= deadline:
+                    for batch_id in pending:
+                        statuses[batch_id] = polled.get(
+                            batch_id, _pending_status(batch_id))
+                    break
+                next_poll = now + self.poll_interval
+        finally:
+            self.forget(batch_ids)
+
+        return statuses
+
+    def _run(self):
+        error = None
+        try:
+            for commit in self._source.commits():
+                LOGGER.debug('Block %s committed with %d batches',
+                             commit.block_num, len(commit.batch_ids))
+                with self._condition:
+                    resolved = False
+                    for batch_id in commit.batch_ids:
+                        if batch_id in self._watched:
+                            self._watched[batch_id] = True
+                            resolved = True
+                    if resolved:
+                        self._condition.notify_all()
+        except Exception as err:
+            LOGGER.warning('Commit events failed, polling instead: %s', err)
+            error = err
+        finally:
+            with self._condition:
+                self._error = error or HellotxpException(
+                    'Commit event source closed')
+                self._condition.notify_all()
+
+
+class LocalEventSource(object):
+    """
+    in-process event source, for running the waiter without a validator
+    """
+
+    def __init__(self):
+        self._commits = queue.Queue()
+
+    def commit(self, block_id, batch_ids, block_num=0):
+        self._commits.put(BlockCommit(block_id, block_num, tuple(batch_ids)))
+
+    def commits(self):
+        while True:
+            commit = self._commits.get()
+            if commit is None:
+                return
+            yield commit
+
+    def close(self):
+        self._commits.put(None)
+
+
+class ZmqEventSource(object):
+    def __init__(self, url, prefix, timeout=DEFAULT_REQUEST_TIMEOUT):
+        """
+        :param url: client endpoint of the validator, e.g. tcp://localhost:4004
+        :param prefix: address prefix of the namespace whose blocks are read
+        """
+        if zmq is None:
+            raise HellotxpException('ZmqEventSource requires the pyzmq package')
+
+        self._url = url
+        self._prefix = prefix
+        self._timeout = timeout
+        self._context = zmq.Context()
+        self._socket = None
+        # messages received while waiting for the answer to a request
+        self._backlog = collections.deque()
+        self._closed = threading.Event()
+
+    def connect(self):
+        """
+        subscribe to the validator's block commit events
+        """
+        self._socket = self._context.socket(zmq.DEALER)
+        self._socket.setsockopt(zmq.LINGER, 0)
+        self._socket.connect(self._url)
+
+        request = ClientEventsSubscribeRequest(subscriptions=[
+            EventSubscription(event_type='sawtooth/block-commit'),
+            EventSubscription(
+                event_type='sawtooth/state-delta',
+                filters=[EventFilter(
+                    key='address',
+                    match_string='^{}.*'.format(self._prefix),
+                    filter_type=EventFilter.REGEX_ANY)]),
+        ])
+        response = ClientEventsSubscribeResponse()
+        try:
+            response.ParseFromString(self._request(
+                Message.CLIENT_EVENTS_SUBSCRIBE_REQUEST, request))
+        except HellotxpException:
+            self._close_socket()
+            raise
+        if response.status != ClientEventsSubscribeResponse.OK:
+            self._close_socket()
+            raise HellotxpException(
+                'Failed to subscribe to events at {}: {}'.format(
+                    self._url, ClientEventsSubscribeResponse.Status.Name(
+                        response.status)))
+
+    def commits(self):
+        if self._socket is None:
+            self.connect()
+
+        try:
+            while not self._closed.is_set():
+                message = self._receive()
+                if message is None or \
+                        message.message_type != Message.CLIENT_EVENTS:
+                    continue
+                commit = self._block_commit(message.content)
+                if commit is not None:
+                    yield commit
+        finally:
+            self._unsubscribe()
+            self._close_socket()
+
+    def close(self):
+        # the socket belongs to the thread running commits(), which
+        # notices within _RECEIVE_POLL_MS
+        self._closed.set()
+
+    def _block_commit(self, content):
+        events = EventList()
+        events.ParseFromString(content)
+
+        block_id = None
+        block_num = None
+        changed = False
+        for event in events.events:
+            if event.event_type == 'sawtooth/block-commit':
+                attributes = {a.key: a.value for a in event.attributes}
+                block_id = attributes.get('block_id')
+                block_num = int(attributes.get('block_num', 0))
+            elif event.event_type == 'sawtooth/state-delta':
+                changed = True
+
+        if block_id is None:
+            return None
+        if not changed:
+            return BlockCommit(block_id, block_num, ())
+        return BlockCommit(block_id, block_num, self._block_batch_ids(block_id))
+
+    def _block_batch_ids(self, block_id):
+        response = ClientBlockGetResponse()
+        response.ParseFromString(self._request(
+            Message.CLIENT_BLOCK_GET_BY_ID_REQUEST,
+            ClientBlockGetByIdRequest(block_id=block_id)))
+        if response.status != ClientBlockGetResponse.OK:
+            raise HellotxpException('Failed to read block {}: {}'.format(
+                block_id, ClientBlockGetResponse.Status.Name(response.status)))
+
+        header = BlockHeader()
+        header.ParseFromString(response.block.header)
+        return tuple(header.batch_ids)
+
+    def _request(self, message_type, request):
+        correlation_id = uuid.uuid4().hex
+        self._socket.send_multipart([Message(
+            message_type=message_type,
+            correlation_id=correlation_id,
+            content=request.SerializeToString()).SerializeToString()])
+
+        deadline = time.time() + self._timeout
+        while time.time() < deadline:
+            message = self._receive(backlog=False)
+            if message is None:
+                continue
+            if message.correlation_id == correlation_id:
+                return message.content
+            self._backlog.append(message)
+
+        raise HellotxpException(
+            'No response from the validator at {}'.format(self._url))
+
+    def _receive(self, backlog=True):
+        if backlog and self._backlog:
+            return self._backlog.popleft()
+        if not self._socket.poll(_RECEIVE_POLL_MS):
+            return None
+
+        message = Message()
+        message.ParseFromString(self._socket.recv_multipart()[-1])
+        if message.message_type == Message.PING_REQUEST:
+            self._socket.send_multipart([Message(
+                message_type=Message.PING_RESPONSE,
+                correlation_id=message.correlation_id,
+                content=PingResponse().SerializeToString()).SerializeToString()])
+            return None
+        return message
+
+    def _unsubscribe(self):
+        if self._socket is None:
+            return
+        try:
+            self._socket.send_multipart([Message(
+                message_type=Message.CLIENT_EVENTS_UNSUBSCRIBE_REQUEST,
+                correlation_id=uuid.uuid4().hex,
+                content=ClientEventsUnsubscribeRequest().SerializeToString()
+            ).SerializeToString()], zmq.NOBLOCK)
+        except zmq.ZMQError:
+            pass
+
+    def _close_socket(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        self._context.term()
@@ -0,0 +1,123 @@
+"""
+Spatial cells of the hellotxp location index, shared by the client and
+the transaction processor.
+
+A location falls into one cell of a geohash-style grid: longitude and
+latitude are each quantized to CELL_BITS bits and the bits interleaved,
+longitude first, into a 2 * CELL_BITS bit cell number written as
+CELL_DIGITS hex characters. Every hex character adds two bits per axis,
+so the first n characters of a cell name the enclosing cell of a grid
+4 ** n cells wide and high. Location index addresses hold the cell
+characters unhashed, which lets a query read a whole enclosing cell with
+one state request for its address prefix.
+"""
+import math
+
+# Bits per axis; 20 bits make cells of about 38 x 19 meters at the equator.
+CELL_BITS = 20
+CELL_DIGITS = CELL_BITS // 2
+
+# Cell prefixes read by one bounding box query at most. Queries use the
+# finest grid that covers the box with this many cells.
+MAX_QUERY_CELLS = 16
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def valid_position(latitude, longitude):
+    """
+    :return: True if latitude and longitude are a location on earth.
+        Batches stored before locations had separate fields have a NaN
+        longitude and no position.
+    """
+    return -90.0 <= latitude <= 90.0 and -180.0 <= longitude <= 180.0
+
+
+def cell_key(latitude, longitude):
+    """
+    :return: the CELL_DIGITS hex characters of the cell of a location
+    """
+    cells = 1 << CELL_BITS
+    return '{:0{}x}'.format(
+        _interleave(_grid(longitude, -180.0, 360.0, cells),
+                    _grid(latitude, -90.0, 180.0, cells),
+                    CELL_BITS),
+        CELL_DIGITS)
+
+
+def covering_cells(min_lat, min_lon, max_lat, max_lon,
+                   max_cells=MAX_QUERY_CELLS):
+    """
+    cell prefixes that together cover a bounding box, from the finest grid
+    needing at most max_cells of them
+    :return: list of hex cell prefixes, [''] for the whole world
+    """
+    best = ['']
+    for digits in range(1, CELL_DIGITS + 1):
+        bits = 2 * digits
+        cells = 1 << bits
+        x_min = _grid(min_lon, -180.0, 360.0, cells)
+        x_max = _grid(max_lon, -180.0, 360.0, cells)
+        y_min = _grid(min_lat, -90.0, 180.0, cells)
+        y_max = _grid(max_lat, -90.0, 180.0, cells)
+        if (x_max - x_min + 1) * (y_max - y_min + 1) > max_cells:
+            break
+        best = [
+            '{:0{}x}'.format(_interleave(x, y, bits), digits)
+            for x in range(x_min, x_max + 1)
+            for y in range(y_min, y_max + 1)
+        ]
+    return best
+
+
+def radius_boxes(latitude, longitude, radius_km):
+    """
+    bounding boxes covering every location within radius_km of a location,
+    two of them if the circle crosses the antimeridian
+    :return: list of (min_lat, min_lon, max_lat, max_lon)
+    """
+    delta = radius_km / KM_PER_DEGREE
+    min_lat = max(-90.0, latitude - delta)
+    max_lat = min(90.0, latitude + delta)
+
+    widest = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if widest <= 0 or delta / widest >= 180.0:
+        return [(min_lat, -180.0, max_lat, 180.0)]
+
+    min_lon = longitude - delta / widest
+    max_lon = longitude + delta / widest
+    if min_lon < -180.0:
+        return [(min_lat, min_lon + 360.0, max_lat, 180.0),
+                (min_lat, -180.0, max_lat, max_lon)]
+    if max_lon > 180.0:
+        return [(min_lat, min_lon, max_lat, 180.0),
+                (min_lat, -180.0, max_lat, max_lon - 360.0)]
+    return [(min_lat, min_lon, max_lat, max_lon)]
+
+
+def in_box(latitude, longitude, min_lat, min_lon, max_lat, max_lon):
+    return min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """
+    :return: great circle distance between two locations in km
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) *
+         math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _grid(value, low, span, cells):
+    return min(cells - 1, max(0, int((value - low) / span * cells)))
+
+
+def _interleave(x, y, bits):
+    code = 0
+    for shift in range(bits - 1, -1, -1):
+        code = (code << 2) | (((x >> shift) & 1) << 1) | ((y >> shift) & 1)
+    return code
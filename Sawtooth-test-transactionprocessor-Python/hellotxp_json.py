@@ -0,0 +1,118 @@
+"""
+Decoders for the JSON responses of the Sawtooth REST API.
+
+A decoder has loads(text), returning the decoded response, and
+iter_items(text, key, fields), yielding the items of the array under the
+top level key one at a time and storing the other top level values in the
+fields dict once the items are exhausted. Both take the complete response
+text, so a listing is held in memory as text either way. JsonDecoder uses
+the standard library and decodes the items of a listing lazily, as they
+are consumed, so the decoded items are not all held at once;
+OrjsonDecoder uses the orjson package when it is installed, which is
+faster even though it decodes the whole response at once.
+"""
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from hellotxp_exceptions import HellotxpException
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class JsonDecoder(object):
+    name = 'json'
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+
+    def loads(self, text):
+        return self._decoder.decode(text)
+
+    def iter_items(self, text, key, fields):
+        raw_decode = self._decoder.raw_decode
+        skip = _WHITESPACE.match
+
+        pos = skip(text, 0).end()
+        if text[pos:pos + 1] != '{':
+            raise ValueError('Expected a JSON object')
+        pos = skip(text, pos + 1).end()
+        if text[pos:pos + 1] == '}':
+            return
+
+        while True:
+            name, pos = raw_decode(text, pos)
+            pos = skip(text, pos).end()
+            if text[pos:pos + 1] != ':':
+                raise ValueError('Expected : at {}'.format(pos))
+            pos = skip(text, pos + 1).end()
+
+            if name == key and text[pos:pos + 1] == '[':
+                pos = skip(text, pos + 1).end()
+                if text[pos:pos + 1] == ']':
+                    pos += 1
+                else:
+                    while True:
+                        item, pos = raw_decode(text, pos)
+                        yield item
+                        pos = skip(text, pos).end()
+                        delimiter = text[pos:pos + 1]
+                        pos = skip(text, pos + 1).end()
+                        if delimiter == ']':
+                            break
+                        if delimiter != ',':
+                            raise ValueError('Expected , or ] at {}'.format(pos))
+            else:
+                fields[name], pos = raw_decode(text, pos)
+
+            pos = skip(text, pos).end()
+            delimiter = text[pos:pos + 1]
+            pos = skip(text, pos + 1).end()
+            if delimiter == '}':
+                return
+            if delimiter != ',':
+                raise ValueError('Expected , or }} at {}'.format(pos))
+
+
+class OrjsonDecoder(object):
+    name = 'orjson'
+
+    def loads(self, text):
+        return orjson.loads(text)
+
+    def iter_items(self, text, key, fields):
+        response = orjson.loads(text)
+        if not isinstance(response, dict):
+            raise ValueError('Expected a JSON object')
+        items = response.pop(key, [])
+        fields.update(response)
+        return iter(items)
+
+
+DECODERS = {JsonDecoder.name: JsonDecoder}
+if orjson is not None:
+    DECODERS[OrjsonDecoder.name] = OrjsonDecoder
+
+DEFAULT_DECODER = OrjsonDecoder.name if orjson is not None else JsonDecoder.name
+
+
+def get_decoder(decoder=None):
+    """
+    :param decoder: name of a decoder in DECODERS, a decoder object, or
+        None for DEFAULT_DECODER
+    :return: decoder object
+    """
+    if decoder is None:
+        decoder = DEFAULT_DECODER
+    if not isinstance(decoder, str):
+        return decoder
+
+    try:
+        return DECODERS[decoder]()
+    except KeyError:
+        raise HellotxpException(
+            'Unknown or unavailable JSON decoder: {}'.format(decoder))
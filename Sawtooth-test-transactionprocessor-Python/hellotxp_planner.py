@@ -0,0 +1,84 @@
+"""
+Planning bulk submissions of operations that touch the same harvest
+batches, such as a create followed by updates of the new batch.
+
+Two operations conflict when they share an address, or when one declares
+an index kind prefix that holds an address of the other. Only deletes
+and updates sent without their stored values declare those, see
+hellotxp_addressing.index_addresses and
+hellotxp_common.resolve_operations. Every operation becomes a
+transaction of its own whose header lists, as dependencies, the earlier
+transactions it conflicts with most recently; the validator then applies
+them in order without the client waiting for each to commit.
+
+Operations are sorted into waves: an operation goes one wave after the
+latest of its dependencies, so the operations of a wave never conflict.
+A transaction id is the signature over its header, which holds the ids
+of its dependencies, so the transactions are signed wave by wave, and
+each wave is packed into Batches of its own that the validator can
+schedule in parallel.
+"""
+import collections
+
+from hellotxp_addressing import BATCH_PREFIX
+from hellotxp_addressing import operation_addresses
+
+# Length of the namespace and kind prefix of an address; declared
+# addresses this short are whole index kinds.
+_KIND_PREFIX_LENGTH = len(BATCH_PREFIX)
+
+Plan = collections.namedtuple(
+    'Plan', ['operations', 'dependencies', 'waves', 'legacy'])
+
+
+def plan_operations(operations, legacy=None):
+    """
+    work out the dependencies and waves of operations
+    :param operations: list of (name, action, batchnr, volume, latitude,
+        longitude, username), with (fields, expected_revision) for
+        updates, in the order they are to apply
+    :param legacy: for every operation, True if its transaction uses the
+        legacy layout (see hellotxp_addressing); None for none of them
+    :return: Plan with the operations, for every operation the sorted
+        indexes of the earlier operations it depends on, the lists of
+        operation indexes of every wave, first wave first, and the
+        legacy flags
+    """
+    operations = list(operations)
+    legacy = [False] * len(operations) if legacy is None else list(legacy)
+    # address to the index of the last operation touching it
+    last_address = {}
+    # kind prefix to the index of the last operation declaring it, and to
+    # the indexes of the operations touching an address under it since
+    last_prefix = {}
+    under_prefix = collections.defaultdict(set)
+
+    dependencies = []
+    wave_of = []
+    waves = []
+    for i, operation in enumerate(operations):
+        depends = set()
+        for address in operation_addresses(operation, legacy[i]):
+            if len(address) > _KIND_PREFIX_LENGTH:
+                prefix = address[:_KIND_PREFIX_LENGTH]
+                if address in last_address:
+                    depends.add(last_address[address])
+                if prefix in last_prefix:
+                    depends.add(last_prefix[prefix])
+                last_address[address] = i
+                under_prefix[prefix].add(i)
+            else:
+                depends.update(under_prefix.pop(address, ()))
+                if address in last_prefix:
+                    depends.add(last_prefix[address])
+                last_prefix[address] = i
+        depends.discard(i)
+
+        wave = max((wave_of[d] + 1 for d in depends), default=0)
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append(i)
+        wave_of.append(wave)
+        dependencies.append(sorted(depends))
+
+    return Plan(operations, dependencies, waves, legacy)
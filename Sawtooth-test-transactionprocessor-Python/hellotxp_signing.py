@@ -0,0 +1,84 @@
+import concurrent.futures
+import os
+
+from sawtooth_signing import create_context
+from sawtooth_signing import CryptoFactory
+from sawtooth_signing.secp256k1 import Secp256k1PrivateKey
+
+# Headers sent to a worker per task. Signing one header takes well under a
+# millisecond, so headers travel in chunks to keep IPC overhead low.
+DEFAULT_CHUNK_SIZE = 256
+
+# The signer of a pool worker process, created once by _init_worker.
+_WORKER_SIGNER = None
+
+
+def _init_worker(private_key_hex):
+    global _WORKER_SIGNER
+    private_key = Secp256k1PrivateKey.from_hex(private_key_hex)
+    _WORKER_SIGNER = CryptoFactory(
+        create_context('secp256k1')).new_signer(private_key)
+
+
+def _sign_chunk(headers):
+    return [_WORKER_SIGNER.sign(header) for header in headers]
+
+
+class ParallelSigner:
+    """
+    signs serialized headers across a pool of worker processes, each
+    holding its own signer for the same private key. Signatures come back
+    in the order of the headers, so they can be used for BatchHeader
+    transaction_ids directly.
+    """
+
+    def __init__(self, identity, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        :param identity: SignerIdentity of the key to sign with
+        :param workers: number of worker processes, defaults to the CPU count
+        :param chunk_size: headers sent to a worker per task
+        """
+        self._identity = identity
+        self._workers = workers or os.cpu_count() or 1
+        self._chunk_size = chunk_size
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def workers(self):
+        return self._workers
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def sign_all(self, headers):
+        """
+        sign every header
+        :param headers: list of serialized TransactionHeaders or BatchHeaders
+        :return: list of signatures, in the order of headers
+        """
+        if self._workers < 2 or len(headers) <= self._chunk_size:
+            return [self._identity.signer.sign(header) for header in headers]
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._workers,
+                initializer=_init_worker,
+                initargs=(self._identity.private_key,))
+
+        chunks = [
+            headers[i:i + self._chunk_size]
+            for i in range(0, len(headers), self._chunk_size)
+        ]
+        return [
+            signature
+            for signatures in self._executor.map(_sign_chunk, chunks)
+            for signature in signatures
+        ]
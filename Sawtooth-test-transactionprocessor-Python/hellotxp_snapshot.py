@@ -0,0 +1,372 @@
+"""
+Snapshots of the hellotxp namespace: every state entry at one block in a
+compressed file that answers show and find offline.
+
+export_snapshot streams the state entries under the namespace prefix,
+read at one head, into a SnapshotWriter. The entries are packed into
+chunks of about chunk_size bytes that are compressed with zlib one by one,
+so a reader decompresses only the chunks holding the entries it reads.
+SnapshotReader memory-maps the file and finds entries through sorted
+tables of fixed-width records, searched by bisection. All integers are
+little endian:
+
+    8s  magic (b'HTXPSNAP')
+    B   snapshot format version (1)
+    chunks, each a zlib stream of entries:
+        I   data length, followed by the state entry data
+    chunk table, one record per chunk:
+        Q   file offset of the chunk
+        I   compressed length
+    address index, sorted by address, one record per entry:
+        35s address, the 70 hex characters as bytes
+        I   chunk number
+        I   offset of the entry in the decompressed chunk
+    name index, sorted by name, one record per harvest batch:
+        Q   offset of the name in the name table
+        H   name length
+        I   address index record of the entry holding the batch
+    name table, the utf-8 names back to back
+    head, the utf-8 id of the block the snapshot was read at
+    footer:
+        Q   chunk table offset
+        Q   address index offset
+        Q   name index offset
+        Q   name table offset
+        Q   head offset
+        I   number of chunks
+        I   number of entries
+        I   number of names
+        H   head length
+        8s  magic
+"""
+import functools
+import mmap
+import os
+import struct
+import zlib
+
+from hellotxp_addressing import index_key_prefix
+from hellotxp_addressing import NAMESPACE_PREFIX
+from hellotxp_client import DEFAULT_PAGE_SIZE
+from hellotxp_common import index_lookup
+from hellotxp_common import index_names
+from hellotxp_codec import CodecError
+from hellotxp_codec import decode_state
+from hellotxp_codec import is_index_entry
+from hellotxp_exceptions import HellotxpException
+
+SNAPSHOT_FORMAT_V1 = 1
+
+# Uncompressed bytes per chunk; a read decompresses one chunk.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_COMPRESSION = 6
+
+# Decompressed chunks a reader keeps.
+DEFAULT_CHUNK_CACHE = 32
+
+_MAGIC = b'HTXPSNAP'
+_ADDRESS_BYTES = 35
+_HEADER = struct.Struct('<8sB')
+_ENTRY_HEADER = struct.Struct('<I')
+_CHUNK_RECORD = struct.Struct('<QI')
+_ADDRESS_RECORD = struct.Struct('<35sII')
+_NAME_RECORD = struct.Struct('<QHI')
+_FOOTER = struct.Struct('<QQQQQIIIH8s')
+
+
+def export_snapshot(client, path, auth_user=None, auth_password=None,
+                    page_size=DEFAULT_PAGE_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    write every state entry of the namespace to a snapshot file, reading
+    all pages at the current head so the snapshot is of a single block
+    :param client: hellotxpClient of the REST API to read
+    :return: (head, number of entries)
+    """
+    head = client.fetch_head(auth_user, auth_password)
+    with SnapshotWriter(path, head, chunk_size) as writer:
+        for address, data in client.iter_state(
+                NAMESPACE_PREFIX, auth_user, auth_password,
+                page_size=page_size, head=head):
+            writer.add(address, data)
+    return head, writer.count
+
+
+class SnapshotWriter(object):
+    def __init__(self, path, head, chunk_size=DEFAULT_CHUNK_SIZE,
+                 compression=DEFAULT_COMPRESSION):
+        """
+        :param path: snapshot file, replaced once the snapshot is complete
+        :param head: id of the block the entries are read at
+        """
+        self.path = path
+        self.head = head
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.count = 0
+
+        self._temp_path = path + '.tmp'
+        try:
+            self._file = open(self._temp_path, 'wb')
+            self._file.write(_HEADER.pack(_MAGIC, SNAPSHOT_FORMAT_V1))
+        except OSError as err:
+            raise HellotxpException(
+                'Cannot write snapshot {}: {}'.format(path, err))
+
+        self._chunks = []
+        self._buffer = bytearray()
+        # (address bytes, chunk number, offset in chunk) of every entry,
+        # and (name bytes, address bytes) of every harvest batch
+        self._entries = []
+        self._names = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add(self, address, data):
+        """
+        add the state entry at address
+        """
+        try:
+            key = bytes.fromhex(address)
+        except ValueError:
+            key = b''
+        if len(key) != _ADDRESS_BYTES:
+            raise HellotxpException('Invalid address: {}'.format(address))
+
+        # batches kept in the legacy layout can be at any address, see
+        # hellotxp_addressing
+        if not is_index_entry(data):
+            try:
+                batches = decode_state(data)
+            except CodecError as err:
+                raise HellotxpException(
+                    'Invalid state entry at {}: {}'.format(address, err))
+            for batch in batches:
+                self._names.append((batch[0].encode('utf-8'), key))
+
+        self._entries.append((key, len(self._chunks), len(self._buffer)))
+        self._buffer += _ENTRY_HEADER.pack(len(data))
+        self._buffer += data
+        self.count += 1
+        if len(self._buffer) >= self.chunk_size:
+            self._write_chunk()
+
+    def close(self):
+        """
+        write the indexes and move the snapshot into place
+        """
+        try:
+            self._write_chunk()
+            self._write_tables()
+            self._file.close()
+            os.replace(self._temp_path, self.path)
+        except OSError as err:
+            self.abort()
+            raise HellotxpException(
+                'Cannot write snapshot {}: {}'.format(self.path, err))
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
+
+    def _write_chunk(self):
+        if not self._buffer:
+            return
+        chunk = zlib.compress(bytes(self._buffer), self.compression)
+        self._chunks.append((self._file.tell(), len(chunk)))
+        self._file.write(chunk)
+        self._buffer = bytearray()
+
+    def _write_tables(self):
+        entries = sorted(self._entries)
+        records = {key: i for i, (key, _, _) in enumerate(entries)}
+        names = sorted(self._names)
+
+        chunk_table = self._file.tell()
+        for offset, length in self._chunks:
+            self._file.write(_CHUNK_RECORD.pack(offset, length))
+
+        address_index = self._file.tell()
+        for key, chunk, offset in entries:
+            self._file.write(_ADDRESS_RECORD.pack(key, chunk, offset))
+
+        name_index = self._file.tell()
+        name_offset = 0
+        for name, key in names:
+            self._file.write(
+                _NAME_RECORD.pack(name_offset, len(name), records[key]))
+            name_offset += len(name)
+
+        name_table = self._file.tell()
+        for name, _ in names:
+            self._file.write(name)
+
+        head_offset = self._file.tell()
+        head = self.head.encode('utf-8')
+        self._file.write(head)
+        self._file.write(_FOOTER.pack(
+            chunk_table, address_index, name_index, name_table, head_offset,
+            len(self._chunks), len(entries), len(names), len(head), _MAGIC))
+
+
+class SnapshotReader(object):
+    def __init__(self, path, chunk_cache=DEFAULT_CHUNK_CACHE):
+        """
+        :param path: snapshot file written by SnapshotWriter
+        :param chunk_cache: decompressed chunks kept for later reads
+        """
+        try:
+            with open(path, 'rb') as fd:
+                self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as err:
+            raise HellotxpException(
+                'Cannot open snapshot {}: {}'.format(path, err))
+
+        try:
+            magic, version = _HEADER.unpack_from(self._map, 0)
+            (self._chunk_table, self._address_index, self._name_index,
+             self._name_table, head_offset, self._chunk_count, self._count,
+             self._name_count, head_length, end_magic) = _FOOTER.unpack_from(
+                 self._map, len(self._map) - _FOOTER.size)
+            self.head = self._map[
+                head_offset:head_offset + head_length].decode('utf-8')
+        except (struct.error, UnicodeDecodeError) as err:
+            self.close()
+            raise HellotxpException('Invalid snapshot {}: {}'.format(path, err))
+        if magic != _MAGIC or end_magic != _MAGIC:
+            self.close()
+            raise HellotxpException('Not a snapshot: {}'.format(path))
+        if version != SNAPSHOT_FORMAT_V1:
+            self.close()
+            raise HellotxpException(
+                'Unsupported snapshot format: {}'.format(version))
+
+        self._chunk = functools.lru_cache(maxsize=chunk_cache)(
+            self._read_chunk)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        self._map.close()
+
+    def get(self, address):
+        """
+        :return: the state entry bytes at address, or None
+        """
+        i = self._lower_bound(address)
+        if i < self._count and self._address(i) == address:
+            return self._entry(i)
+        return None
+
+    def entries(self, prefix=''):
+        """
+        iterate over the state entries under an address prefix, decoding
+        only the chunks holding them
+        :return: generator of (address, state entry bytes), in address order
+        """
+        for i in range(self._lower_bound(prefix), self._count):
+            address = self._address(i)
+            if not address.startswith(prefix):
+                return
+            yield address, self._entry(i)
+
+    def names(self):
+        """
+        :return: generator of the names of all harvest batches, sorted
+        """
+        for i in range(self._name_count):
+            yield self._name(i).decode('utf-8')
+
+    def show(self, name):
+        """
+        :return: the state entry bytes holding the harvest batch name, as
+            hellotxpClient.show returns them, or None
+        """
+        target = name.encode('utf-8')
+        low, high = 0, self._name_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._name_count and self._name(low) == target:
+            _, _, record = self._name_record(low)
+            return self._entry(record)
+        return None
+
+    def find(self, batchnr=None, username=None):
+        """
+        look up harvest batches by batchnr or username, see
+        hellotxpClient.find
+        :return: sorted list of harvest batch names, empty if none match
+        """
+        kind, key = index_lookup(batchnr, username)
+        names = set()
+        for _, data in self.entries(index_key_prefix(kind, key)):
+            names.update(index_names(data, key))
+        return sorted(names)
+
+    def _lower_bound(self, prefix):
+        # addresses are stored as bytes, so an odd prefix is padded with
+        # the lowest hex digit
+        target = bytes.fromhex(prefix + '0' * (len(prefix) % 2))
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._address_key(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _address_key(self, i):
+        start = self._address_index + i * _ADDRESS_RECORD.size
+        return self._map[start:start + _ADDRESS_BYTES]
+
+    def _address(self, i):
+        return self._address_key(i).hex()
+
+    def _entry(self, i):
+        try:
+            _, chunk, offset = _ADDRESS_RECORD.unpack_from(
+                self._map, self._address_index + i * _ADDRESS_RECORD.size)
+            data = self._chunk(chunk)
+            length, = _ENTRY_HEADER.unpack_from(data, offset)
+        except struct.error as err:
+            raise HellotxpException('Invalid snapshot entry: {}'.format(err))
+        start = offset + _ENTRY_HEADER.size
+        return data[start:start + length]
+
+    def _read_chunk(self, chunk):
+        try:
+            offset, length = _CHUNK_RECORD.unpack_from(
+                self._map, self._chunk_table + chunk * _CHUNK_RECORD.size)
+            return zlib.decompress(self._map[offset:offset + length])
+        except (struct.error, zlib.error) as err:
+            raise HellotxpException('Invalid snapshot chunk: {}'.format(err))
+
+    def _name_record(self, i):
+        return _NAME_RECORD.unpack_from(
+            self._map, self._name_index + i * _NAME_RECORD.size)
+
+    def _name(self, i):
+        offset, length, _ = self._name_record(i)
+        start = self._name_table + offset
+        return self._map[start:start + length]
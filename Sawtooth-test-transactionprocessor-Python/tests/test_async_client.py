@@ -0,0 +1,274 @@
+"""
+AsyncHellotxpClient against a stand-in REST API served by aiohttp.test_utils.
+"""
+import asyncio
+import base64
+import json
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+from sawtooth_signing import create_context
+
+import hellotxp_async_client
+from hellotxp_addressing import batch_address
+from hellotxp_addressing import index_address
+from hellotxp_addressing import INDEX_PREFIXES
+from hellotxp_addressing import legacy_batch_address
+from hellotxp_async_client import AsyncHellotxpClient
+from hellotxp_codec import decode_payload
+from hellotxp_codec import encode_index
+from hellotxp_codec import encode_state
+from hellotxp_codec import INDEX_BATCHNR
+from hellotxp_codec import PAYLOAD_FORMAT_V4
+from hellotxp_exceptions import HellotxpException
+
+
+class RestApi(object):
+    """
+    the parts of the Sawtooth REST API the client uses: batches are
+    committed when posted, state is a dict of address to bytes
+    """
+
+    def __init__(self, state=None):
+        self.state = dict(state or {})
+        self.batch_lists = []
+        self.status_requests = []
+        self.state_requests = []
+        self.app = web.Application()
+        self.app.router.add_post('/batches', self.post_batches)
+        self.app.router.add_post('/batch_statuses', self.post_statuses)
+        self.app.router.add_get('/state', self.get_state)
+        self.app.router.add_get('/state/{address}', self.get_entry)
+
+    async def post_batches(self, request):
+        batch_list = BatchList()
+        batch_list.ParseFromString(await request.read())
+        self.batch_lists.append(batch_list)
+        return web.json_response({'link': 'batch_statuses'}, status=202)
+
+    async def post_statuses(self, request):
+        ids = json.loads(await request.read())
+        self.status_requests.append((ids, request.query.get('wait')))
+        return web.json_response({'data': [
+            {'id': batch_id, 'status': 'COMMITTED', 'invalid_transactions': []}
+            for batch_id in ids
+        ]})
+
+    async def get_state(self, request):
+        prefix = request.query['address']
+        limit = int(request.query.get('limit', 1000))
+        start = request.query.get('start')
+        self.state_requests.append((prefix, start))
+        addresses = sorted(
+            address for address in self.state
+            if address.startswith(prefix) and (start is None or address >= start))
+        paging = {}
+        if len(addresses) > limit:
+            paging['next_position'] = addresses[limit]
+        return web.json_response({
+            'data': [
+                {'address': address,
+                 'data': base64.b64encode(self.state[address]).decode()}
+                for address in addresses[:limit]
+            ],
+            'paging': paging,
+        })
+
+    async def get_entry(self, request):
+        data = self.state.get(request.match_info['address'])
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.json_response({'data': base64.b64encode(data).decode()})
+
+
+@pytest.fixture
+def keyfile(tmp_path):
+    path = tmp_path / 'test.priv'
+    path.write_text(create_context('secp256k1').new_random_private_key().as_hex())
+    return str(path)
+
+
+def batch_entry(name, batchnr, owner='alice'):
+    return encode_state([(name, batchnr, 10.0, 52.0, 4.0, owner, 0)])
+
+
+def run(api, test, **options):
+    async def main():
+        async with TestServer(api.app) as server:
+            base_url = '{}:{}'.format(server.host, server.port)
+            async with AsyncHellotxpClient(base_url, **options) as client:
+                return await test(client)
+    return asyncio.run(main())
+
+
+def test_create_many_posts_signed_batches(keyfile):
+    api = RestApi()
+    records = [
+        ('coop/b{}'.format(i), i, 1.0, 52.0, 4.0, 'alice') for i in range(5)]
+
+    results = run(
+        api, lambda client: client.create_many(records, wait=5, batch_size=2),
+        keyfile=keyfile)
+
+    assert [r['name'] for r in results] == [r[0] for r in records]
+    assert {r['status'] for r in results} == {'COMMITTED'}
+    batches = [b for batch_list in api.batch_lists for b in batch_list.batches]
+    assert [len(b.transactions) for b in batches] == [2, 2, 1]
+    names = [
+        operation[0]
+        for b in batches for t in b.transactions
+        for operation in decode_payload(t.payload)
+    ]
+    assert names == [r[0] for r in records]
+
+
+def test_wait_for_batches_splits_ids_and_clamps_wait(monkeypatch):
+    monkeypatch.setattr(hellotxp_async_client, 'STATUS_IDS_PER_REQUEST', 2)
+    api = RestApi()
+    ids = ['{:0128x}'.format(i) for i in range(5)]
+
+    statuses = run(
+        api, lambda client: client.wait_for_batches(ids, wait=10 ** 9))
+
+    assert sorted(statuses) == ids
+    assert sorted(len(request[0]) for request in api.status_requests) == [1, 2, 2]
+    assert {request[1] for request in api.status_requests} == {
+        str(hellotxp_async_client.MAX_WAIT)}
+
+
+def test_list_follows_paging():
+    names = ['coop/b{}'.format(i) for i in range(7)] + ['other/b0']
+    api = RestApi({batch_address(name): batch_entry(name, 1) for name in names})
+
+    async def test(client):
+        return [data async for data in client.list(page_size=3, group='coop')]
+
+    entries = run(api, test)
+
+    assert sorted(entries) == sorted(
+        batch_entry(name, 1) for name in names if name.startswith('coop/'))
+    assert [start is None for _, start in api.state_requests] == [
+        True, False, False]
+
+
+def test_list_reads_batches_of_both_layouts_but_no_index_records():
+    state = {legacy_batch_address(name): batch_entry(name, 1)
+             for name in ('x', 'y', 'z')}
+    state[batch_address('coop/a')] = batch_entry('coop/a', 7)
+    state[index_address(INDEX_BATCHNR, '7', 'coop/a')] = \
+        encode_index({'7': ['coop/a']})
+    api = RestApi(state)
+
+    async def test(client):
+        entries = [entry async for entry in client.list_entries(page_size=2)]
+        resumed = [entry async for entry in client.list_entries(
+            page_size=2, start=entries[2][0])]
+        return entries, resumed
+
+    entries, resumed = run(api, test)
+
+    assert [data for _, data in entries] == [
+        batch_entry(name, 1 if '/' not in name else 7)
+        for name in ('coop/a', 'y', 'z', 'x')]
+    assert resumed == entries[2:]
+    assert not any(prefix.startswith(tuple(INDEX_PREFIXES.values()))
+                   for prefix, _ in api.state_requests)
+
+
+def test_list_limit():
+    names = ['coop/b{}'.format(i) for i in range(7)]
+    api = RestApi({batch_address(name): batch_entry(name, 1) for name in names})
+
+    async def test(client):
+        return [data async for data in client.list(page_size=2, limit=3)]
+
+    assert len(run(api, test)) == 3
+
+
+def test_find_reads_the_index_leaves_of_a_key():
+    state = {}
+    for name, batchnr in [('coop/a', 7), ('coop/b', 7), ('coop/c', 8)]:
+        state[batch_address(name)] = batch_entry(name, batchnr)
+        state[index_address(INDEX_BATCHNR, str(batchnr), name)] = \
+            encode_index({str(batchnr): [name]})
+    api = RestApi(state)
+
+    async def test(client):
+        return await client.find(batchnr=7), await client.find(batchnr=9)
+
+    assert run(api, test) == (['coop/a', 'coop/b'], [])
+
+
+def test_find_misses_csv_batches():
+    # csv transactions declare only the batch address and keep no index
+    api = RestApi({legacy_batch_address('x'): b'x,3,1.5,2.0'})
+
+    async def test(client):
+        return await client.find(batchnr=3), await client.show('x')
+
+    assert run(api, test) == ([], b'x,3,1.5,2.0')
+
+
+def test_show():
+    api = RestApi({batch_address('coop/a'): batch_entry('coop/a', 7)})
+
+    async def test(client):
+        assert await client.show('coop/a') == batch_entry('coop/a', 7)
+        with pytest.raises(HellotxpException, match='No such batch'):
+            await client.show('coop/missing')
+
+    run(api, test)
+
+
+def test_show_prefers_the_leaf_layout():
+    api = RestApi({
+        legacy_batch_address('x'): b'x,3,1.5,2.0',
+        legacy_batch_address('coop/a'): b'coop/a,1,1.0,2.0',
+        batch_address('coop/a'): batch_entry('coop/a', 7),
+    })
+
+    async def test(client):
+        return await client.show('x'), await client.show('coop/a')
+
+    assert run(api, test) == (b'x,3,1.5,2.0', batch_entry('coop/a', 7))
+
+
+def test_delete_sends_the_stored_values(keyfile):
+    api = RestApi({batch_address('coop/a'): batch_entry('coop/a', 7)})
+
+    async def test(client):
+        await client.delete('coop/a', 'bob')
+        with pytest.raises(HellotxpException, match='No such batch'):
+            await client.delete('coop/missing', 'bob')
+
+    run(api, test, keyfile=keyfile)
+
+    [batch_list] = api.batch_lists
+    [transaction] = batch_list.batches[0].transactions
+    [operation] = decode_payload(transaction.payload)
+    assert operation[9] == (7, 52.0, 4.0, 'alice')
+    header = TransactionHeader()
+    header.ParseFromString(transaction.header)
+    assert index_address(INDEX_BATCHNR, '7', 'coop/a') in header.inputs
+    assert INDEX_PREFIXES[INDEX_BATCHNR] not in header.inputs
+
+
+def test_updates_of_legacy_batches_keep_the_legacy_layout(keyfile):
+    api = RestApi({legacy_batch_address('x'): b'x,3,1.5,2.0'})
+
+    async def test(client):
+        await client.update('x', volume=2.5)
+
+    run(api, test, keyfile=keyfile)
+
+    [batch_list] = api.batch_lists
+    [transaction] = batch_list.batches[0].transactions
+    assert transaction.payload[0] == PAYLOAD_FORMAT_V4
+    header = TransactionHeader()
+    header.ParseFromString(transaction.header)
+    assert list(header.inputs) == [legacy_batch_address('x')]
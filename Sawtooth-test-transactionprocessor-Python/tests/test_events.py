@@ -0,0 +1,157 @@
+"""
+CommitWaiter with a LocalEventSource in place of the validator's events.
+"""
+import json
+import threading
+import time
+
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+from sawtooth_signing import create_context
+
+from hellotxp_client import hellotxpClient
+from hellotxp_events import CommitWaiter
+from hellotxp_events import LocalEventSource
+
+
+def status(batch_id, state):
+    return {'id': batch_id, 'status': state, 'invalid_transactions': []}
+
+
+class Poller(object):
+    """
+    batch_statuses stand-in answering with fixed states, PENDING for
+    batches without one
+    """
+
+    def __init__(self, states=None):
+        self.states = dict(states or {})
+        self.calls = []
+
+    def __call__(self, batch_ids, wait):
+        self.calls.append((list(batch_ids), wait))
+        return {
+            batch_id: status(batch_id, self.states.get(batch_id, 'PENDING'))
+            for batch_id in batch_ids
+        }
+
+
+class FailingEventSource(object):
+    def commits(self):
+        raise ConnectionError('validator went away')
+
+    def close(self):
+        pass
+
+
+def start_waiter(source, poll_interval=60.0):
+    waiter = CommitWaiter(source, poll_interval=poll_interval)
+    waiter.start()
+    return waiter
+
+
+def test_commits_resolve_waits_without_polling():
+    source = LocalEventSource()
+    waiter = start_waiter(source)
+    poller = Poller()
+    try:
+        threading.Timer(0.05, source.commit, ('block-1', ['a', 'b'])).start()
+        statuses = waiter.wait(['a', 'b'], 5, poller)
+    finally:
+        waiter.close()
+
+    assert {b: s['status'] for b, s in statuses.items()} == {
+        'a': 'COMMITTED', 'b': 'COMMITTED'}
+    assert poller.calls == []
+
+
+def test_commit_before_wait_is_not_missed():
+    source = LocalEventSource()
+    waiter = start_waiter(source)
+    poller = Poller()
+    try:
+        waiter.watch(['a'])
+        source.commit('block-1', ['a'])
+        # let the waiter thread take the commit before anyone waits
+        time.sleep(0.1)
+        statuses = waiter.wait(['a'], 1, poller)
+    finally:
+        waiter.close()
+
+    assert statuses['a']['status'] == 'COMMITTED'
+    assert poller.calls == []
+
+
+def test_failed_event_source_falls_back_to_polling():
+    waiter = start_waiter(FailingEventSource())
+    poller = Poller({'a': 'COMMITTED', 'b': 'INVALID'})
+    start = time.time()
+    try:
+        statuses = waiter.wait(['a', 'b'], 30, poller)
+    finally:
+        waiter.close()
+
+    assert time.time() - start < 5
+    assert {b: s['status'] for b, s in statuses.items()} == {
+        'a': 'COMMITTED', 'b': 'INVALID'}
+    assert [ids for ids, _ in poller.calls] == [['a', 'b']]
+
+
+def test_invalid_batches_are_resolved_by_polling():
+    source = LocalEventSource()
+    waiter = start_waiter(source, poll_interval=0.05)
+    # an invalid batch is never in a block
+    poller = Poller({'b': 'INVALID'})
+    try:
+        threading.Timer(0.01, source.commit, ('block-1', ['a'])).start()
+        statuses = waiter.wait(['a', 'b'], 5, poller)
+    finally:
+        waiter.close()
+
+    assert statuses['a']['status'] == 'COMMITTED'
+    assert statuses['b']['status'] == 'INVALID'
+    assert all('a' not in ids or 'b' in ids for ids, _ in poller.calls)
+
+
+def test_wait_times_out_as_pending():
+    waiter = start_waiter(LocalEventSource(), poll_interval=0.05)
+    try:
+        statuses = waiter.wait(['a'], 0.2, Poller())
+    finally:
+        waiter.close()
+
+    assert statuses['a']['status'] == 'PENDING'
+
+
+def test_client_watches_batches_before_posting(tmp_path, monkeypatch):
+    keyfile = tmp_path / 'test.priv'
+    keyfile.write_text(
+        create_context('secp256k1').new_random_private_key().as_hex())
+    client = hellotxpClient('localhost:8008', keyfile=str(keyfile))
+    source = LocalEventSource()
+    client._waiter = start_waiter(source)
+    requests = []
+
+    def send_request(suffix, data=None, content_type=None, **options):
+        requests.append(suffix)
+        if suffix == 'batches':
+            # the batches commit while the post is still in flight
+            batch_list = BatchList()
+            batch_list.ParseFromString(data)
+            source.commit(
+                'block-1', [b.header_signature for b in batch_list.batches])
+            time.sleep(0.1)
+            return '{}'
+        return json.dumps({'data': [
+            status(batch_id, 'PENDING') for batch_id in json.loads(data)]})
+
+    monkeypatch.setattr(client, '_send_request', send_request)
+    try:
+        results = client.create_many(
+            [('coop/a', 1, 1.0, 52.0, 4.0, 'alice'),
+             ('coop/b', 2, 1.0, 52.0, 4.0, 'alice')],
+            wait=2)
+    finally:
+        client.close()
+
+    assert [r['status'] for r in results] == ['COMMITTED', 'COMMITTED']
+    assert requests == ['batches']
@@ -0,0 +1,153 @@
+"""
+HelloTransactionHandler.apply against benchmarks.mock_context, which,
+like the validator, only allows the addresses a transaction declares.
+"""
+import pytest
+from sawtooth_sdk.processor.exceptions import AuthorizationException
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+
+from handler import HelloTransactionHandler
+from helloMetrics import Metrics
+from hellotxp_addressing import batch_address
+from hellotxp_addressing import INDEX_PREFIXES
+from hellotxp_addressing import legacy_batch_address
+from hellotxp_codec import BINARY_FAMILY_VERSION
+from hellotxp_codec import CSV_FAMILY_VERSION
+from hellotxp_codec import decode_state
+from hellotxp_codec import encode_payload
+from hellotxp_codec import FIELD_BATCHNR
+from hellotxp_codec import FIELD_VOLUME
+from hellotxp_codec import INDEX_BATCHNR
+from hellotxp_codec import NO_LONGITUDE
+from hellotxp_codec import PAYLOAD_FORMAT_V4
+from mock_context import MockContext
+from mock_context import MockTransaction
+
+
+def apply(context, *transactions):
+    handler = HelloTransactionHandler(Metrics())
+    for transaction in transactions:
+        handler.apply(transaction, context.for_transaction(transaction))
+
+
+def test_csv_create_and_delete_touch_the_batch_only():
+    context = MockContext()
+
+    apply(context, MockTransaction(b'x,create,3,1.5,2.0,u', CSV_FAMILY_VERSION))
+    assert list(context.state) == [legacy_batch_address('x')]
+    assert decode_state(
+        context.state[legacy_batch_address('x')])[0][:2] == ('x', 3)
+
+    apply(context, MockTransaction(b'x,delete,,,,u', CSV_FAMILY_VERSION))
+    assert context.state == {}
+
+
+def test_binary_create_keeps_indexes():
+    context = MockContext()
+
+    apply(context, MockTransaction(
+        encode_payload('coop/x', 'create', 3, 1.5, 52.0, 4.0, 'u'),
+        BINARY_FAMILY_VERSION))
+
+    assert any(
+        address.startswith(INDEX_PREFIXES[INDEX_BATCHNR])
+        for address in context.state)
+
+
+def test_updates_apply_at_the_expected_revision_only():
+    context = MockContext()
+    apply(context, MockTransaction(
+        encode_payload('coop/x', 'create', 3, 1.5, 52.0, 4.0, 'u'),
+        BINARY_FAMILY_VERSION))
+    update = encode_payload('coop/x', 'update', 0, 2.5, NO_LONGITUDE,
+                            NO_LONGITUDE, '', FIELD_VOLUME, 0)
+
+    apply(context, MockTransaction(update, BINARY_FAMILY_VERSION))
+    assert decode_state(context.state[batch_address('coop/x')]) == [
+        ('coop/x', 3, 2.5, 52.0, 4.0, 'u', 1)]
+
+    with pytest.raises(InvalidTransaction, match='at revision 1, not 0'):
+        apply(context, MockTransaction(update, BINARY_FAMILY_VERSION))
+
+
+def test_undeclared_addresses_are_refused():
+    context = MockContext()
+    transaction = MockTransaction(
+        encode_payload('coop/x', 'create', 3, 1.5, 52.0, 4.0, 'u'),
+        BINARY_FAMILY_VERSION, addresses=[batch_address('coop/x')])
+
+    with pytest.raises(AuthorizationException):
+        apply(context, transaction)
+
+
+def test_delete_declares_the_leaves_of_its_stored_values():
+    context = MockContext()
+    apply(context, MockTransaction(
+        encode_payload('coop/x', 'create', 3, 1.5, 52.0, 4.0, 'u'),
+        BINARY_FAMILY_VERSION))
+
+    apply(context, MockTransaction(
+        encode_payload('coop/x', 'delete', 3, 0.0, 52.0, 4.0, 'u'),
+        BINARY_FAMILY_VERSION))
+
+    assert context.state == {}
+
+
+def test_stale_stored_values_are_refused():
+    context = MockContext()
+    apply(context, MockTransaction(
+        encode_payload('coop/x', 'create', 3, 1.5, 52.0, 4.0, 'u'),
+        BINARY_FAMILY_VERSION))
+    state = dict(context.state)
+
+    for payload in (
+            encode_payload('coop/x', 'delete', 4, 0.0, 52.0, 4.0, 'u'),
+            encode_payload('coop/x', 'update', 5, 0.0, NO_LONGITUDE,
+                           NO_LONGITUDE, '', FIELD_BATCHNR,
+                           stored=(4, NO_LONGITUDE, NO_LONGITUDE, ''))):
+        with pytest.raises(InvalidTransaction, match='has changed'):
+            apply(context, MockTransaction(payload, BINARY_FAMILY_VERSION))
+    assert context.state == state
+
+
+def test_names_taken_in_the_legacy_layout_are_refused():
+    context = MockContext()
+    apply(context, MockTransaction(
+        encode_payload('coop/x', 'create', 3, 1.5, 52.0, 4.0, 'u',
+                       payload_format=PAYLOAD_FORMAT_V4),
+        BINARY_FAMILY_VERSION))
+    assert legacy_batch_address('coop/x') in context.state
+
+    with pytest.raises(InvalidTransaction, match='already exists'):
+        apply(context, MockTransaction(
+            encode_payload('coop/x', 'create', 3, 1.5, 52.0, 4.0, 'u'),
+            BINARY_FAMILY_VERSION))
+
+
+def test_names_taken_in_the_leaf_layout_are_refused():
+    context = MockContext()
+    apply(context, MockTransaction(
+        encode_payload('coop/x', 'create', 3, 1.5, 52.0, 4.0, 'u'),
+        BINARY_FAMILY_VERSION))
+
+    with pytest.raises(InvalidTransaction, match='already exists'):
+        apply(context, MockTransaction(
+            encode_payload('coop/x', 'create', 3, 1.5, 52.0, 4.0, 'u',
+                           payload_format=PAYLOAD_FORMAT_V4),
+            BINARY_FAMILY_VERSION))
+
+
+def test_creates_declaring_one_layout_replay_unchecked():
+    # csv and older clients declared only the legacy address of a create,
+    # the processor cannot read the leaf layout for them
+    context = MockContext()
+    apply(context, MockTransaction(
+        encode_payload('coop/x', 'create', 3, 1.5, 52.0, 4.0, 'u'),
+        BINARY_FAMILY_VERSION))
+
+    apply(context, MockTransaction(b'coop/x,create,3,1.5,2.0,u',
+                                   CSV_FAMILY_VERSION))
+
+    assert batch_address('coop/x') in context.state
+    assert context.state[legacy_batch_address('coop/x')] == \
+        b'coop/x,3,1.5,2.0'
@@ -0,0 +1,28 @@
+import pytest
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+
+from hellotxp_codec import CodecError
+from hellotxp_codec import CSV_FAMILY_VERSION
+from hellotxp_codec import encode_payload
+from helloPayload import HelloPayload
+
+
+def test_csv_delete_with_empty_fields_parses():
+    # deletes were accepted with the numeric fields left empty
+    payload = HelloPayload.from_bytes(b'x,delete,,,,u', CSV_FAMILY_VERSION)
+
+    assert (payload.name, payload.action, payload.username) == (
+        'x', 'delete', 'u')
+
+
+def test_csv_create_needs_its_numbers():
+    payload = HelloPayload.from_bytes(b'x,create,3,1.5,2.0,u', CSV_FAMILY_VERSION)
+    assert (payload.batchnr, payload.volume, payload.latitude) == (3, 1.5, 2.0)
+
+    with pytest.raises(InvalidTransaction):
+        HelloPayload.from_bytes(b'x,create,,,,u', CSV_FAMILY_VERSION)
+
+
+def test_encode_payload_without_username():
+    with pytest.raises(CodecError, match='Expected a string'):
+        encode_payload('x', 'create', 1, 1.0, 52.0, 4.0, None)
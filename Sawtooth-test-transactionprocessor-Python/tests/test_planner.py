@@ -0,0 +1,60 @@
+"""
+plan_operations on operations resolved as the clients resolve them.
+"""
+from hellotxp_addressing import INDEX_PREFIXES
+from hellotxp_addressing import operation_addresses
+from hellotxp_codec import FIELD_BATCHNR
+from hellotxp_codec import INDEX_BATCHNR
+from hellotxp_codec import NO_LONGITUDE
+from hellotxp_common import resolve_operations
+from hellotxp_common import stored_names
+from hellotxp_planner import plan_operations
+
+
+def create(name, batchnr):
+    return (name, 'create', batchnr, 1.0, 52.0, 4.0, 'alice')
+
+
+OPERATIONS = [
+    create('a', 1),
+    ('a', 'update', 2, 0.0, NO_LONGITUDE, NO_LONGITUDE, '', FIELD_BATCHNR, -1),
+    create('b', 1),
+    ('c', 'delete', 0, 0.0, 0.0, 0.0, 'alice'),
+    create('d', 1),
+]
+
+
+def test_stored_names_skips_batches_created_first():
+    assert stored_names(OPERATIONS) == ['c']
+
+
+def test_deletes_and_updates_declare_exact_leaves():
+    operations, legacy = resolve_operations(
+        OPERATIONS, {'c': (1, 52.0, 4.0, 'alice')})
+
+    assert legacy == [False] * 5
+    assert operations[1][9] == (1, 52.0, 4.0, 'alice')
+    assert operations[3][2:7] == (1, 0.0, 52.0, 4.0, 'alice')
+    for operation in operations:
+        assert not set(operation_addresses(operation)) & set(
+            INDEX_PREFIXES.values())
+    # only the update depends on the create of its batch
+    assert plan_operations(operations).waves == [[0, 2, 3, 4], [1]]
+
+
+def test_operations_without_stored_values_declare_index_kinds():
+    assert plan_operations(OPERATIONS).waves == [[0], [1], [2], [3], [4]]
+
+
+def test_legacy_batches_keep_the_legacy_declarations():
+    operations, legacy = resolve_operations(
+        OPERATIONS[3:] + [create('c', 2)], {'c': (1, 52.0, 4.0, 'alice')},
+        legacy=['c'])
+
+    assert legacy == [True, False, False]
+    assert operations[0] == OPERATIONS[3]
+    assert INDEX_PREFIXES[INDEX_BATCHNR] in operation_addresses(
+        operations[0], legacy=True)
+    # the create of 'd' falls under the index kinds the legacy delete
+    # declares, and the new 'c' must follow the delete of the old one
+    assert plan_operations(operations, legacy).dependencies == [[], [0], [0]]
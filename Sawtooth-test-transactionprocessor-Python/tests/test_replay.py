@@ -0,0 +1,67 @@
+"""
+Replaying transactions written before the leaf address layout: csv
+payloads and binary payloads before payload format 5, with the addresses
+their clients declared, must still produce the legacy layout state.
+"""
+from handler import HelloTransactionHandler
+from helloMetrics import Metrics
+from hellotxp_addressing import legacy_batch_address
+from hellotxp_addressing import legacy_index_address
+from hellotxp_codec import BINARY_FAMILY_VERSION
+from hellotxp_codec import CSV_FAMILY_VERSION
+from hellotxp_codec import encode_geo_index
+from hellotxp_codec import encode_index
+from hellotxp_codec import encode_payload
+from hellotxp_codec import encode_state
+from hellotxp_codec import FIELD_BATCHNR
+from hellotxp_codec import FIELD_OWNER
+from hellotxp_codec import INDEX_BATCHNR
+from hellotxp_codec import INDEX_LOCATION
+from hellotxp_codec import INDEX_USER
+from hellotxp_codec import NO_LONGITUDE
+from hellotxp_codec import PAYLOAD_FORMAT_V4
+from hellotxp_geo import cell_key
+from mock_context import MockContext
+from mock_context import MockTransaction
+
+
+def binary(*operation):
+    return MockTransaction(
+        encode_payload(*operation, payload_format=PAYLOAD_FORMAT_V4),
+        BINARY_FAMILY_VERSION)
+
+
+def csv(payload):
+    return MockTransaction(payload, CSV_FAMILY_VERSION)
+
+
+TRANSACTIONS = [
+    csv(b'x,create,3,1.5,2.0,u'),
+    csv(b'y,create,4,1.5,2.0,u'),
+    binary('coop/a', 'create', 7, 1.5, 52.0, 4.0, 'alice'),
+    binary('coop/b', 'create', 7, 2.5, -33.9, 18.4, 'bob'),
+    binary('coop/a', 'update', 8, 0.0, NO_LONGITUDE, NO_LONGITUDE, 'carol',
+           FIELD_BATCHNR | FIELD_OWNER, 0),
+    binary('coop/b', 'delete', 0, 0.0, 0.0, 0.0, 'bob'),
+    csv(b'y,delete,,,,u'),
+]
+
+
+def test_legacy_transactions_replay_to_the_legacy_layout():
+    context = MockContext()
+    handler = HelloTransactionHandler(Metrics())
+    for transaction in TRANSACTIONS:
+        handler.apply(transaction, context.for_transaction(transaction))
+
+    assert context.state == {
+        # csv transactions write the text entries they always wrote
+        legacy_batch_address('x'): b'x,3,1.5,2.0',
+        legacy_batch_address('coop/a'): encode_state(
+            [('coop/a', 8, 1.5, 52.0, 4.0, 'carol', 1)]),
+        legacy_index_address(INDEX_BATCHNR, '8'): encode_index(
+            {'8': ['coop/a']}),
+        legacy_index_address(INDEX_USER, 'carol'): encode_index(
+            {'carol': ['coop/a']}),
+        legacy_index_address(INDEX_LOCATION, cell_key(52.0, 4.0)):
+            encode_geo_index({'coop/a': (52.0, 4.0)}),
+    }
@@ -0,0 +1,117 @@
+"""
+Snapshots written by SnapshotWriter and read back by SnapshotReader.
+"""
+import pytest
+
+from hellotxp_addressing import batch_address
+from hellotxp_addressing import index_address
+from hellotxp_addressing import INDEX_PREFIXES
+from hellotxp_addressing import legacy_batch_address
+from hellotxp_addressing import legacy_index_address
+from hellotxp_codec import encode_geo_index
+from hellotxp_codec import encode_index
+from hellotxp_codec import encode_state
+from hellotxp_codec import INDEX_BATCHNR
+from hellotxp_codec import INDEX_LOCATION
+from hellotxp_codec import INDEX_USER
+from hellotxp_exceptions import HellotxpException
+from hellotxp_geo import cell_key
+from hellotxp_snapshot import export_snapshot
+from hellotxp_snapshot import SnapshotReader
+from hellotxp_snapshot import SnapshotWriter
+
+CELL = cell_key(52.0, 4.0)
+
+# one entry per layout and one per index kind
+STATE = {
+    legacy_batch_address('x'): b'x,3,1.5,2.0',
+    batch_address('coop/a'): encode_state(
+        [('coop/a', 7, 1.5, 52.0, 4.0, 'alice', 0)]),
+    legacy_index_address(INDEX_BATCHNR, '3'): encode_index({'3': ['x']}),
+    index_address(INDEX_BATCHNR, '7', 'coop/a'): encode_index(
+        {'7': ['coop/a']}),
+    index_address(INDEX_USER, 'alice', 'coop/a'): encode_index(
+        {'alice': ['coop/a']}),
+    index_address(INDEX_LOCATION, CELL, 'coop/a'): encode_geo_index(
+        {'coop/a': (52.0, 4.0)}),
+}
+
+
+class Client(object):
+    """
+    the parts of hellotxpClient export_snapshot reads
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.heads = []
+
+    def fetch_head(self, auth_user=None, auth_password=None):
+        return 'head0'
+
+    def iter_state(self, address, auth_user=None, auth_password=None,
+                   page_size=None, start=None, head=None):
+        self.heads.append(head)
+        for entry_address in sorted(self.state):
+            if entry_address.startswith(address):
+                yield entry_address, self.state[entry_address]
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = str(tmp_path / 'state.snap')
+    # one entry per chunk, so reads cross chunks
+    with SnapshotWriter(path, 'head0', chunk_size=1) as writer:
+        for address, data in STATE.items():
+            writer.add(address, data)
+    with SnapshotReader(path) as reader:
+        yield reader
+
+
+def test_round_trip(snapshot):
+    assert snapshot.head == 'head0'
+    assert len(snapshot) == len(STATE)
+    assert list(snapshot.entries()) == sorted(STATE.items())
+    assert list(snapshot.names()) == ['coop/a', 'x']
+
+
+def test_lookups(snapshot):
+    for address, data in STATE.items():
+        assert snapshot.get(address) == data
+    assert snapshot.get(legacy_batch_address('missing')) is None
+
+    assert snapshot.show('x') == b'x,3,1.5,2.0'
+    assert snapshot.show('coop/a') == STATE[batch_address('coop/a')]
+    assert snapshot.show('coop') is None
+
+    prefix = INDEX_PREFIXES[INDEX_LOCATION] + CELL[:3]
+    assert list(snapshot.entries(prefix)) == [
+        (index_address(INDEX_LOCATION, CELL, 'coop/a'),
+         STATE[index_address(INDEX_LOCATION, CELL, 'coop/a')])]
+
+
+def test_find(snapshot):
+    assert snapshot.find(batchnr=7) == ['coop/a']
+    assert snapshot.find(username='alice') == ['coop/a']
+    assert snapshot.find(batchnr=3) == ['x']
+    assert snapshot.find(username='bob') == []
+    with pytest.raises(HellotxpException):
+        snapshot.find()
+
+
+def test_export_reads_every_page_at_one_head(tmp_path):
+    client = Client(STATE)
+    path = str(tmp_path / 'state.snap')
+
+    assert export_snapshot(client, path) == ('head0', len(STATE))
+    assert client.heads == ['head0']
+    with SnapshotReader(path) as reader:
+        assert list(reader.entries()) == sorted(STATE.items())
+
+
+def test_invalid_files_are_refused(tmp_path):
+    path = tmp_path / 'state.snap'
+    path.write_bytes(b'not a snapshot' * 8)
+
+    with pytest.raises(HellotxpException):
+        SnapshotReader(str(path))
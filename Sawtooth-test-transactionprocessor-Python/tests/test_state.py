@@ -0,0 +1,64 @@
+"""
+HelloState against a dict in place of the validator's state.
+"""
+from hellotxp_addressing import legacy_batch_address
+from hellotxp_codec import decode_state
+from hellotxp_codec import encode_text_state
+from hellotxp_codec import NO_LONGITUDE
+from helloState import HarvestBatch
+from helloState import HelloState
+
+
+class StateEntry(object):
+    def __init__(self, address, data):
+        self.address = address
+        self.data = data
+
+
+class Context(object):
+    def __init__(self):
+        self.state = {}
+
+    def get_state(self, addresses, timeout=None):
+        return [StateEntry(address, self.state[address])
+                for address in addresses if address in self.state]
+
+    def set_state(self, entries, timeout=None):
+        self.state.update(entries)
+        return list(entries)
+
+    def delete_state(self, addresses, timeout=None):
+        for address in addresses:
+            self.state.pop(address, None)
+        return list(addresses)
+
+
+def test_text_entries_keep_the_csv_spelling():
+    context = Context()
+    hello_state = HelloState(context, indexes=False, legacy=True, text=True)
+
+    hello_state.set_batch('x', HarvestBatch(
+        'x', 3, 2, 2.0, NO_LONGITUDE, text=('3', '2', '2.0')))
+    hello_state.flush()
+
+    assert context.state == {legacy_batch_address('x'): b'x,3,2,2.0'}
+
+
+def test_text_entries_decode():
+    records = decode_state(encode_text_state(
+        [('y', '4', '1.5', '2.0'), ('x', '3', '2', '2.0')]))
+
+    assert [record[:4] for record in records] == [
+        ('x', 3, 2.0, 2.0), ('y', 4, 1.5, 2.0)]
+
+
+def test_binary_entries_for_other_writes():
+    context = Context()
+    hello_state = HelloState(context, indexes=False, legacy=True)
+
+    hello_state.set_batch('x', HarvestBatch('x', 3, 2, 2.0, NO_LONGITUDE))
+    hello_state.flush()
+
+    assert decode_state(context.state[legacy_batch_address('x')])[0][:3] == \
+        ('x', 3, 2.0)
+    assert context.state[legacy_batch_address('x')][0] != ord('x')
@@ -1,32 +1,71 @@
 import hashlib
+import logging
+import time
 
 from sawtooth_sdk.processor.handler import TransactionHandler
 from sawtooth_sdk.processor.exceptions import InvalidTransaction
 from sawtooth_sdk.processor.exceptions import InternalError
 import random
 # have a random number for batchnr (test purpose)
+import os
 import sys
-sys.path.append('../')
+# the hellotxp_* modules shared with the client live one directory up
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 from helloPayload import HelloPayload
 from helloState import HelloState, HarvestBatch
-from helloState import FAMILY_NAME
-from helloState import HELLOTXP_ADDRESS_PREFIX
+from helloMetrics import METRICS
+from helloMetrics import TransactionMetrics
+from hellotxp_addressing import batch_address
+from hellotxp_addressing import FAMILY_NAME
+from hellotxp_addressing import index_keys
+from hellotxp_addressing import NAMESPACE_PREFIX
+from hellotxp_codec import CSV_FAMILY_VERSION
+from hellotxp_codec import BINARY_FAMILY_VERSION
+from hellotxp_codec import FIELD_BATCHNR
+from hellotxp_codec import FIELD_LOCATION
+from hellotxp_codec import FIELD_OWNER
+from hellotxp_codec import FIELD_VOLUME
+from hellotxp_codec import INDEX_USER
+from hellotxp_codec import INDEXED_FIELDS
+from hellotxp_codec import legacy_layout
+from hellotxp_codec import NO_REVISION
+
+LOGGER = logging.getLogger(__name__)
+
+# Reason label of invalid transactions raised while parsing the payload.
+INVALID_PAYLOAD = 'invalid_payload'
+
+
+def _invalid_transaction(reason, message):
+    """
+    InvalidTransaction carrying a fixed reason label for the metrics, the
+    message may name the batch
+    """
+    err = InvalidTransaction(message)
+    err.reason = reason
+    return err
 
 # HelloTransactionHandler extends the transactionhandler
 
 
 class HelloTransactionHandler(TransactionHandler):
+    def __init__(self, metrics=METRICS):
+        """
+        :param metrics: helloMetrics.Metrics recording every apply call
+        """
+        self._metrics = metrics
+
     @property
     def family_name(self):
         return FAMILY_NAME
 
     @property
     def family_versions(self):
-        return ['0.1']
+        return [CSV_FAMILY_VERSION, BINARY_FAMILY_VERSION]
 
     @property
     def namespaces(self):
-        return [HELLOTXP_ADDRESS_PREFIX]
+        return [NAMESPACE_PREFIX]
 
     # Handlers get called in two ways, with an "apply" method and with "metadata" methods.
     #  metadata methods provide connection between handler and transactionprocessor.
@@ -36,57 +75,203 @@ class HelloTransactionHandler(TransactionHandler):
     # context parameter stores information about the current state
 
     def apply(self, transaction, context):
-        print("create transaction header")
-        header = transaction.header
-        signer = header.signer_public_key
-        print("payload")
-        hello_payload = HelloPayload.from_bytes(transaction.payload)
-        print(hello_payload)
-        print("state is put away")
-
-        hello_state = HelloState(context)
-        print(hello_state)
-        print("start create batch")
-        print(hello_payload.batchnr)
-        print(hello_payload)
+        timings = TransactionMetrics()
+        action = 'unknown'
+        start = time.perf_counter()
+        try:
+            header = transaction.header
+            operations = HelloPayload.operations_from_bytes(
+                transaction.payload, header.family_version)
+            timings.add('parse', time.perf_counter() - start)
+
+            action = _action_label(operations)
+            self._apply_operations(
+                header, operations, context, timings,
+                legacy_layout(transaction.payload, header.family_version))
+        except InvalidTransaction as err:
+            timings.add('total', time.perf_counter() - start)
+            self._metrics.record(
+                action, timings, getattr(err, 'reason', INVALID_PAYLOAD))
+            raise
+
+        timings.add('total', time.perf_counter() - start)
+        self._metrics.record(action, timings)
+
+    def _apply_operations(self, header, operations, context, timings,
+                          legacy=False):
+        LOGGER.debug(
+            'Applying %d actions from signer %s',
+            len(operations), header.signer_public_key)
+
+        # the header of a csv payload declares the batch address only, so
+        # the index records are kept for binary payloads alone, and csv
+        # payloads write the text entries they always wrote. Payloads
+        # written before the leaf layout replay in the legacy layout.
+        csv = header.family_version == CSV_FAMILY_VERSION
+        indexes = not csv
+        hello_state = HelloState(
+            context, timings, indexes=indexes, legacy=legacy, text=csv)
+
+        # names taken in either address layout stay taken. csv and older
+        # clients declared only the legacy address of a create, so those
+        # creates replay without looking at the leaf layout.
+        checked = {
+            operation.name for operation in operations
+            if operation.action == 'create' and (
+                not legacy or
+                _declares(header, batch_address(operation.name)))
+        }
+
+        # read every address the transaction touches with one get_state call
+        hello_state.prefetch(
+            [operation.name for operation in operations],
+            _index_keys(operations) if indexes else (),
+            checked)
+
+        for hello_payload in operations:
+            self._apply_operation(hello_payload, hello_state, checked)
+
+        # write all state changes of this transaction at once
+        hello_state.flush()
+
+    def _apply_operation(self, hello_payload, hello_state, checked=()):
+        """
+        :param checked: names of the creates to refuse when the other
+            address layout holds them
+        """
+        LOGGER.debug(
+            'Action %s on batch %s', hello_payload.action, hello_payload.name)
         if hello_payload.action == 'create':
 
             #new_batchnr = random.randint(1,50)
-            #print(new_batchnr)
-            print(hello_payload.name,hello_payload.batchnr)
-            if hello_state.get_batch(hello_payload.name) is not None:
-                print("file exists")
-                raise InvalidTransaction(
+            if hello_state.get_batch(hello_payload.name) is not None or (
+                    hello_payload.name in checked and
+                    hello_state.get_other_batch(hello_payload.name) is not None):
+                raise _invalid_transaction(
+                    'batch_exists',
                     'Invalid action: Batch already exists: {}'.format(hello_payload.name)
                 )
-            print("creating a new  batch")
             batch = HarvestBatch(coopname=hello_payload.name,
                                  batchnr=hello_payload.batchnr,
                                  volume=hello_payload.volume,
-                                 latlong= hello_payload.latlong
+                                 latitude=hello_payload.latitude,
+                                 longitude=hello_payload.longitude,
+                                 owner=hello_payload.username,
+                                 text=hello_payload.text
                                 )
-            print(hello_payload.name,hello_payload.batchnr,hello_payload.volume,hello_payload.latlong)
-            print(batch.coopname,batch.batchnr,batch.volume,batch.latlong)
+            LOGGER.debug(
+                'Created batch %s: batchnr %s, volume %s, location %s, %s',
+                batch.coopname, batch.batchnr, batch.volume, batch.latitude,
+                batch.longitude)
 
-            print("batch created ")
-            print(str(batch.batchnr))
             hello_state.set_batch(hello_payload.name, batch)
-            print("get state")
         if hello_payload.action == 'delete':
             harvestbatch=hello_state.get_batch(hello_payload.name)
             if harvestbatch is None:
-                raise InvalidTransaction('Invalid action: batch does not exist')
+                raise _invalid_transaction(
+                    'batch_not_found', 'Invalid action: batch does not exist')
+            _check_stored(harvestbatch, hello_payload, INDEXED_FIELDS)
             hello_state.delete_batch(hello_payload.name)
 
         if hello_payload.action == 'update':
             batch = hello_state.get_batch(hello_payload.name)
 
             if batch is None:
-                raise InvalidTransaction(
+                raise _invalid_transaction(
+                    'batch_not_found',
                     'Invalid action: No batch found to update by this name'
                 )
+            if hello_payload.expected_revision != NO_REVISION and \
+                    hello_payload.expected_revision != batch.revision:
+                raise _invalid_transaction(
+                    'revision_mismatch',
+                    'Invalid action: Batch {} is at revision {}, not {}'.format(
+                        hello_payload.name, batch.revision,
+                        hello_payload.expected_revision))
+            _check_stored(batch, hello_payload, hello_payload.fields)
+
+            # updates in payload formats before 4 have no fields and, as
+            # before, change nothing
+            if hello_payload.fields:
+                hello_state.set_batch(
+                    hello_payload.name, _updated_batch(batch, hello_payload))
+
+
+def _declares(header, address):
+    return any(address.startswith(prefix) for prefix in header.inputs)
+
+
+def _check_stored(batch, hello_payload, fields):
+    """
+    reject a delete or update whose stored values, from which its
+    transaction declares the index leaves it changes, no longer index the
+    batch
+    :param fields: FIELD_* bits of the stored values to check
+    """
+    stored = hello_payload.stored
+    if stored is None:
+        return
+    keys = index_keys(
+        batch.batchnr, batch.latitude, batch.longitude, batch.owner, fields)
+    if index_keys(*stored, fields=fields) != keys:
+        raise _invalid_transaction(
+            'stale_values',
+            'Invalid action: Batch {} has changed since it was read'.format(
+                hello_payload.name))
+
+
+def _updated_batch(batch, hello_payload):
+    """
+    :return: a new HarvestBatch with the fields of an update merged into
+        batch, one revision later
+    """
+    fields = hello_payload.fields
+    updated = HarvestBatch(
+        coopname=batch.coopname,
+        batchnr=hello_payload.batchnr if fields & FIELD_BATCHNR else batch.batchnr,
+        volume=hello_payload.volume if fields & FIELD_VOLUME else batch.volume,
+        latitude=batch.latitude,
+        longitude=batch.longitude,
+        owner=hello_payload.username if fields & FIELD_OWNER else batch.owner,
+        revision=batch.revision + 1)
+    if fields & FIELD_LOCATION:
+        updated.latitude = hello_payload.latitude
+        updated.longitude = hello_payload.longitude
+    return updated
 
-        # update_batch = hello_state.
 
+def _index_keys(operations):
+    # index entries the operations are expected to change. Deletes and
+    # updates carry the stored batchnr, owner and location since payload
+    # format 5; those not known from older payloads are read when the
+    # batch is changed.
+    keys = set()
+    for operation in operations:
+        name = operation.name
+        stored = operation.stored
+        if operation.action == 'update':
+            fields = operation.fields & INDEXED_FIELDS
+            found = index_keys(
+                operation.batchnr, operation.latitude, operation.longitude,
+                operation.username, fields)
+            if stored is not None:
+                found += index_keys(*stored, fields=fields)
+        elif operation.action == 'create':
+            found = index_keys(
+                operation.batchnr, operation.latitude, operation.longitude,
+                operation.username)
+        elif operation.action == 'delete' and stored is not None:
+            found = index_keys(*stored)
+        elif operation.action == 'delete' and operation.username:
+            found = [(INDEX_USER, operation.username)]
+        else:
+            found = []
+        keys.update((kind, key, name) for kind, key in found)
+    return keys
 
 
+def _action_label(operations):
+    actions = {operation.action for operation in operations}
+    if len(actions) == 1:
+        return actions.pop()
+    return 'mixed'
@@ -0,0 +1,48 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+
+LOG_FORMAT = '[%(asctime)s.%(msecs)03d %(levelname)-8s %(name)s] %(message)s'
+LOG_DATE_FORMAT = '%H:%M:%S'
+
+
+def log_level(verbose_level):
+    """
+    map the count of -v flags to a logging level: warnings by default,
+    info for -v and debug for -vv
+    """
+    if verbose_level == 0:
+        return logging.WARNING
+    elif verbose_level == 1:
+        return logging.INFO
+    return logging.DEBUG
+
+
+def setup_logging(verbose_level):
+    """
+    send log records through a queue to a listener thread that formats and
+    writes them to stderr, so the threads applying transactions never block
+    on I/O. Records below the level of verbose_level are dropped before they
+    are created, so disabled debug calls cost one level check and no
+    formatting.
+
+    :param verbose_level: count of -v flags
+    :return: the started QueueListener, stopped at interpreter exit
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler)
+
+    root = logging.getLogger()
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(log_level(verbose_level))
+
+    listener.start()
+    atexit.register(listener.stop)
+
+    return listener
@@ -0,0 +1,208 @@
+import bisect
+import http.server
+import logging
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency histogram buckets. apply usually
+# takes well under a millisecond plus the validator round trips of
+# get_state and set_state.
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Phases of apply timed separately, 'total' covers the whole call.
+PHASES = (
+    'parse', 'get_state', 'deserialize', 'serialize', 'set_state',
+    'delete_state', 'total')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram(object):
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # one count per bucket plus the +Inf bucket, not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class TransactionMetrics(object):
+    """
+    measurements of one apply call, collected without locking and handed
+    to Metrics.record once the transaction is done
+    """
+    __slots__ = ('phases', 'bytes_read', 'bytes_written')
+
+    def __init__(self):
+        self.phases = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add(self, phase, seconds):
+        phases = self.phases
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+class Metrics(object):
+    """
+    latency histograms by action and phase, transaction counts by action
+    and result, invalid transaction counts by reason and state bytes read
+    and written, rendered in the Prometheus text format.
+
+    Transactions are applied on the SDK's worker threads, so every
+    transaction takes the lock once, in record.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # (action, phase) -> Histogram
+        self._latency = {}
+        # (action, result) -> count
+        self._transactions = {}
+        # reason -> count
+        self._invalid = {}
+        self._state_bytes = {'read': 0, 'written': 0}
+
+    def record(self, action, timings, invalid_reason=None):
+        """
+        add the measurements of one apply call
+        :param action: the transaction's action, 'mixed' or 'unknown'
+        :param timings: TransactionMetrics of the call
+        :param invalid_reason: reason label if the transaction was invalid
+        """
+        result = 'ok' if invalid_reason is None else 'invalid'
+        with self._lock:
+            for phase, seconds in timings.phases.items():
+                histogram = self._latency.get((action, phase))
+                if histogram is None:
+                    histogram = self._latency[(action, phase)] = \
+                        Histogram(self._buckets)
+                histogram.observe(seconds)
+
+            key = (action, result)
+            self._transactions[key] = self._transactions.get(key, 0) + 1
+            if invalid_reason is not None:
+                self._invalid[invalid_reason] = \
+                    self._invalid.get(invalid_reason, 0) + 1
+
+            self._state_bytes['read'] += timings.bytes_read
+            self._state_bytes['written'] += timings.bytes_written
+
+    def render(self):
+        """
+        :return: all metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            latency = [
+                (key, list(h.counts), h.sum, h.count)
+                for key, h in sorted(self._latency.items())
+            ]
+            transactions = sorted(self._transactions.items())
+            invalid = sorted(self._invalid.items())
+            state_bytes = sorted(self._state_bytes.items())
+
+        lines = [
+            '# HELP hellotxp_apply_seconds Time spent applying transactions '
+            'by action and phase',
+            '# TYPE hellotxp_apply_seconds histogram',
+        ]
+        for (action, phase), counts, total, count in latency:
+            labels = 'action="{}",phase="{}"'.format(action, phase)
+            cumulative = 0
+            for bound, bucket_count in zip(self._buckets, counts):
+                cumulative += bucket_count
+                lines.append('hellotxp_apply_seconds_bucket{{{},le="{}"}} {}'
+                             .format(labels, bound, cumulative))
+            lines.append('hellotxp_apply_seconds_bucket{{{},le="+Inf"}} {}'
+                         .format(labels, count))
+            lines.append('hellotxp_apply_seconds_sum{{{}}} {!r}'
+                         .format(labels, total))
+            lines.append('hellotxp_apply_seconds_count{{{}}} {}'
+                         .format(labels, count))
+
+        lines.append('# HELP hellotxp_transactions_total Transactions applied '
+                     'by action and result')
+        lines.append('# TYPE hellotxp_transactions_total counter')
+        for (action, result), count in transactions:
+            lines.append(
+                'hellotxp_transactions_total{{action="{}",result="{}"}} {}'
+                .format(action, result, count))
+
+        lines.append('# HELP hellotxp_invalid_transactions_total Invalid '
+                     'transactions by reason')
+        lines.append('# TYPE hellotxp_invalid_transactions_total counter')
+        for reason, count in invalid:
+            lines.append(
+                'hellotxp_invalid_transactions_total{{reason="{}"}} {}'
+                .format(reason, count))
+
+        lines.append('# HELP hellotxp_state_bytes_total Bytes of state '
+                     'entries read and written')
+        lines.append('# TYPE hellotxp_state_bytes_total counter')
+        for direction, count in state_bytes:
+            lines.append('hellotxp_state_bytes_total{{direction="{}"}} {}'
+                         .format(direction, count))
+
+        return '\n'.join(lines) + '\n'
+
+
+# Metrics of this process, recorded by HelloTransactionHandler.
+METRICS = Metrics()
+
+
+def start_http_server(port, host='', metrics=METRICS):
+    """
+    serve metrics.render() at /metrics from a daemon thread
+    :param port: port to listen on
+    :return: the running ThreadingHTTPServer, stop it with shutdown()
+    """
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            LOGGER.debug('metrics request: ' + format, *args)
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(
+        target=server.serve_forever, name='hellotxp-metrics', daemon=True)
+    thread.start()
+    LOGGER.info('Serving metrics on port %d', port)
+    return server
+
+
+def start_periodic_dump(interval, metrics=METRICS):
+    """
+    log metrics.render() at info level every interval seconds from a
+    daemon thread
+    :return: threading.Event, set it to stop dumping
+    """
+    stopped = threading.Event()
+
+    def dump():
+        while not stopped.wait(interval):
+            LOGGER.info('hellotxp metrics\n%s', metrics.render())
+
+    threading.Thread(
+        target=dump, name='hellotxp-metrics-dump', daemon=True).start()
+    return stopped
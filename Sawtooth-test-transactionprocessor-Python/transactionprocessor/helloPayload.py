@@ -1,15 +1,20 @@
+import math
+
 from sawtooth_sdk.processor.exceptions import InvalidTransaction
 
-class HelloPayload(object):
-    def __init__(self,payload):
-        try:
-            # the payload is csv utf-8 encoded string
-            name, action, batchnr, volume, latlong, username = payload.decode().split(",")
-            print("try init payload")
-            print(name,action,batchnr, volume, latlong, username)
-        except ValueError:
-            raise InvalidTransaction('Invalid payload serialization')
+from hellotxp_codec import CodecError
+from hellotxp_codec import CSV_FAMILY_VERSION
+from hellotxp_codec import BINARY_FAMILY_VERSION
+from hellotxp_codec import decode_payload
+from hellotxp_codec import FIELD_LOCATION
+from hellotxp_codec import NO_LONGITUDE
+from hellotxp_codec import NO_REVISION
+from hellotxp_geo import valid_position
 
+class HelloPayload(object):
+    def __init__(self, name, action, batchnr, volume, latitude, longitude,
+                 username, fields=0, expected_revision=NO_REVISION,
+                 stored=None, text=None):
         if not name:
             raise InvalidTransaction('name is required')
 
@@ -22,20 +27,84 @@ class HelloPayload(object):
         if action not in ('create','delete','update','list'):
             raise InvalidTransaction('Invalid Action: {}'.format(action))
 
+        # payloads with a single latlong value carry no longitude and are
+        # not checked, unless an update sets the location
+        if (not math.isnan(longitude) or fields & FIELD_LOCATION) and \
+                not valid_position(latitude, longitude):
+            raise InvalidTransaction(
+                'Invalid location: {}, {}'.format(latitude, longitude))
+
         self._name = name
         self._action = action
         self._batchnr = batchnr
         self._volume = volume
         self._username = username
-        self._latlong = latlong
+        self._latitude = latitude
+        self._longitude = longitude
+        # FIELD_* bits of the fields an update changes, and the revision
+        # the batch must have for it to apply
+        self._fields = fields
+        self._expected_revision = expected_revision
+        # (batchnr, latitude, longitude, owner) a delete or update expects
+        # the batch to have, None before payload format 5
+        self._stored = stored
+        # (batchnr, volume, latlong) as a csv payload spelled them, None
+        # for binary payloads
+        self._text = text
 
-        # self._latitude = latitude
-        # self._longitude = longitude
-        # self._batchnr = batchnr
+    @staticmethod
+    def from_bytes(payload, family_version=CSV_FAMILY_VERSION):
+        """
+        parse a payload holding a single action
+        :param payload: the transaction payload bytes
+        :param family_version: family_version from the transaction header
+        :return: HelloPayload
+        """
+        operations = HelloPayload.operations_from_bytes(payload, family_version)
+        if len(operations) != 1:
+            raise InvalidTransaction('Expected a payload with one action')
+        return operations[0]
 
     @staticmethod
-    def from_bytes(payload):
-        return HelloPayload(payload=payload)
+    def operations_from_bytes(payload, family_version=CSV_FAMILY_VERSION):
+        """
+        parse a payload in the format of the transaction's family version
+        :param payload: the transaction payload bytes
+        :param family_version: family_version from the transaction header
+        :return: list of HelloPayload, one per action, in payload order
+        """
+        if family_version == CSV_FAMILY_VERSION:
+            return [HelloPayload._parse_csv(payload)]
+        if family_version != BINARY_FAMILY_VERSION:
+            raise InvalidTransaction(
+                'Unsupported family version: {}'.format(family_version))
+
+        try:
+            operations = decode_payload(payload)
+        except CodecError as err:
+            raise InvalidTransaction(str(err))
+        return [HelloPayload(*fields) for fields in operations]
+
+    @staticmethod
+    def _parse_csv(payload):
+        try:
+            # the payload is csv utf-8 encoded string
+            name, action, batchnr, volume, latlong, username = payload.decode().split(",")
+        except ValueError:
+            raise InvalidTransaction('Invalid payload serialization')
+
+        # only creates use the numbers; other actions were accepted with
+        # the fields left empty, e.g. x,delete,,,,u, and must still replay
+        if action != 'create':
+            return HelloPayload(
+                name, action, 0, 0.0, 0.0, NO_LONGITUDE, username)
+        try:
+            numbers = int(batchnr), float(volume), float(latlong)
+        except ValueError:
+            raise InvalidTransaction('Invalid payload serialization')
+        return HelloPayload(
+            name, action, *numbers, NO_LONGITUDE, username,
+            text=(batchnr, volume, latlong))
 
     @property
     def name(self):
@@ -53,15 +122,29 @@ class HelloPayload(object):
         return self._volume
 
     @property
-    def latlong(self):
-        return self._latlong
+    def latitude(self):
+        return self._latitude
+
+    @property
+    def longitude(self):
+        return self._longitude
 
     @property
     def username(self):
         return self._username
 
+    @property
+    def fields(self):
+        return self._fields
+
+    @property
+    def expected_revision(self):
+        return self._expected_revision
 
-    # @property
-    # def longitude(self):
-    #     return self._longitude
-    #
+    @property
+    def stored(self):
+        return self._stored
+
+    @property
+    def text(self):
+        return self._text
@@ -1,22 +1,58 @@
-import hashlib
+import logging
+import time
 
 from sawtooth_sdk.processor.exceptions import InternalError
-FAMILY_NAME="hellotxp"
 
-#Addresses must be a 70 character hexadecimal string
-#The first 6 characters of the address are the first 6 characters of a sha512 hash of the transactionprocessor namespace prefix: eg. testproc
-HELLOTXP_ADDRESS_PREFIX = hashlib.sha512(FAMILY_NAME.encode('utf-8')).hexdigest()[0:6]
-
-#The following 64 characters of the address are the last 64 characters of a sha512 hash of the entry Name
-def _make_hellotxp_address(name):
-    return HELLOTXP_ADDRESS_PREFIX + hashlib.sha512(name.encode('utf-8')).hexdigest()[:64]
+from hellotxp_codec import CodecError
+from hellotxp_codec import decode_geo_index
+from hellotxp_codec import decode_index
+from hellotxp_codec import decode_state
+from hellotxp_codec import encode_geo_index
+from hellotxp_codec import encode_index
+from hellotxp_codec import encode_state
+from hellotxp_codec import encode_text_state
+from hellotxp_codec import GEO_INDEX_FORMAT_V1
+from hellotxp_codec import INDEX_BATCHNR
+from hellotxp_codec import INDEX_LOCATION
+from hellotxp_codec import INDEX_USER
+from hellotxp_addressing import batch_address
+from hellotxp_addressing import index_address
+from hellotxp_addressing import INDEX_PREFIXES
+from hellotxp_addressing import legacy_batch_address
+from hellotxp_addressing import legacy_index_address
+from hellotxp_geo import cell_key
+from hellotxp_geo import valid_position
+
+from helloMetrics import TransactionMetrics
+
+LOGGER = logging.getLogger(__name__)
+
+#Harvest batches and their index records are stored at the addresses
+#described in hellotxp_addressing, in the legacy layout for the
+#transactions that were written with it.
 
 class HarvestBatch(object):
-    def __init__(self,coopname,batchnr,volume, latlong):
+    # state reads create one HarvestBatch per stored batch, slots keep them
+    # small and typed
+    __slots__ = ('coopname', 'batchnr', 'volume', 'latitude', 'longitude',
+                 'owner', 'revision', 'text')
+
+    def __init__(self,coopname,batchnr,volume, latitude, longitude, owner='',
+                 revision=0, text=None):
         self.coopname = coopname
-        self.batchnr = batchnr
-        self.volume = volume
-        self.latlong = latlong
+        self.batchnr = int(batchnr)
+        self.volume = float(volume)
+        # batches stored with a single latlong value have a NaN longitude
+        self.latitude = float(latitude)
+        self.longitude = float(longitude)
+        # username that created the batch, '' for batches stored before
+        # owners were recorded
+        self.owner = owner
+        # number of updates applied to the batch
+        self.revision = int(revision)
+        # (batchnr, volume, latlong) text of a batch created by a csv
+        # payload, which the text state format stores as it was sent
+        self.text = text
 
 
 
@@ -24,16 +60,128 @@ class HelloState(object):
 
     TIMEOUT = 3
 
-    def __init__(self, context):
+    def __init__(self, context, timings=None, indexes=True, legacy=False,
+                 text=False):
         """
         Args:
         context (sawtooth_sdk.transactionprocessor.context.Context): Access to
             validator state from within the transaction transactionprocessor.
+        timings (helloMetrics.TransactionMetrics): collects the time spent
+            in state calls and codecs and the state bytes read and written.
+        indexes (bool): keep the index records of the batches changed.
+            Transactions that do not declare the index addresses leave
+            them alone.
+        legacy (bool): address batches and index entries in the legacy
+            layout, see hellotxp_addressing.
+        text (bool): write harvest batch entries in the text state format
+            of family version 0.1 instead of the binary one.
         """
         self._context = context
+        self._timings = TransactionMetrics() if timings is None else timings
+        self._indexes = indexes
+        self._legacy = legacy
+        self._text = text
+        # address -> decoded {name: HarvestBatch} dict, {} for empty
+        # addresses. Each address is read and decoded once per transaction.
         self._address_cache = {}
+        # addresses whose cached dict changed and has not been written yet,
+        # see flush
+        self._dirty = set()
+        # index leaf address -> decoded {key: set of names} dict, or for
+        # location index leaves {name: (latitude, longitude)}, and the
+        # index leaves changed since the last flush
+        self._index_cache = {}
+        self._dirty_indexes = set()
+        self._stats = {'hits': 0, 'misses': 0, 'decodes': 0, 'encodes': 0}
+
+    @property
+    def stats(self):
+        """
+        cache counters: hits and misses of address lookups, and the number
+        of state entries decoded and encoded
+        """
+        return dict(self._stats)
 
-        print(context)
+    def flush(self):
+        """
+        write every address changed since the last flush to validator
+        state, harvest batches and index entries alike, with one set_state
+        call for the addresses that still hold data and one delete_state
+        call for the ones left empty.
+
+        Call once at the end of a transaction. Writes are only buffered
+        in this object, so a transaction that fails before flush leaves
+        state untouched, the same as the validator discarding the state
+        changes of an invalid transaction.
+        """
+        timings = self._timings
+        entries = {}
+        deleted = []
+        start = time.perf_counter()
+        for address in sorted(self._dirty):
+            batches = self._address_cache[address]
+            if batches:
+                entries[address] = self._serialize(batches)
+                timings.bytes_written += len(entries[address])
+            else:
+                deleted.append(address)
+        for address in sorted(self._dirty_indexes):
+            index = self._index_cache[address]
+            if any(index.values()):
+                entries[address] = self._serialize_index(address, index)
+                timings.bytes_written += len(entries[address])
+            else:
+                deleted.append(address)
+        if self._dirty or self._dirty_indexes:
+            timings.add('serialize', time.perf_counter() - start)
+
+        LOGGER.debug(
+            'Flushing %d set and %d deleted addresses, cache %s',
+            len(entries), len(deleted), self._stats)
+        if entries:
+            start = time.perf_counter()
+            self._context.set_state(entries, timeout=self.TIMEOUT)
+            timings.add('set_state', time.perf_counter() - start)
+        if deleted:
+            start = time.perf_counter()
+            self._context.delete_state(deleted, timeout=self.TIMEOUT)
+            timings.add('delete_state', time.perf_counter() - start)
+
+        self._dirty.clear()
+        self._dirty_indexes.clear()
+
+    def prefetch(self, names, index_keys=(), other_names=()):
+        """
+        load the addresses of all names and index keys with a single
+        get_state call, so later calls reading them are cache hits
+        :param names: names of the harvest batches the transaction touches
+        :param index_keys: (index kind, key, name) of the index leaves
+            the transaction is expected to change
+        :param other_names: names to look up with get_other_batch
+        """
+        addresses = set(map(self._batch_address, names))
+        addresses.update(map(self._other_batch_address, other_names))
+        addresses.difference_update(self._address_cache)
+        index_addresses = {
+            self._index_address(kind, key, name)
+            for kind, key, name in index_keys
+        }.difference(self._index_cache)
+        if not addresses and not index_addresses:
+            return
+
+        self._stats['misses'] += len(addresses) + len(index_addresses)
+        state_entries = self._get_state(sorted(addresses | index_addresses))
+        for entry in state_entries:
+            if entry.address in index_addresses:
+                self._index_cache[entry.address] = \
+                    self._deserialize_index(entry.data)
+            else:
+                self._address_cache[entry.address] = \
+                    self._deserialize(entry.data)
+        for address in addresses:
+            self._address_cache.setdefault(address, {})
+        for address in index_addresses:
+            self._index_cache.setdefault(address, {})
 
     def delete_batch(self,name):
         """
@@ -42,11 +190,9 @@ class HelloState(object):
          """
         batches = self._load_batches(name=name)
 
+        self._unindex_batch(name, batches[name])
         del batches[name]
-        if batches:
-            self._store_batch(name, batches = batches)
-        else:
-            self._delete_batch(name)
+        self._store_batch(name, batches = batches)
 
     def set_batch(self, name, harvestbatch):
         """
@@ -56,13 +202,15 @@ class HelloState(object):
         :param coop: information of coop
 
         """
-        print(harvestbatch)
         batches = self._load_batches(name=name)
 
+        if name in batches:
+            self._reindex_batch(name, batches[name], harvestbatch)
+        else:
+            self._index_batch(name, harvestbatch)
         batches[name] = harvestbatch
 
         self._store_batch(name, batches=batches)
-        print("set batch in validator state")
 
     def get_batch(self, name):
         """
@@ -73,6 +221,94 @@ class HelloState(object):
 
         return self._load_batches(name).get(name)
 
+    def get_other_batch(self, name):
+        """
+        :return: the harvest batch name stored in the address layout this
+            state does not write, or None
+        """
+        return self._load_address(self._other_batch_address(name)).get(name)
+
+    def _index_batch(self, name, harvestbatch):
+        if not self._indexes:
+            return
+        self._index_names(INDEX_BATCHNR, str(harvestbatch.batchnr), name).add(name)
+        if harvestbatch.owner:
+            self._index_names(INDEX_USER, harvestbatch.owner, name).add(name)
+        location = _location(harvestbatch)
+        if location is not None:
+            self._changed_index(
+                INDEX_LOCATION, cell_key(*location), name)[name] = location
+
+    def _unindex_batch(self, name, harvestbatch):
+        if not self._indexes:
+            return
+        self._index_names(
+            INDEX_BATCHNR, str(harvestbatch.batchnr), name).discard(name)
+        if harvestbatch.owner:
+            self._index_names(INDEX_USER, harvestbatch.owner, name).discard(name)
+        location = _location(harvestbatch)
+        if location is not None:
+            self._changed_index(
+                INDEX_LOCATION, cell_key(*location), name).pop(name, None)
+
+    def _reindex_batch(self, name, old, new):
+        # only the index leaves of the values that changed are read and
+        # written
+        if not self._indexes:
+            return
+        if old.batchnr != new.batchnr:
+            self._index_names(INDEX_BATCHNR, str(old.batchnr), name).discard(name)
+            self._index_names(INDEX_BATCHNR, str(new.batchnr), name).add(name)
+        if old.owner != new.owner:
+            if old.owner:
+                self._index_names(INDEX_USER, old.owner, name).discard(name)
+            if new.owner:
+                self._index_names(INDEX_USER, new.owner, name).add(name)
+        old_location = _location(old)
+        new_location = _location(new)
+        if old_location != new_location:
+            if old_location is not None:
+                self._changed_index(
+                    INDEX_LOCATION, cell_key(*old_location), name).pop(name, None)
+            if new_location is not None:
+                self._changed_index(
+                    INDEX_LOCATION, cell_key(*new_location), name)[name] = \
+                    new_location
+
+    def _index_names(self, kind, key, name):
+        """
+        the set of names of one index key in the leaf of name, for
+        changing. Keys left without names are dropped when the leaf is
+        serialized.
+        """
+        return self._changed_index(kind, key, name).setdefault(key, set())
+
+    def _changed_index(self, kind, key, name):
+        """
+        the cached index leaf of key and name, marked to be written by flush
+        """
+        index = self._load_index(kind, key, name)
+        self._dirty_indexes.add(self._index_address(kind, key, name))
+        return index
+
+    def _load_index(self, kind, key, name):
+        address = self._index_address(kind, key, name)
+
+        index = self._index_cache.get(address)
+        if index is not None:
+            self._stats['hits'] += 1
+            return index
+
+        self._stats['misses'] += 1
+        state_entries = self._get_state([address])
+        if state_entries:
+            index = self._deserialize_index(state_entries[0].data)
+        else:
+            index = {}
+
+        self._index_cache[address] = index
+        return index
+
     def _store_batch(self, name, batches):
         """
         store harvest batch on the tree
@@ -83,74 +319,82 @@ class HelloState(object):
         In particular, an 'hellotxp' address consists of the first 6 characters of the SHA-512 hash of the UTF-8 encoding of the string “hellotxp” (which is “314d67”)
         plus the first 64 characters of the SHA-512 hash of the UTF-8 encoding of the batchnr. for example 314d677ac185f8a0e1d5f84f88bc887fd67b143732c304cc5fa9ad8e6f57f50028a8ff
 
+        The write is buffered until flush. An address without batches
+        left is deleted from state.
+
         :param batchnr: batchnr of the associated batch
         :param batches:list of batches
         :return:
         """
-        print("store batch function")
-        print(str(batches[name].batchnr))
-        nameToSet = name
-        address = _make_hellotxp_address(nameToSet)
-
-        state_data = self._serialize(batches)
-        self._address_cache[address] = state_data
-        self._context.set_state({address: state_data},timeout=self.TIMEOUT)
-        print("stored batch")
-
-    def _delete_batch(self,name):
-
-        address = _make_hellotxp_address(name)
+        address = self._batch_address(name)
 
-        self._context.delete_state(
-            [address],
-            timeout=self.TIMEOUT)
-
-        self._address_cache[address] = None
+        self._address_cache[address] = batches
+        self._dirty.add(address)
 
     def _load_batches(self, name):
-        print("name in load batches is: " + name)
-        print("address created")
-        address = _make_hellotxp_address(name)
-        print(address)
-
-        if address in self._address_cache:
-            print("serializing batches")
-            if self._address_cache[address]:
-                serialized_batches = self._address_cache[address]
-                batches = self._deserialize(serialized_batches)
-            else:
-                batches = {}
+        return self._load_address(self._batch_address(name))
+
+    def _load_address(self, address):
+        batches = self._address_cache.get(address)
+        if batches is not None:
+            self._stats['hits'] += 1
+            return batches
+
+        self._stats['misses'] += 1
+        state_entries = self._get_state([address])
+        if state_entries:
+            batches = self._deserialize(data=state_entries[0].data)
         else:
-            print("start else loading batches")
-            state_entries = self._context.get_state(
-                [address],
-                timeout=self.TIMEOUT
-            )
-            print(state_entries)
-            if state_entries:
-                self._address_cache[address] = state_entries[0].data
-                batches = self._deserialize(data=state_entries[0].data)
-            else:
-                self._address_cache[address] = None
-                batches = {}
-        print(batches)
+            batches = {}
+
+        self._address_cache[address] = batches
         return batches
 
+    def _batch_address(self, name):
+        if self._legacy:
+            return legacy_batch_address(name)
+        return batch_address(name)
+
+    def _other_batch_address(self, name):
+        if self._legacy:
+            return batch_address(name)
+        return legacy_batch_address(name)
+
+    def _index_address(self, kind, key, name):
+        # a legacy index entry holds the records of every batch with key
+        if self._legacy:
+            return legacy_index_address(kind, key)
+        return index_address(kind, key, name)
+
+    def _get_state(self, addresses):
+        timings = self._timings
+        start = time.perf_counter()
+        state_entries = self._context.get_state(
+            addresses,
+            timeout=self.TIMEOUT
+        )
+        timings.add('get_state', time.perf_counter() - start)
+        for entry in state_entries:
+            timings.bytes_read += len(entry.data)
+        return state_entries
+
     def _deserialize(self,data):
         """
         take bytes stored in state and deserialize them into python objects
-        :param data: the utf-8 encoded string stored in state
-        :return: (dict):batchnr and harvest batch values
+        :param data: the state entry, binary or legacy utf-8 text
+        :return: (dict):name and harvest batch values
         """
-        batches = {}
+        self._stats['decodes'] += 1
+        start = time.perf_counter()
         try:
-            for batch in data.decode().split("|"):
-                coopname,batchnr,volume = batch.split(",")
-                batches[coopname] = HarvestBatch(coopname,batchnr,volume)
-        except ValueError:
+            return {
+                record[0]: HarvestBatch(*record)
+                for record in decode_state(data)
+            }
+        except (CodecError, ValueError):
             raise  InternalError("Failed to deserialize batch data")
-
-        return batches
+        finally:
+            self._timings.add('deserialize', time.perf_counter() - start)
 
     def _serialize(self,batches):
         """
@@ -158,31 +402,57 @@ class HelloState(object):
 
 
         :param batches:
-        :return: the utf-8 encoded string stored in state.
+        :return: the state entry stored in state, binary or utf-8 text.
         """
-        print("serializing data")
-        batch_strs = []
-
-        for name,b in batches.items():
-            print("starting loop to generate encoded string")
-            print(name + " " + str(b.batchnr)+ " " + str(b.volume)+ " " + str(b.latlong))
-            batch_str = ",".join(
-                [name,b.batchnr,b.volume,b.latlong]
+        self._stats['encodes'] += 1
+        if self._text:
+            return encode_text_state(
+                (name,) + (b.text or (str(b.batchnr), str(b.volume),
+                                      str(b.latitude)))
+                for name, b in batches.items()
             )
+        try:
+            return encode_state(
+                (name, b.batchnr, b.volume, b.latitude, b.longitude, b.owner,
+                 b.revision)
+                for name, b in batches.items()
+            )
+        except CodecError:
+            raise InternalError("Failed to serialize batch data")
 
-            batch_strs.append(batch_str)
-            print(batch_strs)
-        print(batch_strs)
-        return "|".join(sorted(batch_strs)).encode()
-
-
-
-
-
-
-
-
-
-
-
-
+    def _deserialize_index(self, data):
+        """
+        decode an index entry into a {key: set of names} dict, or a
+        location index entry into a {name: (latitude, longitude)} dict
+        """
+        self._stats['decodes'] += 1
+        start = time.perf_counter()
+        try:
+            if data and data[0] == GEO_INDEX_FORMAT_V1:
+                return decode_geo_index(data)
+            return {
+                key: set(names) for key, names in decode_index(data).items()
+            }
+        except CodecError:
+            raise InternalError("Failed to deserialize index data")
+        finally:
+            self._timings.add('deserialize', time.perf_counter() - start)
+
+    def _serialize_index(self, address, index):
+        self._stats['encodes'] += 1
+        try:
+            if address.startswith(INDEX_PREFIXES[INDEX_LOCATION]):
+                return encode_geo_index(index)
+            return encode_index(
+                {key: names for key, names in index.items() if names})
+        except CodecError:
+            raise InternalError("Failed to serialize index data")
+
+
+def _location(harvestbatch):
+    """
+    :return: (latitude, longitude) of a batch, None without a position
+    """
+    if valid_position(harvestbatch.latitude, harvestbatch.longitude):
+        return harvestbatch.latitude, harvestbatch.longitude
+    return None
@@ -2,22 +2,64 @@
 import sys
 import os
 import argparse
+import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
+import time
 import pkg_resources
 
 from sawtooth_sdk.processor.core import TransactionProcessor
 from handler import HelloTransactionHandler
-
-sys.path.append('../')
+from helloLogging import setup_logging
+from helloMetrics import start_http_server
+from helloMetrics import start_periodic_dump
 
 DISTRIBUTION_NAME = 'sawtooth-hellotxp'
 
+# In docker, the url would be the validator's container name with
+# port 4004
+DEFAULT_URL = 'tcp://127.0.0.1:4004'
+
+# Seconds before a crashed worker is restarted, doubled for every crash in
+# a row up to MAX_RESTART_DELAY. A worker that ran for STABLE_RUN_TIME
+# seconds starts over at RESTART_DELAY.
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 30
+STABLE_RUN_TIME = 60
+
+# Seconds workers get to unregister from the validator on shutdown.
+SHUTDOWN_TIMEOUT = 10
+
+LOGGER = logging.getLogger(__name__)
+
 def parse_args(args):
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawTextHelpFormatter)
 
     parser.add_argument(
         '-C', '--connect',
-        help='Endpoint for the validator connection')
+        help='Endpoint for the validator connection, default {}'.format(
+            DEFAULT_URL))
+
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=1,
+        help='Number of transaction processor processes to run. Each one\n'
+             'registers with the validator for the hellotxp family, so\n'
+             'independent transactions are applied on several cores')
+
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        help='Serve Prometheus metrics on this port at /metrics. With\n'
+             '--workers N, worker i listens on this port + i')
+
+    parser.add_argument(
+        '--metrics-interval',
+        type=float,
+        help='Log all metrics at info level every this many seconds')
 
     parser.add_argument('-v', '--verbose',
                         action='count',
@@ -41,19 +83,144 @@ def parse_args(args):
 
 
 
-def main():
-    # In docker, the url would be the validator's container name with
-    # port 4004
-    print("i started")
-    print("processor becomes txp on localhost")
-    processor = TransactionProcessor(url='tcp://127.0.0.1:4004')
+def start_metrics(port=None, interval=None):
+    """
+    export the metrics of this process over http on port and/or as log
+    dumps every interval seconds
+    """
+    if port is not None:
+        start_http_server(port)
+    if interval:
+        start_periodic_dump(interval)
+
+
+def run_processor(url):
+    """
+    register a hellotxp transaction processor with the validator at url
+    and serve transactions until interrupted
+    """
+    processor = TransactionProcessor(url=url)
     handler = HelloTransactionHandler()
-    print("handler has gotten a value")
     processor.add_handler(handler)
-    print("procesor.add_handler(handler)done")
-    print("connected with validator")
-    processor.start()
-    print("i got to the end")
+    LOGGER.info('Starting hellotxp transaction processor on %s', url)
+    try:
+        # start() unregisters from the validator on KeyboardInterrupt
+        processor.start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        processor.stop()
+    LOGGER.info('hellotxp transaction processor stopped')
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def _run_worker(index, url, opts):
+    # the worker's copy of the parent's log queue has no listener
+    listener = setup_logging(opts.verbose)
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        port = opts.metrics_port
+        start_metrics(
+            None if port is None else port + index, opts.metrics_interval)
+        run_processor(url)
+    finally:
+        # worker processes skip atexit handlers, flush the log queue here
+        listener.stop()
+
+
+def _start_worker(index, url, opts):
+    process = multiprocessing.Process(
+        target=_run_worker,
+        args=(index, url, opts),
+        name='hellotxp-worker-{}'.format(index))
+    process.start()
+    LOGGER.info('Started worker %d (pid %d)', index, process.pid)
+    return process
+
+
+def _stop_workers(workers):
+    for process in workers.values():
+        if process is not None and process.is_alive():
+            process.terminate()
+
+    deadline = time.time() + SHUTDOWN_TIMEOUT
+    for index, process in workers.items():
+        if process is None:
+            continue
+        process.join(max(0, deadline - time.time()))
+        if process.is_alive():
+            LOGGER.warning('Worker %d did not stop, killing it', index)
+            process.kill()
+            process.join()
+
+
+def supervise(url, worker_count, opts):
+    """
+    run worker_count transaction processor processes and restart any that
+    exit, until SIGINT or SIGTERM stops them all
+    :param opts: parsed command line options, passed on to the workers
+    """
+    workers = {}
+    started = {}
+    delays = {}
+    restart_at = {}
+
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        for index in range(worker_count):
+            workers[index] = _start_worker(index, url, opts)
+            started[index] = time.time()
+            delays[index] = RESTART_DELAY
+
+        while True:
+            now = time.time()
+            for index, when in list(restart_at.items()):
+                if when <= now:
+                    del restart_at[index]
+                    workers[index] = _start_worker(index, url, opts)
+                    started[index] = now
+
+            running = [p.sentinel for p in workers.values() if p is not None]
+            timeout = min([1] + [when - now for when in restart_at.values()])
+            multiprocessing.connection.wait(running, timeout=max(0, timeout))
+
+            now = time.time()
+            for index, process in workers.items():
+                if process is None or process.is_alive():
+                    continue
+
+                if now - started[index] >= STABLE_RUN_TIME:
+                    delays[index] = RESTART_DELAY
+                LOGGER.warning(
+                    'Worker %d exited with code %s, restarting in %ss',
+                    index, process.exitcode, delays[index])
+                restart_at[index] = now + delays[index]
+                delays[index] = min(delays[index] * 2, MAX_RESTART_DELAY)
+                workers[index] = None
+    except KeyboardInterrupt:
+        LOGGER.info('Stopping %d workers', worker_count)
+    finally:
+        _stop_workers(workers)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+    setup_logging(opts.verbose)
+
+    url = opts.connect or DEFAULT_URL
+    if opts.workers < 1:
+        raise SystemExit('--workers must be at least 1')
+
+    if opts.workers == 1:
+        start_metrics(opts.metrics_port, opts.metrics_interval)
+        run_processor(url)
+    else:
+        supervise(url, opts.workers, opts)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()